@@ -0,0 +1,87 @@
+import asyncio
+
+from midiconnection import MidiConnection, MidiException
+
+class AsyncMidiConnection(object):
+    """ asyncio interface of a MidiConnection.
+        Answers are handed from the MIDI input thread to the event loop
+        through the Futures of the MidiConnection, no polling is involved. """
+
+    def __init__(self, midi=None):
+        self.midi = midi if midi is not None else MidiConnection()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.disconnect()
+
+    @property
+    def read_connected(self):
+        return self.midi.read_connected
+
+    @property
+    def write_connected(self):
+        return self.midi.write_connected
+
+    def connect(self, in_name=None, out_name=None):
+        return self.midi.connect(in_name, out_name)
+
+    def connect_write(self, out_name):
+        return self.midi.connect_write(out_name)
+
+    def connect_read(self, in_name=None):
+        return self.midi.connect_read(in_name)
+
+    def disconnect(self):
+        self.midi.disconnect()
+
+    def write(self, data):
+        """ Sends a MIDI message. """
+        self.midi.write(data)
+
+    def try_read(self, message_class=None):
+        return self.midi.try_read(message_class)
+
+    async def wait(self, future, timeout=5):
+        """ Waits for an answer registered with MidiConnection.expect(). """
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.midi.cancel(future, True)
+            raise MidiException("Timeout while waiting for answer from MIDI device.")
+
+    async def collect(self, future, timeout):
+        """ Awaitable version of MidiConnection.collect(). """
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            self.midi.cancel(future)
+            return None if future.cancelled() else future.result()
+
+    async def run(self, steps):
+        """ Awaitable version of MidiConnection.run(). """
+        try:
+            future, timeout = next(steps)
+            while True:
+                if future is None:
+                    await asyncio.sleep(timeout)
+                    answer = None
+                else:
+                    answer = await self.collect(future, timeout)
+                future, timeout = steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
+
+    async def sysex_communicate(self, message_data, match=None, timeout=5):
+        """ Sends a sysex question and waits for the answer.
+            See MidiConnection.expect() for the meaning of 'match'. """
+        if message_data[0] != 0xF0 or message_data[-1] != 0xF7:
+            raise MidiException("Invalid sysex data")
+        future = self.midi.expect(match, message_data)
+        try:
+            self.midi.write(message_data)
+        except:
+            self.midi.cancel(future)
+            raise
+        return await self.wait(future, timeout)
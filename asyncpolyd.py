@@ -0,0 +1,82 @@
+import contextlib
+
+from polyd import PolyD
+
+def _requests(name):
+    steps = getattr(PolyD, name).steps
+    async def method(self, *args, **kwargs):
+        return await self.midi.run(steps(self.polyd, *args, **kwargs))
+    method.__name__ = name
+    method.__doc__ = f"Awaitable version of PolyD.{name}()."
+    return method
+
+class AsyncPolyD:
+    """ asyncio interface of a Poly D connected through an AsyncMidiConnection.
+        The requests are the ones of a PolyD object that shares the MIDI
+        connection, its state mirror and its pacer; they are only awaited
+        on the event loop instead of blocking. Every task has its own
+        transaction. """
+
+    def __init__(self, midi, pacer=None, policies=None):
+        self.midi = midi
+        self.polyd = PolyD(midi.midi, pacer, policies)
+
+    @property
+    def state(self):
+        return self.polyd.state
+
+    @property
+    def pacer(self):
+        return self.polyd.pacer
+
+    @property
+    def policies(self):
+        return self.polyd.policies
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """ Awaitable version of PolyD.transaction(). """
+        if self.polyd.in_transaction:
+            yield self
+            return
+        with self.polyd.collect_settings() as (changes, names):
+            yield self
+        await self.write_settings(changes, names)
+
+    get_version = _requests('get_version')
+    get_config = _requests('get_config')
+    refresh = _requests('refresh')
+    read_settings = _requests('read_settings')
+    get_pattern = _requests('get_pattern')
+    get_patterns = _requests('get_patterns')
+    send_config_sysex = _requests('send_config_sysex')
+    send_pattern_sysex = _requests('send_pattern_sysex')
+    send_patterns = _requests('send_patterns')
+    write_settings = _requests('write_settings')
+    factory_restore = _requests('factory_restore')
+
+    set_id = _requests('set_id')
+    set_rx_channel = _requests('set_rx_channel')
+    set_tx_channel = _requests('set_tx_channel')
+    set_in_transpose = _requests('set_in_transpose')
+    set_velocity_on = _requests('set_velocity_on')
+    set_velocity_off = _requests('set_velocity_off')
+    set_velocity_curve = _requests('set_velocity_curve')
+    set_key_priority = _requests('set_key_priority')
+    set_multi_trig = _requests('set_multi_trig')
+    set_pbend_range = _requests('set_pbend_range')
+    set_mod_range = _requests('set_mod_range')
+    set_mod_curve = _requests('set_mod_curve')
+    set_note_zero = _requests('set_note_zero')
+    set_sync_rate = _requests('set_sync_rate')
+    set_sync_source = _requests('set_sync_source')
+    set_local_mode = _requests('set_local_mode')
+    set_ext_clock_polarity = _requests('set_ext_clock_polarity')
+    set_accent_velocity = _requests('set_accent_velocity')
+    set_clock_out = _requests('set_clock_out')
+    set_pbend_out = _requests('set_pbend_out')
+    set_mod_out = _requests('set_mod_out')
+    set_key_out = _requests('set_key_out')
+    set_at_out = _requests('set_at_out')
+    set_seq_out = _requests('set_seq_out')
+    set_arp_out = _requests('set_arp_out')
@@ -0,0 +1,131 @@
+import os
+
+class RtMidiPort:
+    """ Input or output port of the RtMidiBackend. Messages are passed as bytes. """
+
+    def __init__(self, rt, callback=None):
+        self.__rt = rt
+        self.__callback = callback
+        self.__sysex = None
+        if callback is not None:
+            # Like mido: receive sysex and clock, ignore active sensing
+            rt.ignore_types(sysex=False, timing=False, active_sense=True)
+            rt.set_callback(self.__receive)
+
+    def send(self, data):
+        self.__rt.send_message(data)
+
+    def panic(self):
+        # All sound off on every channel
+        for channel in range(16):
+            self.__rt.send_message(bytes((0xB0 | channel, 120, 0)))
+
+    def reset(self):
+        # All notes off and reset all controllers on every channel
+        for channel in range(16):
+            self.__rt.send_message(bytes((0xB0 | channel, 123, 0)))
+            self.__rt.send_message(bytes((0xB0 | channel, 121, 0)))
+
+    def close(self):
+        if self.__callback is not None:
+            self.__rt.cancel_callback()
+        else:
+            self.reset()
+        self.__rt.close_port()
+        self.__rt.delete()
+
+    def __receive(self, event, data=None):
+        message = event[0]
+        # Long sysex messages may be delivered in several parts.
+        if self.__sysex is not None:
+            self.__sysex.extend(message)
+            if message[-1] != 0xF7:
+                return
+            message, self.__sysex = self.__sysex, None
+        elif message[0] == 0xF0 and message[-1] != 0xF7:
+            self.__sysex = bytearray(message)
+            return
+        self.__callback(bytes(message))
+
+class RtMidiBackend:
+    """ Sends and receives plain bytes through python-rtmidi. """
+
+    def __init__(self):
+        import rtmidi
+        self.__rtmidi = rtmidi
+
+    def get_input_names(self):
+        return self.__rtmidi.MidiIn().get_ports()
+
+    def get_output_names(self):
+        return self.__rtmidi.MidiOut().get_ports()
+
+    def open_input(self, name=None, callback=None):
+        return RtMidiPort(self.__open(self.__rtmidi.MidiIn(), name), callback)
+
+    def open_output(self, name=None):
+        return RtMidiPort(self.__open(self.__rtmidi.MidiOut(), name))
+
+    @staticmethod
+    def __open(rt, name):
+        ports = rt.get_ports()
+        if name is None and ports:
+            name = ports[0]
+        if name not in ports:
+            raise IOError(f"Unknown port '{name}'")
+        rt.open_port(ports.index(name))
+        return rt
+
+class MidoPort:
+    """ Output port of the MidoBackend. """
+
+    def __init__(self, mido, port):
+        self.__mido = mido
+        self.__port = port
+
+    def send(self, data):
+        self.__port.send(self.__mido.Message.from_bytes(data))
+
+    def panic(self):
+        self.__port.panic()
+
+    def close(self):
+        self.__port.close()
+
+class MidoBackend:
+    """ Sends and receives bytes through the mido module. Every message
+        is converted from and to a mido message. """
+
+    def __init__(self):
+        import mido
+        self.__mido = mido
+
+    def get_input_names(self):
+        return self.__mido.get_input_names()
+
+    def get_output_names(self):
+        return self.__mido.get_output_names()
+
+    def open_input(self, name=None, callback=None):
+        return self.__mido.open_input(name=name, callback=lambda msg: callback(bytes(msg.bytes())))
+
+    def open_output(self, name=None):
+        return MidoPort(self.__mido, self.__mido.open_output(name=name, autoreset=True))
+
+BACKENDS = {
+    'rtmidi': RtMidiBackend,
+    'mido': MidoBackend,
+}
+
+_default_backend = None
+
+def default_backend():
+    """ Returns the backend selected by the environment variable
+        POLYD_MIDI_BACKEND ('rtmidi' or 'mido', default 'rtmidi'). """
+    global _default_backend
+    if _default_backend is None:
+        name = os.environ.get('POLYD_MIDI_BACKEND', 'rtmidi')
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown MIDI backend '{name}'")
+        _default_backend = BACKENDS[name]()
+    return _default_backend
@@ -1,16 +1,40 @@
+import collections
+import itertools
 import os
 import re
-import queue
+import threading
+import time
 
-import mido
+import midibackend
+import midiports
 
 class MidiException(Exception):
     def __init__(self, message):
         self.message = message
 
 class MidiConnection(object):
-    def __init__(self):
-        self.__queue = queue.Queue()
+    # Classes of received messages. Every class is kept in its own buffer,
+    # so a flood of clock or note messages cannot push out sysex answers.
+    SYSEX = 'sysex'
+    CHANNEL = 'channel'
+    COMMON = 'common'
+    REALTIME = 'realtime'
+    BUFFER_SIZES = { SYSEX: 100, CHANNEL: 100, COMMON: 16, REALTIME: 16 }
+
+    def __init__(self, backend=None):
+        """ 'backend' opens the ports, see midibackend.py. All messages are
+            passed as bytes. By default midibackend.default_backend() is used. """
+        self.__backend = backend if backend is not None else midibackend.default_backend()
+        self.__buffers = { c: collections.deque(maxlen=size) for c, size in self.BUFFER_SIZES.items() }
+        self.__overflows = { c: 0 for c in self.BUFFER_SIZES }
+        self.__received = threading.Condition()
+        self.__sequence = itertools.count()
+        self.__sysex_prefix = None
+        self.__classes = None
+        # Collects the traffic, latencies and timeouts if set, see polyd_stats.py
+        self.stats = None
+        self.__pending = []
+        self.__pending_lock = threading.Lock()
         self.__input = None
         self.__output = None
         self.read_connected = False
@@ -22,24 +46,19 @@ class MidiConnection(object):
     def __exit__(self, type, value, traceback):
         self.disconnect()
 
-    @staticmethod
-    def __get_device_names(names):
-        result = set()
-        for name in names:
-            result.add(name)
-        return sorted(result, key=lambda x: x.lower())
+    # The port names are enumerated once, see midiports.py
 
     @staticmethod
     def get_ids():
-        return MidiConnection.__get_device_names(mido.get_input_names() + mido.get_output_names())
+        return midiports.default_registry().ids
 
     @staticmethod
     def get_input_ids():
-        return MidiConnection.__get_device_names(mido.get_input_names())
+        return midiports.default_registry().inputs
 
     @staticmethod
     def get_output_ids():
-        return MidiConnection.__get_device_names(mido.get_output_names())
+        return midiports.default_registry().outputs
 
     def connect(self, in_name=None, out_name=None, callback=None):
         self.connect_write(out_name)
@@ -49,14 +68,14 @@ class MidiConnection(object):
     def connect_write(self, out_name):
         if self.write_connected:
             self.disconnect_write()
-        self.__output = mido.open_output(name=out_name, autoreset=True)
+        self.__output = self.__backend.open_output(out_name)
         self.write_connected = True
         return self.write_connected
 
     def connect_read(self, in_name=None):
         if self.read_connected:
             self.disconnect_read()
-        self.__input = mido.open_input(name=in_name, callback=self.__input_callback)
+        self.__input = self.__backend.open_input(in_name, self.__input_callback)
         self.read_connected = True
         return self.read_connected
 
@@ -78,48 +97,197 @@ class MidiConnection(object):
 
     def write_short(self, *args):
         """ Sends a MIDI message. """
-        self.__output.send(mido.Message.from_bytes(args))
+        self.write(bytes(args))
 
     def write(self, data):
         """ Sends a MIDI message. """
-        msg = mido.Message.from_bytes(data)
-        self.__output.send(msg)
+        self.__output.send(data)
+        if self.stats is not None:
+            self.stats.sent(data)
 
-    def read(self):
-        """ Reads the oldest MIDI message from the queue. 
-            After 5 seconds an Empty"""
-        try:
-            return self.__queue.get(timeout=5)
-        except:
-            raise MidiException("Timeout while waiting for answer from MIDI device.")
+    def read(self, timeout=5, message_class=None):
+        """ Reads the bytes of the oldest MIDI message from the buffers, or
+            from the buffer of 'message_class' only.
+            After 'timeout' seconds a MidiException is raised."""
+        with self.__received:
+            if not self.__received.wait_for(lambda: self.__oldest(message_class) is not None, timeout):
+                raise MidiException("Timeout while waiting for answer from MIDI device.")
+            return self.__oldest(message_class).popleft()[1]
+
+    def try_read(self, message_class=None):
+        """ Like read(), but returns None if no message was received. """
+        with self.__received:
+            buffer = self.__oldest(message_class)
+            return None if buffer is None else buffer.popleft()[1]
 
-    def try_read(self):
-        if self.__queue.empty():
-            return None
-        return self.__queue.get()
+    def set_input_filter(self, sysex_prefix=None, message_classes=None):
+        """ Only received messages of the given classes are kept, and only
+            sysex messages that start with 'sysex_prefix'. None accepts
+            everything. The filter is applied before answers are matched. """
+        self.__sysex_prefix = None if sysex_prefix is None else bytes(sysex_prefix)
+        self.__classes = None if message_classes is None else frozenset(message_classes)
+
+    @property
+    def overflows(self):
+        """ Number of messages per class that were dropped because the
+            buffer of the class was full. """
+        with self.__received:
+            return dict(self.__overflows)
+
+    @classmethod
+    def message_class(cls, data):
+        status = data[0]
+        if status == 0xF0:
+            return cls.SYSEX
+        if status >= 0xF8:
+            return cls.REALTIME
+        if status > 0xF0:
+            return cls.COMMON
+        return cls.CHANNEL
 
     def send_sysex(self, filename):
         """ Sends the contents of a sysex file. """
         if not os.path.isfile(filename):
             return
-        for message in mido.read_syx_file(filename):
-            self.__output.send(message)
+        with open(filename, "rb") as fp:
+            data = fp.read()
+        for sysex in re.findall(rb'\xF0[^\xF0\xF7]*\xF7', data):
+            self.write(sysex)
+
+    def expect(self, match=None, request=None):
+        """ Registers an expected sysex answer and returns a Future that is
+            completed with its bytes. 'match' is called with the bytes of every
+            received sysex and returns True for the expected answer. Without
+            'match' the next sysex is taken. Sysex messages that no request
+            expects are buffered for read() and try_read(). 'request' are
+            the bytes of the question; the answer time is recorded for its
+            command in 'stats'. """
+        # concurrent.futures takes longer to import than the rest of the
+        # module, it is loaded when the first answer is expected.
+        from concurrent.futures import Future
+        future = Future()
+        with self.__pending_lock:
+            self.__pending.append((match, future, request, time.monotonic()))
+        return future
+
+    def cancel(self, future, timed_out=False):
+        """ Removes an expected answer that is no longer waited for.
+            'timed_out' counts a timeout for the request in 'stats'. """
+        with self.__pending_lock:
+            removed = [ p for p in self.__pending if p[1] is future ]
+            self.__pending = [ p for p in self.__pending if p[1] is not future ]
+            future.cancel()
+        if timed_out and self.stats is not None:
+            for _, _, request, _ in removed:
+                self.stats.timed_out(self.stats.command(request or b''))
+
+    def wait(self, future, timeout=5):
+        """ Waits for an expected answer. After 'timeout' seconds
+            a MidiException is raised. """
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.cancel(future, True)
+            raise MidiException("Timeout while waiting for answer from MIDI device.")
+
+    def collect(self, future, timeout):
+        """ Waits up to 'timeout' seconds for an answer that is not always
+            sent, like the error answer of a pattern write. Returns None if
+            nothing was received. """
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.cancel(future)
+            # The answer may have arrived in the meantime
+            return None if future.cancelled() else future.result()
 
-    def sysex_communicate(self, message_data):
-        """ Sends a sysex question and waits for the answer. """
+    def run(self, steps):
+        """ Runs the requests of a generator and returns its result. The
+            generator yields (future, timeout) to wait for an answer with
+            collect(), which is sent back into it, and (None, timeout) to
+            sleep. AsyncMidiConnection.run() executes the same generators. """
+        try:
+            future, timeout = next(steps)
+            while True:
+                if future is None:
+                    time.sleep(timeout)
+                    answer = None
+                else:
+                    answer = self.collect(future, timeout)
+                future, timeout = steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
+
+    def sysex_communicate(self, message_data, match=None, timeout=5):
+        """ Sends a sysex question and waits for the answer.
+            See expect() for the meaning of 'match'. """
         if message_data[0] != 0xF0 or message_data[-1] != 0xF7:
             raise MidiException("Invalid sysex data")
-        self.write(message_data)
-        while True:
-            msg = self.read()
-            if msg.type == 'sysex':
-                return msg
+        future = self.expect(match, message_data)
+        try:
+            self.write(message_data)
+        except:
+            self.cancel(future)
+            raise
+        return self.wait(future, timeout)
     
     def panic(self):
         self.__output.panic()
 
-    def __input_callback(self, msg):
-        #print(msg)
-        self.__queue.put(msg)
-        while self.__queue.qsize() > 100:
-            self.__queue.get()
+    def __input_callback(self, data):
+        if not data:
+            return
+        stats = self.stats
+        message_class = self.message_class(data)
+        if (self.__classes is not None and message_class not in self.__classes) or \
+           (message_class == self.SYSEX and self.__sysex_prefix is not None and
+            not data.startswith(self.__sysex_prefix)):
+            if stats is not None:
+                stats.received(data)
+                stats.dropped_message(message_class)
+            return
+        if message_class == self.SYSEX and self.__complete_request(data):
+            return
+        if stats is not None:
+            stats.received(data)
+        with self.__received:
+            buffer = self.__buffers[message_class]
+            if len(buffer) == buffer.maxlen:
+                self.__overflows[message_class] += 1
+                if stats is not None:
+                    stats.dropped_message(message_class)
+            buffer.append((next(self.__sequence), data))
+            self.__received.notify_all()
+
+    def __oldest(self, message_class):
+        # Returns the non-empty buffer with the oldest message or None
+        if message_class is not None:
+            buffer = self.__buffers[message_class]
+            return buffer if buffer else None
+        buffers = [ b for b in self.__buffers.values() if b ]
+        return min(buffers, key=lambda b: b[0][0], default=None)
+
+    def __complete_request(self, data):
+        # The Future is completed under the lock, so cancel() cannot
+        # cancel it between being removed and getting its result.
+        with self.__pending_lock:
+            self.__pending = [ p for p in self.__pending if not p[1].done() ]
+            for i, (match, future, request, start) in enumerate(self.__pending):
+                if match is None or match(data):
+                    del self.__pending[i]
+                    future.set_result(data)
+                    break
+            else:
+                return False
+        stats = self.stats
+        if stats is not None:
+            if request is None:
+                stats.received(data)
+            else:
+                # The answer is counted for the request, a result does not
+                # name the command it answers.
+                stats.received(data, stats.command(request))
+                stats.answered(stats.command(request), time.monotonic() - start)
+        return True
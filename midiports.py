@@ -0,0 +1,114 @@
+import threading
+
+import midibackend
+from delegate import Delegate
+
+class MidiPortRegistry:
+    """ Cached names of the MIDI input and output ports.
+        The ports are enumerated once and only again by refresh() or by the
+        hotplug watcher. The watcher fires 'added' and 'removed' with the
+        input and output port name of every instrument that appears or
+        disappears. The events are called from the watcher thread. """
+
+    def __init__(self, backend=None):
+        self.__backend = backend
+        self.__lock = threading.Lock()
+        self.__inputs = None
+        self.__outputs = None
+        self.__watcher = None
+        self.__stop = threading.Event()
+        self.added = Delegate()
+        self.removed = Delegate()
+
+    def refresh(self):
+        """ Enumerates the ports again. """
+        backend = self.__backend if self.__backend is not None else midibackend.default_backend()
+        inputs = self.__sorted(backend.get_input_names())
+        outputs = self.__sorted(backend.get_output_names())
+        with self.__lock:
+            self.__inputs = inputs
+            self.__outputs = outputs
+
+    @property
+    def inputs(self):
+        return list(self.__load()[0])
+
+    @property
+    def outputs(self):
+        return list(self.__load()[1])
+
+    @property
+    def ids(self):
+        inputs, outputs = self.__load()
+        return self.__sorted(inputs + outputs)
+
+    def pairs(self, name_part=''):
+        """ Returns (input, output) name pairs of the ports whose names contain
+            'name_part'. Ports with identical names belong together, the others
+            are paired in order. """
+        inputs, outputs = self.__load()
+        inputs = [ n for n in inputs if name_part in n ]
+        outputs = [ n for n in outputs if name_part in n ]
+        pairs = [ (n, n) for n in inputs if n in outputs ]
+        paired = set(n for n, _ in pairs)
+        pairs.extend(zip([ n for n in inputs if n not in paired ],
+                         [ n for n in outputs if n not in paired ]))
+        return pairs
+
+    def first_pair(self, name_part=''):
+        """ Returns the first pair of pairs() or (None, None). """
+        return next(iter(self.pairs(name_part)), (None, None))
+
+    def watch(self, name_part='', interval=1.0):
+        """ Starts a thread that enumerates the ports every 'interval' seconds
+            and fires the events for the pairs whose names contain 'name_part'. """
+        if self.__watcher is not None:
+            return
+        self.__stop.clear()
+        self.__watcher = threading.Thread(target=self.__watch, args=(name_part, interval), daemon=True)
+        self.__watcher.start()
+
+    def stop_watching(self):
+        if self.__watcher is None:
+            return
+        self.__stop.set()
+        if self.__watcher is not threading.current_thread():
+            self.__watcher.join()
+        self.__watcher = None
+
+    def __watch(self, name_part, interval):
+        known = self.pairs(name_part)
+        while not self.__stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                continue    # Enumeration can fail while a device is plugged in.
+            current = self.pairs(name_part)
+            for pair in known:
+                if pair not in current:
+                    self.removed(*pair)
+            for pair in current:
+                if pair not in known:
+                    self.added(*pair)
+            known = current
+
+    def __load(self):
+        # Returns the input and output names, they are enumerated only once
+        if self.__inputs is None:
+            self.refresh()
+        with self.__lock:
+            return (self.__inputs, self.__outputs)
+
+    @staticmethod
+    def __sorted(names):
+        return sorted(set(names), key=lambda x: x.lower())
+
+_default_registry = None
+
+def default_registry():
+    """ Returns the registry of the default backend, which is shared by the
+        whole program. """
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = MidiPortRegistry()
+    return _default_registry
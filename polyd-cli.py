@@ -1,14 +1,22 @@
 #! /usr/bin/env python
 
 import argparse
+import contextlib
+import json
+import os
+import re
 import sys
-import zipfile
+import time
+
+import midiports
 
 from midiconnection import MidiConnection, MidiException
 from polyd_cmd import PolyD_Cmd
 from polyd_exc import PolyD_Exception, PolyD_InvalidArgumentException
 from polyd_config import PolyD_Config
 from polyd import PolyD 
+from polyd_pacing import PolyD_Pacer
+from polyd_pattern import PolyD_Pattern
 
 NAME = 'polyd-cli'
 VERSION = 1.5
@@ -16,19 +24,30 @@ VERSION = 1.5
 CONFIGNAME = "config.syx"
 CONFIGSIZE = 35
 
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "polyd-cli")
+PACING_FILE = os.path.join(CONFIG_DIR, "pacing.json")
+LIBRARY_FILE = os.path.join(CONFIG_DIR, "library.sqlite")
+SNAPSHOT_DIR = os.path.join(CONFIG_DIR, "snapshots")
+
 def get_range_string(values):
     text = ", ".join([f"\'{v}\'" for v in values])
     text += f" or 0-{len(values)}"
     return text
 
-def first_or_default(arr, pred):
-    return next(iter([x for x in arr if pred(x)]), None)
+def find_polyd_ports(port, backend=None):
+    # Pair the input and output ports of all matching instruments
+    registry = midiports.default_registry() if backend is None else midiports.MidiPortRegistry(backend)
+    return registry.pairs(port)
 
-def is_polyd(searched_name, port_name):
-    return searched_name in port_name
+def is_supported(version):
+    return not (version[0] != 1 and version[1] != 1 and version[1] <= 3)
+
+def device_archive_name(port_name, device_id):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', port_name).strip('_')
+    return f"{name}-id{device_id}.zip"
 
 def pattern_name(bank, pattern):
-    return f"b{bank}p{pattern}.seq"
+    return PolyD_Cmd.slot_name(bank, pattern) + ".seq"
 
 
 def save_single_pattern(polyd, filename, bank, pattern):
@@ -44,31 +63,92 @@ def save_config(polyd, filename):
     with open(filename, "wb") as fp:
         fp.write(config.sysex)
 
-def save_all(polyd, filename):
-    # Write a zip file with the configuration and all patterns
+def all_slots():
+    return [(bank, pattern) for bank in range(1, 9) for pattern in range(1, 9)]
+
+def slot_names(slots):
+    return ", ".join(PolyD_Cmd.slot_name(bank, pattern) for bank, pattern in sorted(slots))
+
+def parse_slot(name):
+    bank, pattern = PolyD_Cmd.parse_slot(str(name))
+    if bank is None:
+        raise PolyD_InvalidArgumentException(f"Invalid slot '{name}', expected e.g. 'b1p2'")
+    return (bank, pattern)
+
+def save_all(polyd, filename, window=1):
+    # Write a zip file with the configuration and all patterns.
+    # Patterns that could not be read are left out and returned.
+    import zipfile
     with zipfile.ZipFile(filename, "w") as zip:
         config = polyd.get_config()
         zip.writestr(CONFIGNAME, config.sysex)
 
-        for bank in range(1, 9):
-            for pattern in range(1,9):
-                sysex = polyd.get_pattern(bank, pattern)
-                seq = PolyD_Cmd.syx2seq(sysex)
-                zip.writestr(pattern_name(bank, pattern), seq)
+        patterns = polyd.get_patterns(all_slots(), window, skip_failed=True)
+        for (bank, pattern), sysex in patterns.items():
+            seq = PolyD_Cmd.syx2seq(sysex)
+            zip.writestr(pattern_name(bank, pattern), seq)
+    return [ slot for slot in all_slots() if slot not in patterns ]
 
-def save(polyd, filename, config_only, patterns_only, bank, pattern):
+def save(polyd, filename, config_only, patterns_only, bank, pattern, window=1):
     if bank is not None and pattern is not None:
         save_single_pattern(polyd, filename, bank, pattern)
     elif config_only:
         save_config(polyd, filename)
     else:
-        save_all(polyd, filename)
+        failed = save_all(polyd, filename, window)
+        if failed:
+            print(f"Error: Could not read {len(failed)} patterns: {slot_names(failed)}")
+        return failed
+    return []
+
+def backup_device(in_id, out_id, directory, window, stats=None, backend=None):
+    # Save all patterns and the configuration of one instrument
+    with MidiConnection(backend) as midi:
+        midi.stats = stats
+        if not midi.connect_write(out_id) or not midi.connect_read(in_id):
+            raise PolyD_Exception(f"Could not connect to MIDI device {in_id}.")
+        polyd = PolyD(midi)
+        version = polyd.get_version()
+        if not is_supported(version):
+            raise PolyD_Exception(f"Unsupported firmware {'.'.join([str(v) for v in version])}")
+        config = polyd.get_config()
+        filename = os.path.join(directory, device_archive_name(in_id, config.device_id))
+        return (filename, save_all(polyd, filename, window))
+
+def backup_all_devices(port, directory, window, stats=None, backend=None):
+    # Save every connected instrument concurrently, one archive per instrument.
+    # A device that fails does not stop the others.
+    import concurrent.futures
+    ports = find_polyd_ports(port, backend)
+    if len(ports) == 0:
+        print("No Poly D found.")
+        return False
+    os.makedirs(directory, exist_ok=True)
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        futures = { executor.submit(backup_device, in_id, out_id, directory, window, stats, backend): in_id
+                        for in_id, out_id in ports }
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            name = futures[future]
+            try:
+                filename, failed_slots = future.result()
+                print(f"[{done}/{len(ports)}] {name}: saved {filename}")
+                if failed_slots:
+                    failed += 1
+                    print(f"[{done}/{len(ports)}] {name}: Error: Could not read patterns {slot_names(failed_slots)}")
+            except Exception as exc:
+                # The backends raise their own errors when a port is gone
+                failed += 1
+                print(f"[{done}/{len(ports)}] {name}: Error: {getattr(exc, 'message', None) or str(exc) or type(exc).__name__}")
+    print(f"Saved {len(ports) - failed} of {len(ports)} devices, {failed} failed.")
+    return failed == 0
 
 def restore_pattern_sysex(polyd, sysex, bank, pattern):
+    sysex = bytearray(sysex)
     if bank is not None:
         sysex[9] = bank - 1
     if pattern is not None:
-        sysex[10] = pattern - 2
+        sysex[10] = pattern - 1
     polyd.send_pattern_sysex(sysex)
 
 def restore_seq(polyd, seq, bank, pattern):
@@ -77,23 +157,79 @@ def restore_seq(polyd, seq, bank, pattern):
     sysex = PolyD_Cmd.seq2syx(0, bank, pattern, seq)
     polyd.send_pattern_sysex(sysex)
 
-def restore_zip(polyd, filename, config_only, patterns_only):
+def changed_slots(polyd, seqs, window=1):
+    # Compare the patterns with the ones on the Poly D and return the
+    # slots whose content differs or could not be read. The patterns are
+    # read again, because they may have been edited on the instrument.
+    current = polyd.get_patterns(seqs.keys(), window, skip_failed=True, cached=False)
+    changed = []
+    for slot, seq in seqs.items():
+        if slot not in current:
+            changed.append(slot)
+            continue
+        new_data = PolyD_Cmd.extract_pattern_from_seq(seq)
+        old_data = PolyD_Cmd.extract_pattern_from_syx(current[slot])
+        if PolyD_Cmd.calc_pattern_checksum(new_data) != PolyD_Cmd.calc_pattern_checksum(old_data) or \
+           PolyD_Cmd.calc_pattern_hash(new_data) != PolyD_Cmd.calc_pattern_hash(old_data):
+            changed.append(slot)
+    return changed
+
+def restore_patterns(polyd, seqs, diff=False, window=1):
+    # Restore the patterns in 'seqs', which maps (bank, pattern) to seq data
+    slots = sorted(seqs.keys())
+    if diff:
+        sys.stdout.write("Comparing patterns       \r")
+        sys.stdout.flush()
+        slots = changed_slots(polyd, seqs, window)
+    sys.stdout.write(f"Restoring {len(slots)} patterns     \r")
+    sys.stdout.flush()
+    sysexes = [ PolyD_Cmd.seq2syx(0, bank, pattern, seqs[(bank, pattern)]) for bank, pattern in slots ]
+    try:
+        failed = polyd.send_patterns(sysexes)
+    except MidiException:
+        failed = slots
+    if diff:
+        print(f"Skipped {len(seqs) - len(slots)} of {len(seqs)} unchanged patterns.")
+    if failed:
+        print(f"Error: Could not restore {len(failed)} patterns: {slot_names(failed)}")
+    return failed
+
+def read_zip(filename):
+    # Returns the configuration sysex (None if missing) and the seq data of
+    # the patterns in a zip file written by save_all().
+    import zipfile
     with zipfile.ZipFile(filename, "r") as zip:
         entries = zip.namelist()
-        if CONFIGNAME in entries and not patterns_only:
-            sys.stdout.write("Restoring configuration\r")
-            sys.stdout.flush()
-            config = zip.read(CONFIGNAME)
-            polyd.send_config_sysex(config, "configuration")
-        if not config_only:
-            for bank in range(1, 9):
-                for pattern in range(1,9):
-                    name = pattern_name(bank, pattern)
-                    if name in entries:
-                        sys.stdout.write(f"Restoring pattern {bank} {pattern}  \r")
-                        sys.stdout.flush()
-                        seq = zip.read(name)
-                        restore_seq(polyd, seq, bank, pattern)
+        config = zip.read(CONFIGNAME) if CONFIGNAME in entries else None
+        seqs = {}
+        for bank, pattern in all_slots():
+            name = pattern_name(bank, pattern)
+            if name in entries:
+                seqs[(bank, pattern)] = zip.read(name)
+    return (config, seqs)
+
+def remap_patterns(seqs, remap):
+    # 'remap' maps slot names like 'b1p1' to the slots the patterns are
+    # restored into. Only the mapped patterns are kept.
+    remapped = {}
+    for source, target in remap.items():
+        source = parse_slot(source)
+        if source not in seqs:
+            raise PolyD_Exception(f"There is no pattern {slot_names([source])} to restore.")
+        remapped[parse_slot(target)] = seqs[source]
+    return remapped
+
+def restore_zip(polyd, filename, config_only, patterns_only, diff=False, window=1, remap=None):
+    config, seqs = read_zip(filename)
+    if remap is not None:
+        seqs = remap_patterns(seqs, remap)
+    if config is not None and not patterns_only:
+        sys.stdout.write("Restoring configuration\r")
+        sys.stdout.flush()
+        polyd.send_config_sysex(config, "configuration")
+    if not config_only:
+        return restore_patterns(polyd, seqs, diff, window)
+    return []
 
 def restore_file(polyd, filename, config_only, patterns_only, bank, pattern):
     with open(filename, "rb") as fp:
@@ -110,14 +246,17 @@ def restore_file(polyd, filename, config_only, patterns_only, bank, pattern):
     else:
         raise PolyD_Exception(f"File '{filename}' is no known Poly D config file.")
 
-def restore(polyd, filename, config_only, patterns_only, bank, pattern):
+def restore(polyd, filename, config_only, patterns_only, bank, pattern, diff=False, window=1, remap=None):
+    # Returns the patterns that could not be restored
+    import zipfile
     if zipfile.is_zipfile(filename):
-        restore_zip(polyd, filename, config_only, patterns_only)
-    else:
-        restore_file(polyd, filename, config_only, patterns_only, bank, pattern)
+        return restore_zip(polyd, filename, config_only, patterns_only, diff, window, remap)
+    restore_file(polyd, filename, config_only, patterns_only, bank, pattern)
+    return []
 
-def configure(polyd, args_dict):
-    handlers = {
+def settings_handlers(polyd):
+    # Map the command line options to the setters
+    return {
         "id":          polyd.set_id,
         "rx":          polyd.set_rx_channel,
         "tx":          polyd.set_tx_channel,
@@ -145,13 +284,16 @@ def configure(polyd, args_dict):
         "arp_out":     polyd.set_arp_out
     }
 
-    for key,func in handlers.items():
-        if key in args_dict:
-            value = args_dict[key]
-            if value is not None:
-                func(value)
-        else:
-            raise PolyD_InvalidArgumentException(f"Unknown argument {key}")
+def configure(polyd, args_dict):
+    handlers = settings_handlers(polyd)
+    with polyd.transaction():
+        for key,func in handlers.items():
+            if key in args_dict:
+                value = args_dict[key]
+                if value is not None:
+                    func(value)
+            else:
+                raise PolyD_InvalidArgumentException(f"Unknown argument {key}")
 
 def dump(version, config):
     print("Firmware version         :", ".".join([str(v) for v in version]))
@@ -181,7 +323,604 @@ def dump(version, config):
     print("Sequencer MIDI Output    :", config.sequencer_output)
     print("Arpeggiator MIDI Output  :", config.arpeggiator_output)
 
+def division_value(text):
+    if text in PolyD_Pattern.DIVISIONS:
+        return PolyD_Pattern.DIVISIONS.index(text)
+    return int(text)
+
+def check_firmware(version):
+    if not is_supported(version):
+        print()
+        print("Warning: This program is tested with firmware up to 1.1.3 only.")
+        print("         It might not work as intended on other versions.")
+        print()
+        print("Poly-D reports firmware", version)
+        print()
+        exit(1)
+
+@contextlib.contextmanager
+def connected_polyd(port, stats=None, daemon=True):
+    # Connect to the first instrument whose port name contains 'port'.
+    # Yields the PolyD object and the firmware version. If polyd-daemon.py
+    # is running, it executes the commands on its open connection instead.
+    # Statistics are only collected by a connection of this program.
+    if daemon and stats is None:
+        from polyd_daemon import PolyD_DaemonClient
+        client = PolyD_DaemonClient.connect(port)
+        if client is not None:
+            with client:
+                try:
+                    version = client.get_version()
+                except MidiException as exc:
+                    print(exc.message)
+                    exit(1)
+                check_firmware(version)
+                yield (client, version)
+            return
+
+    with MidiConnection() as midi:
+        midi.stats = stats
+        in_id, out_id = midiports.default_registry().first_pair(port)
+        if in_id is None or out_id is None:
+            print("No Poly D found.")
+            exit(1)
+        if not midi.connect_write(out_id):
+            print(f"Could not connect to MIDI device {out_id}.")
+            exit(1)
+        if not midi.connect_read(in_id):
+            print(f"Could not connect to MIDI device {in_id}.")
+            exit(1)
+
+        pacer = PolyD_Pacer(PACING_FILE)
+        polyd = PolyD(midi, pacer)
+        version = polyd.get_version()
+        if stats is not None:
+            stats.info['firmware'] = ".".join([str(v) for v in version])
+        check_firmware(version)
+
+        try:
+            yield (polyd, version)
+        finally:
+            pacer.save()
+
+def report_stats(stats, summary, json_file):
+    # Print the statistics and/or write them as JSON ('-' is stdout)
+    if stats is None:
+        return
+    if summary:
+        print()
+        print(stats.summary())
+    if json_file == "-":
+        print(stats.to_json())
+    elif json_file is not None:
+        with open(json_file, "w") as fp:
+            fp.write(stats.to_json())
+
+# Scripts run several steps over one connection. A script is a list of
+# steps, or an object whose 'steps' are that list, e.g.
+#   [ { "op": "restore", "file": "live.zip", "remap": { "b1p1": "b3p4" } },
+#     { "op": "set", "seq_out": "USB" },
+#     { "op": "verify", "settings": { "seq_out": "USB" } } ]
+
+SCRIPT_OPS = {
+    # Operation and the keys it accepts
+    "save":    ("file", "config_only", "patterns_only", "bank", "pattern"),
+    "restore": ("file", "config_only", "patterns_only", "bank", "pattern", "diff", "remap"),
+    "set":     None,
+    "dump":    (),
+    "verify":  ("file", "config_only", "patterns_only", "remap", "settings"),
+}
+
+# Kinds of the settings values in scripts. Texts are chosen like the setters
+# of PolyD do: by their index or by the first text that contains the value.
+NUMBER_SETTINGS = ("id", "tx", "in_trans", "vel_on", "vel_off", "pbend_range", "note_zero", "acc_vel")
+BOOL_SETTINGS = ("multi_trig", "local")
+BOOL_TEXTS = ("off", "on", "no", "yes", "false", "true")
+TEXT_SETTINGS = {
+    "vel_curve": PolyD_Config.CURVES,
+    "key_prio":  PolyD_Config.KEY_PRIORITIES,
+    "mod_range": PolyD_Config.MOD_RANGES,
+    "mod_curve": PolyD_Config.CURVES,
+    "sync_rate": PolyD_Config.CLOCKS,
+    "sync_src":  PolyD_Config.SYNC_PORTS,
+    "ext_pol":   PolyD_Config.POLARITIES,
+    "clock_out": PolyD_Config.PORTS,
+    "pbend_out": PolyD_Config.PORTS,
+    "mod_out":   PolyD_Config.PORTS,
+    "key_out":   PolyD_Config.PORTS,
+    "at_out":    PolyD_Config.PORTS,
+    "seq_out":   PolyD_Config.PORTS,
+    "arp_out":   PolyD_Config.PORTS,
+}
+
+def load_script(filename):
+    # Read and check a JSON or YAML script ('-' is stdin). YAML needs PyYAML.
+    if filename == "-":
+        text = sys.stdin.read()
+    else:
+        with open(filename, "r") as fp:
+            text = fp.read()
+    is_yaml = filename.endswith((".yaml", ".yml")) or \
+              filename == "-" and not text.lstrip().startswith(("[", "{"))
+    try:
+        if is_yaml:
+            try:
+                import yaml
+            except ImportError:
+                raise PolyD_InvalidArgumentException("YAML scripts need PyYAML (pip install pyyaml).")
+            script = yaml.safe_load(text)
+        else:
+            script = json.loads(text)
+    except ValueError as exc:
+        raise PolyD_InvalidArgumentException(f"Invalid script: {exc}")
+    if isinstance(script, dict):
+        script = script.get("steps")
+    if not isinstance(script, list):
+        raise PolyD_InvalidArgumentException("A script must be a list of steps.")
+    for number, step in enumerate(script, 1):
+        if not isinstance(step, dict) or step.get("op") not in SCRIPT_OPS:
+            raise PolyD_InvalidArgumentException(f"Step {number}: 'op' must be one of {', '.join(SCRIPT_OPS)}.")
+        keys = SCRIPT_OPS[step["op"]]
+        unknown = [ key for key in step if key != "op" and keys is not None and key not in keys ]
+        if unknown:
+            raise PolyD_InvalidArgumentException(f"Step {number}: unknown key '{unknown[0]}'.")
+        if step["op"] in ("save", "restore") and "file" not in step:
+            raise PolyD_InvalidArgumentException(f"Step {number}: 'file' is missing.")
+        if step["op"] == "verify" and "file" not in step and "settings" not in step:
+            raise PolyD_InvalidArgumentException(f"Step {number}: 'file' or 'settings' is missing.")
+        try:
+            check_step(step)
+        except PolyD_InvalidArgumentException as exc:
+            raise PolyD_InvalidArgumentException(f"Step {number}: {exc.message}")
+    return script
+
+def check_step(step):
+    # Check the types of the values of a step. The values of settings are
+    # converted into the types the setters expect.
+    if not isinstance(step.get("file", ""), str):
+        raise PolyD_InvalidArgumentException("'file' must be a file name.")
+    for key in ("config_only", "patterns_only", "diff"):
+        if not isinstance(step.get(key, False), bool):
+            raise PolyD_InvalidArgumentException(f"'{key}' must be true or false.")
+    for key in ("bank", "pattern"):
+        value = step.get(key)
+        if value is not None and (type(value) is not int or not 1 <= value <= 8):
+            raise PolyD_InvalidArgumentException(f"'{key}' must be a number from 1 to 8.")
+    remap = step.get("remap", {})
+    if not isinstance(remap, dict):
+        raise PolyD_InvalidArgumentException("'remap' must map slots to slots, e.g. {\"b1p1\": \"b3p4\"}.")
+    for source, target in remap.items():
+        parse_slot(source)
+        parse_slot(target)
+    settings = step if step["op"] == "set" else step.get("settings", {})
+    if not isinstance(settings, dict):
+        raise PolyD_InvalidArgumentException("'settings' must map settings to values.")
+    for key, value in settings.items():
+        if key != "op":
+            settings[key] = check_setting(key, value)
+
+def check_setting(key, value):
+    # Returns the value of a setting as the setter expects it
+    if key not in NUMBER_SETTINGS and key not in BOOL_SETTINGS and key not in TEXT_SETTINGS and key != "rx":
+        raise PolyD_InvalidArgumentException(f"Unknown setting '{key}'")
+    if isinstance(value, bool):
+        if key not in BOOL_SETTINGS:
+            raise PolyD_InvalidArgumentException(f"Invalid value '{value}' for '{key}'")
+        value = BOOL_TEXTS[int(value)]
+    if not isinstance(value, (int, str)):
+        raise PolyD_InvalidArgumentException(f"Invalid value '{value}' for '{key}'")
+    if key in NUMBER_SETTINGS and isinstance(value, str):
+        if not re.fullmatch(r'\s*[-+]?\d+\s*', value):
+            raise PolyD_InvalidArgumentException(f"'{key}' must be a number, not '{value}'")
+        value = int(value)
+    setting_text(key, value)
+    return value
+
+def normalize_setting(value):
+    return re.sub(r'\s+', '', str(value).lower())
+
+def setting_text(key, value):
+    # Returns a value for a setter in the form of config_values()
+    text = normalize_setting(value)
+    if key in NUMBER_SETTINGS:
+        return str(int(value))
+    if key == "rx":
+        if text == "all":
+            return "all"
+        if not text.isdigit():
+            raise PolyD_InvalidArgumentException(f"Invalid value '{value}' for '{key}'")
+        return str(int(text))
+    texts = BOOL_TEXTS if key in BOOL_SETTINGS else TEXT_SETTINGS[key]
+    if text.isdigit():
+        index = int(text)
+    else:
+        index = next((i for i, t in enumerate(texts) if text in normalize_setting(t)), -1)
+    if key in BOOL_SETTINGS and index >= 0:
+        return BOOL_TEXTS[index % 2]
+    if index < 0 or index >= len(texts):
+        raise PolyD_InvalidArgumentException(f"Invalid value '{value}' for '{key}'")
+    return normalize_setting(texts[index])
+
+def config_values(config):
+    # The settings by the names of their command line options, in the form
+    # the setters accept
+    return {
+        "id":          config.device_id,
+        "rx":          config.midi_rx_channel,
+        "tx":          config.midi_tx_channel,
+        "in_trans":    config.midi_in_transpose,
+        "vel_on":      config.note_on_velocity,
+        "vel_off":     config.note_off_velocity,
+        "vel_curve":   config.velocity_curve,
+        "key_prio":    config.key_priority,
+        "multi_trig":  config.multi_trigger,
+        "pbend_range": config.pitch_bend_range,
+        "mod_range":   PolyD_Config.MOD_RANGES[config.mod_wheel_range],
+        "mod_curve":   config.modulation_curve,
+        "note_zero":   config.note_at_zero_cv,
+        "sync_rate":   config.sync_clock_rate,
+        "sync_src":    config.sync_clock_source,
+        "local":       config.local_keyboard_mode,
+        "ext_pol":     config.ext_clock_polarity,
+        "acc_vel":     config.accent_velocity,
+        "clock_out":   config.midi_clock_output,
+        "pbend_out":   config.pitch_wheel_output,
+        "mod_out":     config.mod_wheel_output,
+        "key_out":     config.keyboard_output,
+        "at_out":      config.after_touch_output,
+        "seq_out":     config.sequencer_output,
+        "arp_out":     config.arpeggiator_output,
+    }
+
+def verify(polyd, step, window):
+    # Returns the settings, 'config' and the pattern slots that differ from
+    # the file or the expected settings. The mirrored state is not trusted.
+    import zipfile
+    polyd.refresh()
+    differences = []
+    if "file" in step:
+        if not zipfile.is_zipfile(step["file"]):
+            raise PolyD_Exception(f"File '{step['file']}' is no zip file.")
+        config, seqs = read_zip(step["file"])
+        if "remap" in step:
+            seqs = remap_patterns(seqs, step["remap"])
+        if config is not None and not step.get("patterns_only", False) and \
+           PolyD_Config(config).values != polyd.get_config().values:
+            differences.append("config")
+        if not step.get("config_only", False):
+            differences.extend(slot_names([ slot ]) for slot in sorted(changed_slots(polyd, seqs, window)))
+    values = config_values(polyd.get_config())
+    for key, expected in step.get("settings", {}).items():
+        if normalize_setting(values[key]) != setting_text(key, expected):
+            differences.append(key)
+    return differences
+
+def run_step(polyd, version, step, window):
+    # Executes one step except 'set' and returns its results
+    op = step["op"]
+    config_only = step.get("config_only", False)
+    patterns_only = step.get("patterns_only", False)
+    if op == "save":
+        failed = save(polyd, step["file"], config_only, patterns_only, step.get("bank"), step.get("pattern"), window)
+        return { "ok": not failed, "failed": [ slot_names([ slot ]) for slot in sorted(failed or []) ] }
+    if op == "restore":
+        failed = restore(polyd, step["file"], config_only, patterns_only, step.get("bank"), step.get("pattern"),
+                         step.get("diff", False), window, step.get("remap"))
+        return { "ok": not failed, "failed": [ slot_names([ slot ]) for slot in sorted(failed) ] }
+    if op == "dump":
+        return { "ok": True, "version": ".".join([str(v) for v in version]), "config": config_values(polyd.get_config()) }
+    differences = verify(polyd, step, window)
+    return { "ok": not differences, "differences": differences }
+
+def uses_config(step):
+    # True if a step reads or writes the configuration
+    op = step["op"]
+    if op in ("set", "dump"):
+        return True
+    if op == "save":
+        return step.get("bank") is None or step.get("pattern") is None
+    if op == "verify" and "settings" in step:
+        return True
+    return not step.get("patterns_only", False)
+
+def schedule_script(steps):
+    # Returns the groups of step indices in the order they are executed.
+    # 'set' steps are moved behind the following steps that do not use the
+    # configuration, so they are merged with the next 'set' step and written
+    # in one transaction.
+    groups = []
+    settings = []
+    for index, step in enumerate(steps):
+        if step["op"] == "set":
+            settings.append(index)
+            continue
+        if settings and uses_config(step):
+            groups.append(settings)
+            settings = []
+        groups.append([ index ])
+    if settings:
+        groups.append(settings)
+    return groups
+
+def run_script(polyd, version, steps, window, out=sys.stdout):
+    # Execute the steps and write one JSON line per step to 'out'. Settings
+    # are absolute values, so 'set' steps are merged as far as
+    # schedule_script() allows and written in one transaction. The output
+    # of the steps goes to stderr.
+    # Stops at the first step that fails and returns False then.
+    for group in schedule_script(steps):
+        start = time.monotonic()
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                if steps[group[0]]["op"] == "set":
+                    changes = dict.fromkeys(settings_handlers(polyd))
+                    for index in group:
+                        changes.update((key, value) for key, value in steps[index].items() if key != "op")
+                    configure(polyd, changes)
+                    result = { "ok": True }
+                else:
+                    result = run_step(polyd, version, steps[group[0]], window)
+        except Exception as exc:
+            result = { "ok": False, "error": getattr(exc, 'message', None) or str(exc) or type(exc).__name__ }
+        elapsed = round(time.monotonic() - start, 3)
+        for index in group:
+            line = { "step": index + 1, "op": steps[index]["op"], **result, "time": elapsed }
+            out.write(json.dumps(line) + "\n")
+        out.flush()
+        if not result["ok"]:
+            return False
+    return True
+
+def division_name(value):
+    if 0 <= value < len(PolyD_Pattern.DIVISIONS):
+        return PolyD_Pattern.DIVISIONS[value]
+    return str(value)
+
+# The modules that are only needed by a subcommand are imported by the
+# subcommand, so that the other commands start faster.
+
+def library_main(argv):
+    from polyd_library import PolyD_Library
+    parser = argparse.ArgumentParser(prog=f"{NAME} library", description="index and search pattern files")
+    parser.add_argument("--db", help=f"index database (default {LIBRARY_FILE})", default=LIBRARY_FILE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="index the zip, seq and syx files in a directory")
+    index_parser.add_argument("directory", nargs="+")
+    query_parser = commands.add_parser("query", help="list the indexed patterns matching all given criteria")
+    query_parser.add_argument("--steps", help="number of steps (1-32)", type=int, default=None)
+    query_parser.add_argument("--swing", help="swing in percent (50-75)", type=int, default=None)
+    query_parser.add_argument("--transpose", help="transpose (-24-36)", type=int, default=None)
+    query_parser.add_argument("--division", help=f"division ({get_range_string(PolyD_Pattern.DIVISIONS)})", type=division_value, default=None)
+    query_parser.add_argument("--note_min", help="lowest note used (0-127)", type=int, default=None)
+    query_parser.add_argument("--note_max", help="highest note used (0-127)", type=int, default=None)
+    query_parser.add_argument("--hash", help="content hash or its beginning", default=None)
+    args = parser.parse_args(argv)
+
+    with PolyD_Library(args.db) as library:
+        if args.command == "index":
+            for directory in args.directory:
+                start = time.monotonic()
+                indexed, unchanged, removed = library.index(directory)
+                print(f"{directory}: {indexed} indexed, {unchanged} unchanged, {removed} removed "
+                      f"({time.monotonic() - start:.2f} s)")
+        else:
+            start = time.monotonic()
+            entries = library.query(args.steps, args.swing, args.transpose, args.division,
+                                    args.note_min, args.note_max, args.hash)
+            for e in entries:
+                slot = f"b{e.bank}p{e.pattern}" if e.bank is not None else "-"
+                notes = f"{e.note_min}-{e.note_max}" if e.note_min is not None else "-"
+                print(f"{e.hash[:12]}  {slot:5} steps {e.steps:2}  swing {e.swing}%  transpose {e.transpose:3}  "
+                      f"{division_name(e.division):6} notes {notes:7}  {e.location}")
+            print(f"{len(entries)} patterns ({(time.monotonic() - start) * 1000:.1f} ms)")
+
+def snapshot_main(argv):
+    from polyd_snapshot import PolyD_SnapshotStore
+    parser = argparse.ArgumentParser(prog=f"{NAME} snapshot", description="incremental, deduplicated backups")
+    parser.add_argument("--store", help=f"snapshot directory (default {SNAPSHOT_DIR})", default=SNAPSHOT_DIR)
+    parser.add_argument("--port", help="MIDI port name", default='POLY D')
+    parser.add_argument("--window", help="number of pattern requests kept in flight (default 1)", type=int, default=1)
+    commands = parser.add_subparsers(dest="command", required=True)
+    save_parser = commands.add_parser("save", help="save the configuration and all patterns as new snapshot")
+    save_parser.add_argument("--name", help="snapshot name (default: date and time)", default=None)
+    commands.add_parser("list", help="list the snapshots")
+    diff_parser = commands.add_parser("diff", help="list the differences between two snapshots")
+    diff_parser.add_argument("snapshot_a")
+    diff_parser.add_argument("snapshot_b")
+    restore_parser = commands.add_parser("restore", help="write a snapshot back to the instrument")
+    restore_parser.add_argument("snapshot")
+    restore_parser.add_argument("-C", "--config_only", help="restore the configuration only", action="store_true")
+    restore_parser.add_argument("-P", "--patterns_only", help="restore the patterns only", action="store_true")
+    restore_parser.add_argument("--diff", help="restore only the patterns that differ from the ones on the instrument", action="store_true")
+    args = parser.parse_args(argv)
+
+    store = PolyD_SnapshotStore(args.store)
+    try:
+        if args.command == "list":
+            for manifest in store.list():
+                print(f"{manifest['name']:20} {manifest['created']}  {len(manifest['items'])} items")
+        elif args.command == "diff":
+            for item, hash_a, hash_b in store.diff(args.snapshot_a, args.snapshot_b):
+                print(f"{item:7} {(hash_a or '-')[:12]:12} -> {(hash_b or '-')[:12]}")
+        elif args.command == "save":
+            with connected_polyd(args.port) as (polyd, _):
+                config = polyd.get_config()
+                patterns = polyd.get_patterns(all_slots(), args.window)
+                seqs = { slot: PolyD_Cmd.syx2seq(sysex) for slot, sysex in patterns.items() }
+                name, written = store.create(config.sysex, seqs, args.name)
+                print(f"Saved snapshot {name}, {written} new items.")
+        elif args.command == "restore":
+            config = store.get_config(args.snapshot)
+            seqs = store.get_patterns(args.snapshot)
+            with connected_polyd(args.port) as (polyd, _):
+                if config is not None and not args.patterns_only:
+                    polyd.send_config_sysex(config, "configuration")
+                if not args.config_only:
+                    restore_patterns(polyd, seqs, args.diff, args.window)
+    except MidiException as exc:
+        print("Error:", exc.message)
+        exit(1)
+
+def convert_main(argv):
+    import polyd_convert
+    parser = argparse.ArgumentParser(prog=f"{NAME} convert", description="convert pattern files without an instrument")
+    parser.add_argument("inputs", help="input files, directories or glob patterns", nargs="+")
+    parser.add_argument("-t", "--to", help="output format", choices=polyd_convert.FORMATS, required=True)
+    parser.add_argument("-o", "--out", help="output directory (default: current directory)", default=".")
+    parser.add_argument("-b", "--bank", help="bank number written into the converted patterns", type=int, default=None)
+    parser.add_argument("-p", "--pattern", help="pattern number written into the converted patterns", type=int, default=None)
+    parser.add_argument("-j", "--jobs", help="number of worker processes (default: number of CPUs)", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    inputs = polyd_convert.find_inputs(args.inputs)
+    if len(inputs) == 0:
+        print("No pattern files found.")
+        exit(1)
+    try:
+        jobs = polyd_convert.make_jobs(inputs, args.out, args.to, args.bank, args.pattern)
+    except PolyD_Exception as exc:
+        print("Error:", exc.message)
+        exit(1)
+    start = time.monotonic()
+    converted = failed = 0
+    for done, (job, count, errors) in enumerate(polyd_convert.convert(jobs, args.jobs), 1):
+        converted += count
+        failed += len(errors)
+        for error in errors:
+            print(f"[{done}/{len(jobs)}] Error: {error}")
+    print(f"Converted {converted} patterns from {len(inputs)} files into {len(jobs)} outputs, "
+          f"{failed} errors ({time.monotonic() - start:.2f} s).")
+    if failed:
+        exit(1)
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+def run_benchmark(name, runs, items, operation):
+    # Run 'operation' 'runs' times and print the throughput and the latency
+    # percentiles of one operation in milliseconds.
+    import io
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for run in range(runs):
+            start = time.monotonic()
+            operation(run)
+            times.append(time.monotonic() - start)
+    total = sum(times)
+    print(f"{name:14} {runs:4} {runs / total:8.2f} {runs * items / total:9.1f} "
+          f"{percentile(times, 50) * 1000:9.1f} {percentile(times, 90) * 1000:9.1f} "
+          f"{percentile(times, 99) * 1000:9.1f}")
+    return times
+
+def startup_benchmark(runs, budget):
+    # Start the programs with --version, which must not load the MIDI
+    # backends, kivy or the modules of the subcommands, and with --list,
+    # which loads the MIDI backend. Returns False when a median start time
+    # exceeds 'budget' milliseconds.
+    import subprocess
+    directory = os.path.dirname(os.path.abspath(__file__))
+    ok = True
+    for program in ("polyd-cli.py", "polyd-gui.py"):
+        for option in ("--version", "--list"):
+            name = f"{program[6:-3]} {option}"
+            command = [ sys.executable, os.path.join(directory, program), option ]
+            # The first start also compiles the modules
+            if subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+                if option == "--list":
+                    print(f"{name:14} skipped, the MIDI backend could not be loaded")
+                    continue
+                print(f"Error: {program} {option} failed")
+                ok = False
+                continue
+            times = run_benchmark(name, runs, 1,
+                                  lambda run: subprocess.run(command, check=True, stdout=subprocess.DEVNULL))
+            if budget is not None and percentile(times, 50) * 1000 > budget:
+                print(f"Error: {program} {option} takes {percentile(times, 50) * 1000:.1f} ms, the budget is {budget} ms")
+                ok = False
+    return ok
+
+def bench_main(argv):
+    import tempfile
+    from polyd_sim import PolyD_Simulator
+    from polyd_stats import PolyD_Stats
+    parser = argparse.ArgumentParser(prog=f"{NAME} bench", description="measure backup, restore and configuration speed against a simulated Poly D")
+    parser.add_argument("--runs", help="number of runs of every benchmark (default 5)", type=int, default=5)
+    parser.add_argument("--window", help="number of pattern requests kept in flight (default 1)", type=int, default=1)
+    parser.add_argument("--latency", help="reply latency of the simulator in ms (default 2)", type=float, default=2)
+    parser.add_argument("--jitter", help="additional random reply latency in ms (default 0)", type=float, default=0)
+    parser.add_argument("--pattern-gap", help="minimum time between two pattern writes in ms (default 5)", type=float, default=5)
+    parser.add_argument("--error-rate", help="probability that a write is answered with an error (default 0)", type=float, default=0)
+    parser.add_argument("--drop-rate", help="probability that a reply is lost (default 0)", type=float, default=0)
+    parser.add_argument("--seed", help="seed of the simulated errors", type=int, default=None)
+    parser.add_argument("--stats", help="print the statistics of every command at exit", action="store_true")
+    parser.add_argument("--stats-json", help="write the statistics of every command as JSON into a file ('-' for stdout)", default=None)
+    parser.add_argument("--startup", help="measure the start time of the programs instead", action="store_true")
+    parser.add_argument("--budget", help="fail if the median start time exceeds this many ms (default 250)", type=float, default=250)
+    args = parser.parse_args(argv)
+
+    header = f"{'benchmark':14} {'runs':>4} {'ops/s':>8} {'items/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}"
+    if args.startup:
+        print(header)
+        if not startup_benchmark(args.runs, args.budget):
+            exit(1)
+        return
+
+    simulator = PolyD_Simulator(args.latency / 1000, args.jitter / 1000, args.error_rate,
+                                args.drop_rate, args.pattern_gap / 1000, seed=args.seed)
+    settings = [ { "rx": 2, "vel_on": 100, "acc_vel": 90 },
+                 { "rx": 1, "vel_on": 0, "acc_vel": 96 } ]
+    with MidiConnection(simulator) as midi, tempfile.TemporaryDirectory() as directory:
+        if args.stats or args.stats_json is not None:
+            midi.stats = PolyD_Stats()
+            midi.stats.info['backend'] = "simulator"
+        midi.connect(PolyD_Simulator.PORT_NAME, PolyD_Simulator.PORT_NAME)
+        polyd = PolyD(midi)
+        polyd.get_version()
+        filename = os.path.join(directory, "backup.zip")
+        slots = len(all_slots())
+
+        def backup(run):
+            polyd.state.invalidate()
+            save_all(polyd, filename, args.window)
+
+        def restore(run):
+            restore_zip(polyd, filename, False, False)
+
+        def restore_diff(run):
+            polyd.state.invalidate()
+            restore_zip(polyd, filename, False, False, True, args.window)
+
+        def change_settings(run):
+            args_dict = dict.fromkeys(settings_handlers(polyd))
+            args_dict.update(settings[run % len(settings)])
+            configure(polyd, args_dict)
+
+        print(header)
+        try:
+            run_benchmark("backup", args.runs, slots + 1, backup)
+            run_benchmark("restore", args.runs, slots + 1, restore)
+            run_benchmark("restore --diff", args.runs, slots + 1, restore_diff)
+            run_benchmark("configure", args.runs, len(settings[0]), change_settings)
+        except MidiException as exc:
+            print("Error:", exc.message)
+            exit(1)
+        finally:
+            report_stats(midi.stats, args.stats, args.stats_json)
+
+COMMANDS = {
+    "bench": bench_main,
+    "convert": convert_main,
+    "library": library_main,
+    "snapshot": snapshot_main,
+}
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-V", "--version", help=f"show {NAME}'s version number and exit", action="version",  version=f'%(prog)s {VERSION}')
     parser.add_argument("-l", "--list", help="list the MIDI interfaces and exit", action="store_true")
@@ -190,9 +929,16 @@ def main():
     parser.add_argument("-r", "--restore", help="write data from a file back to the instrument", default=None)
     parser.add_argument("-C", "--config_only", help="save/restore the configuration only", action="store_true")
     parser.add_argument("-P", "--patterns_only", help="restore the patterns only", action="store_true")
+    parser.add_argument("--diff", help="restore only the patterns that differ from the ones on the instrument", action="store_true")
     parser.add_argument("-b", "--bank", help="the bank number of the saved or restored pattern", type=int, default=None)
     parser.add_argument("-p", "--pattern", help="the pattern number of the saved or restored pattern", type=int, default=None)
     parser.add_argument("--port", help="MIDI port name", default=None)
+    parser.add_argument("--script", help="run the steps of a JSON or YAML script ('-' for stdin) and print their results as JSON lines", default=None)
+    parser.add_argument("--no-daemon", help="open the MIDI ports even if polyd-daemon.py is running", action="store_true")
+    parser.add_argument("--all-devices", help="save every connected instrument into the directory given by --save", action="store_true")
+    parser.add_argument("--window", help="number of pattern requests kept in flight while reading patterns (default 1)", type=int, default=1)
+    parser.add_argument("--stats", help="print the number, time, timeouts and errors of every command at exit", action="store_true")
+    parser.add_argument("--stats-json", help="write the statistics of every command as JSON into a file ('-' for stdout)", default=None)
     parser.add_argument("--id", help="set the device id (0-127)", type=int, default=None)
     parser.add_argument("--rx", help="set MIDI rx channel (1-16)", type=int, default=None)
     parser.add_argument("--tx", help="set MIDI rx channel (1-16, All)", type=int, default=None)
@@ -221,7 +967,7 @@ def main():
 
     args = parser.parse_args()
     if args.list:
-        ids = MidiConnection().get_ids()
+        ids = midiports.default_registry().ids
         for name in ids:
             print("    ", name)
         return
@@ -230,46 +976,55 @@ def main():
     if args.port is not None:
         port = args.port
 
-    with MidiConnection() as midi:
-        in_id = first_or_default(midi.get_input_ids(), lambda n: is_polyd(port, n))
-        out_id = first_or_default(midi.get_output_ids(), lambda n: is_polyd(port, n))
-        if in_id is None or out_id is None:
-            print("No Poly D found.")
-            exit(1)
-        if not midi.connect_write(out_id):
-            print(f"Could not connect to MIDI device {out_id}.")
-            exit(1)
-        if not midi.connect_read(in_id):
-            print(f"Could not connect to MIDI device {in_id}.")
+    steps = None
+    if args.script is not None:
+        try:
+            steps = load_script(args.script)
+        except (PolyD_Exception, OSError) as exc:
+            print("Error:", getattr(exc, 'message', exc))
             exit(1)
 
-        polyd = PolyD(midi)
-        version = polyd.get_version()
-        if version[0] != 1 and version[1] != 1 and version[1] <= 3:
-            print()
-            print("Warning: This program is tested with firmware up to 1.1.3 only.")
-            print("         It might not work as intended on other versions.")
-            print()
-            print("Poly-D reports firmware", version)
-            print()
-            exit(1)
+    stats = None
+    if args.stats or args.stats_json is not None:
+        from polyd_stats import PolyD_Stats
+        stats = PolyD_Stats()
+    try:
+        if args.all_devices:
+            directory = args.save if args.save is not None else "."
+            if not backup_all_devices(port, directory, args.window, stats):
+                exit(1)
+            return
 
-        try:
-            if args.save is not None:
-                save(polyd, args.save, args.config_only, args.patterns_only, args.bank, args.pattern)
+        with connected_polyd(port, stats, not args.no_daemon) as (polyd, version):
+            if steps is not None:
+                if not run_script(polyd, version, steps, args.window):
+                    exit(1)
+                return
 
-            if args.restore is not None:
-                restore(polyd, args.restore, args.config_only, args.patterns_only, args.bank, args.pattern)
+            ok = True
+            try:
+                if args.save is not None:
+                    if save(polyd, args.save, args.config_only, args.patterns_only, args.bank, args.pattern, args.window):
+                        ok = False
 
-            args_dict = vars(args)
-            configure(polyd, args_dict)
+                if args.restore is not None:
+                    if restore(polyd, args.restore, args.config_only, args.patterns_only, args.bank, args.pattern, args.diff, args.window):
+                        ok = False
 
-            if args.dump:
-                config = polyd.get_config()
-                dump(version, config)
+                args_dict = vars(args)
+                configure(polyd, args_dict)
 
-        except MidiException as exc:
-            print("Error:", exc.message)
+                if args.dump:
+                    config = polyd.get_config()
+                    dump(version, config)
+
+            except MidiException as exc:
+                print("Error:", exc.message)
+                ok = False
+            if not ok:
+                exit(1)
+    finally:
+        report_stats(stats, args.stats, args.stats_json)
 
 if __name__ == "__main__":
     main()
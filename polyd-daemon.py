@@ -0,0 +1,46 @@
+#! /usr/bin/env python3
+
+import argparse
+import os
+import signal
+import threading
+
+NAME = 'polyd-daemon'
+VERSION = 1.0
+
+PACING_FILE = os.path.join(os.path.expanduser("~"), ".config", "polyd-cli", "pacing.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="keep the connections to the Poly Ds open for polyd-cli.py")
+    parser.add_argument("-V", "--version", help=f"show {NAME}'s version number and exit", action="version", version=f'%(prog)s {VERSION}')
+    parser.add_argument("--socket", help="path of the Unix socket (default $POLYD_DAEMON_SOCKET or $XDG_RUNTIME_DIR/polyd-daemon.sock)", default=None)
+    parser.add_argument("--simulator", help="serve a simulated Poly D instead of the MIDI ports", action="store_true")
+    args = parser.parse_args()
+
+    from polyd_daemon import PolyD_Daemon, is_running
+    from polyd_exc import PolyD_Exception
+
+    backend = None
+    if args.simulator:
+        from polyd_sim import PolyD_Simulator
+        backend = PolyD_Simulator()
+    daemon = PolyD_Daemon(args.socket, backend, PACING_FILE)
+    if is_running(daemon.path):
+        print(f"Error: A daemon is already listening on '{daemon.path}'.")
+        exit(1)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this thread
+        threading.Thread(target=daemon.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Listening on {daemon.path}")
+    try:
+        daemon.serve_forever()
+    except PolyD_Exception as exc:
+        print("Error:", exc.message)
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,37 @@
 #! /usr/bin/env python3
 
-import kivy
-kivy.require('2.3.0')
-
-from kivy.config import Config
-Config.set('graphics', 'width', str(450))
-Config.set('graphics', 'height', str(880))
-Config.set('graphics', 'resizable', False)
-Config.set('input', 'mouse', 'mouse,multitouch_on_demand')
-
-NAME = 'polyd-gui'
-VERSION = 1.0
-
-from kivy.app import App
-
 import argparse
 
-from midiconnection import MidiConnection, MidiException
-from polyd import PolyD, PolyD_Config, PolyD_Exception, PolyD_InvalidArgumentException
-from polydguiview import PolyDGuiView
+import midiports
 
-def first_or_default(arr, pred):
-    return next(iter([x for x in arr if pred(x)]), None)
+from midiconnection import MidiConnection
+from polyd import PolyD
 
-def is_polyd(searched_name, port_name):
-    return searched_name in port_name
+NAME = 'polyd-gui'
+VERSION = 1.0
 
-class PolyDGui(App):
-    def __init__(self, polyd, **kwargs):
-        self.polyd = polyd
-        super().__init__(**kwargs)
+def configure_kivy():
+    # Kivy opens the window when it is imported, so it is only loaded
+    # when the GUI is started and not for --version or --list.
+    import kivy
+    kivy.require('2.3.0')
 
-    def build(self):
-        self.title = "Poly D GUI"
-        return PolyDGuiView(self.polyd)
+    from kivy.config import Config
+    Config.set('graphics', 'width', str(450))
+    Config.set('graphics', 'height', str(880))
+    Config.set('graphics', 'resizable', False)
+    Config.set('input', 'mouse', 'mouse,multitouch_on_demand')
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-V", "--version", help=f"show {NAME}'s version number and exit", action="version", version=f'%(prog)s {VERSION}')
     parser.add_argument("-l", "--list", help="list the MIDI interfaces and exit", action="store_true")
     parser.add_argument("--port", help="MIDI port name", default=None)
+    parser.add_argument("--no-sync", help="do not poll the settings changed on the instrument", action="store_true")
 
     args = parser.parse_args()
     if args.list:
-        ids = MidiConnection().get_ids()
+        ids = midiports.default_registry().ids
         print()
         print("Ports:")
         for name in ids:
@@ -55,8 +43,7 @@ def main():
         port = args.port
 
     with MidiConnection() as midi:
-        in_id = first_or_default(midi.get_input_ids(), lambda n: is_polyd(port, n))
-        out_id = first_or_default(midi.get_output_ids(), lambda n: is_polyd(port, n))
+        in_id, out_id = midiports.default_registry().first_pair(port)
         if in_id is None or out_id is None:
             print("No Poly D found.")
             exit(1)
@@ -78,7 +65,9 @@ def main():
             print()
             exit(1)
 
-        PolyDGui(polyd).run()
+        configure_kivy()
+        from polydguiview import PolyDGui
+        PolyDGui(polyd, midi, port, (in_id, out_id), version, not args.no_sync).run()
 
 if __name__ == "__main__":
     main()
@@ -1,54 +1,191 @@
+import collections
+import contextlib
+import contextvars
 import re
 import time
 
-from midiconnection import MidiException
+from midiconnection import MidiConnection, MidiException
 from polyd_config import PolyD_Config
 from polyd_cmd import PolyD_Cmd
 from polyd_exc import PolyD_InvalidArgumentException, PolyD_MidiException
+from polyd_pacing import PolyD_Pacer
+from polyd_policy import PolyD_Policies
+from polyd_state import PolyD_State
+
+def _requests(steps):
+    """ Turns a generator method into a method that runs its requests on the
+        MidiConnection. The generator yields (future, timeout) to wait for an
+        answer and (None, timeout) to sleep, see MidiConnection.run().
+        AsyncPolyD runs the same generator, which is kept in 'steps', on the
+        event loop. """
+    def method(self, *args, **kwargs):
+        return self._PolyD__midi.run(steps(self, *args, **kwargs))
+    method.__name__ = steps.__name__
+    method.__qualname__ = steps.__qualname__
+    method.__doc__ = steps.__doc__
+    method.steps = steps
+    return method
 
 class PolyD:
     __BOOL_TEXTS = ['off', 'on', 'no', 'yes', 'false', 'true']
-
-    def __init__(self, midi):
+    __DRAIN_TIMEOUT = 0.5
+    # Number of setter commands from which on all settings are written at once.
+    FULL_WRITE_THRESHOLD = 4
+
+    def __init__(self, midi, pacer=None, policies=None):
+        """ Only sysex messages of the Poly D are received from 'midi' from now on.
+            Call midi.set_input_filter() afterwards to receive other messages.
+            'policies' sets the timeouts and retries of the commands. """
         self.__midi = midi
-        self.__config = None
-
+        midi.set_input_filter(PolyD_Cmd.SYX_PREFIX, [ MidiConnection.SYSEX ])
+        self.state = PolyD_State()
+        # Every thread and asyncio task has its own transaction
+        self.__changes = contextvars.ContextVar('changes', default=None)
+        self.pacer = pacer if pacer is not None else PolyD_Pacer()
+        self.policies = policies if policies is not None else PolyD_Policies()
+
+    @_requests
     def get_config(self):
+        """ Returns the configuration. It is only requested from the Poly D
+            if it is not known yet. """
+        if not self.state.is_current:
+            yield from PolyD.refresh.steps(self)
+        return self.state.config
+
+    @_requests
+    def refresh(self):
+        """ Requests the configuration from the Poly D and forgets the
+            mirrored patterns. """
+        self.state.invalidate()
+        return (yield from PolyD.read_settings.steps(self))
+
+    @_requests
+    def read_settings(self):
+        """ Requests the configuration from the Poly D. Unlike refresh()
+            the mirrored patterns are kept. """
         sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.GET_SETTINGS ])
-        answer = self.__midi.sysex_communicate(sysex)
-        self.__config = PolyD_Config(bytes(answer.bytes()))
-        return self.__config
-
-    def get_pattern(self, bank, pattern):
-        if bank is None or pattern is None:
-            raise PolyD_InvalidArgumentException("'bank' and 'pattern' must be specified.")
-        self.__check_range(bank, 1, 8, "bank")
-        self.__check_range(pattern, 1, 8, "pattern")
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.GET_SEQ_PATTERN, bank-1, pattern-1 ])
-        return bytes(self.__midi.sysex_communicate(sysex).bytes())
+        match = PolyD_Cmd.make_reply_matcher(PolyD_Cmd.SETTINGS_RESULT)
+        answer = yield from self.__communicate(sysex, match, PolyD_Policies.SETTINGS)
+        self.state.config = PolyD_Config(answer)
+        return self.state.config
+
+    @_requests
+    def get_pattern(self, bank, pattern, cached=True):
+        """ Returns the pattern sysex. It is only requested from the Poly D
+            if it is not mirrored or 'cached' is False. """
+        self.check_slot(bank, pattern)
+        sysex = self.state.get_pattern(bank, pattern) if cached else None
+        if sysex is None:
+            request = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.GET_SEQ_PATTERN, bank-1, pattern-1 ])
+            match = PolyD_Cmd.make_reply_matcher(PolyD_Cmd.SEQ_PATTERN, bank-1, pattern-1)
+            sysex = yield from self.__communicate(request, match, PolyD_Policies.PATTERN_FETCH)
+            self.state.set_pattern(bank, pattern, sysex)
+        return sysex
+
+    @_requests
+    def get_patterns(self, slots, window=1, skip_failed=False, cached=True):
+        """ Fetches the patterns of several (bank, pattern) slots.
+            Up to 'window' requests are kept in flight at the same time and every
+            reply is matched to its request by bank and pattern number. If the
+            Poly D drops or reorders replies, the remaining patterns are fetched
+            one after another.
+            Returns a dict mapping (bank, pattern) to the pattern sysex. With
+            'skip_failed' the patterns that could not be read are left out
+            instead of raising an exception. Without 'cached' the mirrored
+            patterns are read again. """
+        slots = list(slots)
+        for bank, pattern in slots:
+            self.check_slot(bank, pattern)
+        patterns = {}
+        for slot in slots:
+            sysex = self.state.get_pattern(*slot) if cached else None
+            if sysex is not None:
+                patterns[slot] = sysex
+        if window > 1:
+            missing = [ slot for slot in slots if slot not in patterns ]
+            yield from self.__get_patterns_pipelined(missing, window, patterns)
+        for bank, pattern in slots:
+            if (bank, pattern) not in patterns:
+                try:
+                    patterns[(bank, pattern)] = yield from PolyD.get_pattern.steps(self, bank, pattern, cached)
+                except MidiException:
+                    if not skip_failed:
+                        raise
+        return patterns
+
+    def __get_patterns_pipelined(self, slots, window, patterns):
+        todo = iter(slots)
+        pending = collections.deque()
+
+        def request_next():
+            slot = next(todo, None)
+            if slot is not None:
+                bank, pattern = slot
+                match = PolyD_Cmd.make_reply_matcher(PolyD_Cmd.SEQ_PATTERN, bank-1, pattern-1)
+                sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.GET_SEQ_PATTERN, bank-1, pattern-1 ])
+                future = self.__midi.expect(match, sysex)
+                self.__midi.write(sysex)
+                pending.append((slot, future, sysex))
+
+        try:
+            for _ in range(window):
+                request_next()
+            while pending:
+                slot, future, request = pending[0]
+                answer = yield future, self.policies[PolyD_Policies.PATTERN_FETCH].timeout
+                pending.popleft()
+                if answer is None:
+                    self.__timed_out(request)
+                    break    # The reply was dropped.
+                self.__store_pattern(slot, answer, patterns)
+                if any(f.done() for _, f, _ in pending):
+                    break    # A later reply overtook this one.
+                request_next()
+            # Collect the replies that are still on their way.
+            for slot, future, request in pending:
+                answer = yield future, self.__DRAIN_TIMEOUT
+                if answer is None:
+                    self.__timed_out(request)
+                    continue
+                self.__store_pattern(slot, answer, patterns)
+        finally:
+            # A reply that was not stored must not complete a later request
+            for _, future, _ in pending:
+                self.__midi.cancel(future)
+
+    def __store_pattern(self, slot, sysex, patterns):
+        if len(sysex) != PolyD_Cmd.PATTERN_SYX_SIZE:
+            raise PolyD_MidiException("Invalid pattern sysex (wrong size)")
+        patterns[slot] = sysex
+        self.state.set_pattern(*slot, sysex)
 
     def set_pattern(self, sysex, bank, pattern):
+        """ Writes a pattern without waiting for an error. The pattern is
+            not mirrored, because it is not known if it was accepted. """
         if bank is not None or pattern is not None:
-            if bank is None or pattern is None:
-                raise PolyD_InvalidArgumentException("'bank' and 'pattern' must be specified.")
-            self.__check_range(bank, 1, 8, "bank")
-            self.__check_range(pattern, 1, 8, "pattern")
+            self.check_slot(bank, pattern)
             sysex = bytearray(sysex)
             sysex[9] = bank - 1
             sysex[10] = pattern - 1
         self.__midi.write(sysex)
+        self.state.forget_pattern(sysex[9] + 1, sysex[10] + 1)
 
+    @_requests
     def get_version(self):
         sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.GET_FW_VERSION, 0 ])
-        answer = self.__midi.sysex_communicate(sysex)
-        return answer.data[-3:]
+        match = PolyD_Cmd.make_reply_matcher(PolyD_Cmd.FW_VERSION_RESULT)
+        answer = yield from self.__communicate(sysex, match, PolyD_Policies.VERSION)
+        version = tuple(answer[-4:-1])
+        self.pacer.firmware = version
+        return version
 
+    @_requests
     def set_id(self, value):
         name = "device id"
         self.__check_range(value, 0, 127, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_DEVICE_ID, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.DEVICE_ID: value })
 
+    @_requests
     def set_rx_channel(self, rx):
         name = "MIDI rx channel"
         if self.__normalize_text(rx) == 'all':
@@ -56,187 +193,286 @@ class PolyD:
         else:
             rx = int(rx) - 1
         self.__check_range(rx, 0, 16, name)
-        tx = self.__cached_config.midi_tx_channel_value
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MIDI_CHANNELS, 1, tx, rx ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MIDI_RX_CHANNEL: rx })
 
+    @_requests
     def set_tx_channel(self, tx):
         name = "MIDI tx channel"
         tx = int(tx) - 1
         self.__check_range(tx, 0, 15, name)
-        rx = self.__cached_config.midi_rx_channel_value
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MIDI_CHANNELS, 1, tx, rx ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MIDI_TX_CHANNEL: tx })
 
+    @_requests
     def set_in_transpose(self, value):
         name = "MIDI in transpose value"
         self.__check_range(value, -12, 12, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MIDI_IN_TRANSPOSE, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MIDI_IN_TRANSPOSE: value + 12 })
 
+    @_requests
     def set_velocity_on(self, vel_on):
         name = "note on velocity"
         self.__check_range(vel_on, 0, 127, name)
-        vel_off = self.__cached_config.note_off_velocity
-        vel_curve = self.__cached_config.velocity_curve_value
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_VELOCITY_INFO, vel_on, vel_off, vel_curve ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.NOTE_ON_VELOCITY: vel_on })
 
+    @_requests
     def set_velocity_off(self, vel_off):
         name = "note off velocity"
         self.__check_range(vel_off, 0, 127, name)
-        vel_on = self.__cached_config.note_on_velocity
-        vel_curve = self.__cached_config.velocity_curve_value
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_VELOCITY_INFO, vel_on, vel_off, vel_curve ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.NOTE_OFF_VELOCITY: vel_off })
 
+    @_requests
     def set_velocity_curve(self, vel_curve_text):
         name = "velocity curve"
         vel_curve = self.__text_to_value(vel_curve_text, PolyD_Config.CURVES, name)
-        vel_on = self.__cached_config.note_on_velocity
-        vel_off = self.__cached_config.note_off_velocity
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_VELOCITY_INFO, vel_on, vel_off, vel_curve ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.VELOCITY_CURVE: vel_curve })
 
+    @_requests
     def set_key_priority(self, key_prio_text):
         name = "key priority"
         key_prio = self.__text_to_value(key_prio_text, PolyD_Config.KEY_PRIORITIES, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_KEY_PRIORITY, key_prio ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.KEY_PRIORITY: key_prio })
 
+    @_requests
     def set_multi_trig(self, text):
         name = "multi trigger"
         value = self.__text_to_value(text, self.__BOOL_TEXTS, name)
         value = value % 2
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MULTI_TRIGGER, value, 0 ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MULTI_TRIGGER: value })
 
+    @_requests
     def set_pbend_range(self, value):
         name = "pitch bend range"
         self.__check_range(value, 0, 24, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_PITCH_BEND_RANGE, value, 0 ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.PITCH_BEND_RANGE: value })
 
+    @_requests
     def set_mod_range(self, text):
         name = "mod wheel range"
         value = self.__text_to_value(text, PolyD_Config.MOD_RANGES, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MOD_WHEEL_RANGE, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MOD_WHEEL_RANGE: value })
 
+    @_requests
     def set_mod_curve(self, text):
         name = "modulation curve"
         value = self.__text_to_value(text, PolyD_Config.CURVES, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MOD_CURVE, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MODULATION_CURVE: value })
 
+    @_requests
     def set_note_zero(self, value):
         name = "note at 0 CV"
         self.__check_range(value, 0, 127, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_NOTE_AT_ZERO, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.NOTE_AT_ZERO_CV: value })
 
+    @_requests
     def set_sync_rate(self, text):
         name = "sync clock rate"
         value = self.__text_to_value(text, PolyD_Config.CLOCKS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_SYNC_RATE, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.SYNC_CLOCK_RATE: value })
 
+    @_requests
     def set_sync_source(self, text):
         name = "sync clock source"
         value = self.__text_to_value(text, PolyD_Config.SYNC_PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_CLOCK_SOURCE, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.SYNC_CLOCK_SOURCE: value })
 
+    @_requests
     def set_local_mode(self, text):
         name = "local keyboard mode"
         value = self.__text_to_value(text, self.__BOOL_TEXTS, name)
         value = (value % 2) ^ 1 # Invert, because 0 means 'on'
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_LOCAL_MODE, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.LOCAL_KEYBOARD_MODE: value })
 
+    @_requests
     def set_ext_clock_polarity(self, text):
         name = "external clock polarity"
         value = self.__text_to_value(text, PolyD_Config.POLARITIES, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_EXT_CLOCK_POLARITY, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.EXT_CLOCK_POLARITY: value })
 
+    @_requests
     def set_accent_velocity(self, value):
         name = "accen velocity"
         self.__check_range(value, 0, 127, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_ACCENT_VELOCITY, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.ACCENT_VELOCITY: value })
 
+    @_requests
     def set_clock_out(self, text):
         name = "MIDI clock output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_CLOCK_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MIDI_CLOCK_OUTPUT: value })
 
+    @_requests
     def set_pbend_out(self, text):
         name = "pitch wheel MIDI output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_PITCH_BEND_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.PITCH_WHEEL_OUTPUT: value })
 
+    @_requests
     def set_mod_out(self, text):
         name = "modulation wheel MIDI output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_MOD_WHEEL_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.MOD_WHEEL_OUTPUT: value })
 
+    @_requests
     def set_key_out(self, text):
         name = "keyboard MIDI output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_KEY_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.KEYBOARD_OUTPUT: value })
 
+    @_requests
     def set_at_out(self, text):
         name = "after touch MIDI output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_AFTER_TOUCH_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.AFTER_TOUCH_OUTPUT: value })
 
+    @_requests
     def set_seq_out(self, text):
         name = "sequencer MIDI output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_SEQ_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.SEQUENCER_OUTPUT: value })
 
+    @_requests
     def set_arp_out(self, text):
         name = "arpeggiator MIDI output"
         value = self.__text_to_value(text, PolyD_Config.PORTS, name)
-        sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_ARP_OUT, value ])
-        self.send_config_sysex(sysex, name)
+        yield from self.__set_settings(name, { PolyD_Config.ARPEGGIATOR_OUTPUT: value })
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Collects the settings changed by the setters inside the 'with' block
+            and writes them when the block is left. Values that are set by
+            the same sysex command are merged into one message. If many
+            commands would be needed, all settings are written at once. """
+        if self.in_transaction:
+            yield self
+            return
+        with self.collect_settings() as (changes, names):
+            yield self
+        self.write_settings(changes, names)
+
+    @contextlib.contextmanager
+    def collect_settings(self):
+        """ Collects the settings changed by the setters inside the 'with' block
+            without writing them. Yields two dicts that map the settings indices
+            to the new values and to the names of the settings. """
+        if self.in_transaction:
+            yield self.__changes.get()
+            return
+        token = self.__changes.set(({}, {}))
+        try:
+            yield self.__changes.get()
+        finally:
+            self.__changes.reset(token)
 
+    @property
+    def in_transaction(self):
+        return self.__changes.get() is not None
+
+    @_requests
     def factory_restore(self):
         name = "factory restore"
         sysex = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.RESTORE_FACTORY_SETTINGS ])
-        self.send_config_sysex(sysex, name)
+        yield from PolyD.send_config_sysex.steps(self, sysex, name)
 
+    @_requests
     def send_config_sysex(self, sysex, name):
         if sysex[0] != 0xF0 or sysex[-1] != 0xF7:
             raise PolyD_MidiException("Invalid sysex data")
-        answer = self.__midi.sysex_communicate(sysex)
-        if answer.data[-2] != 0:
+        match = PolyD_Cmd.make_result_matcher(sysex)
+        # Only lost answers are retried. The Poly D rejects an invalid
+        # value every time, so a rejection is reported right away.
+        answer = yield from self.__communicate(sysex, match, PolyD_Policies.SETTINGS)
+        if any(answer[9:-1]):
             raise PolyD_MidiException(f"Could not set the {name}")
-        self._config = None
+        self.state.apply_sysex(sysex)
 
+    @_requests
     def send_pattern_sysex(self, sysex):
-        if sysex[0] != 0xF0 or sysex[-1] != 0xF7:
-            raise PolyD_MidiException("Invalid sysex data")
-        self.__midi.write(sysex)
-        # Wait shortly for an answer. No answer means that erverything is ok.
-        # Otherwise an error response is sent.
-        # Without waiting here setting sequences does not work reliably, because
-        # the Poly-D reports an error as well when the next sysex packet arrives
-        # too soon after this one.
-        time.sleep(0.1)
-        answer = self.try_read()
-        if  answer is not None:
+        if (yield from PolyD.send_patterns.steps(self, [ sysex ])):
             raise PolyD_MidiException("Could not set pattern")
 
-    def try_read(self):
-        return self.__midi.try_read()
+    @_requests
+    def send_patterns(self, sysexes):
+        """ Writes pattern sysexes and returns the (bank, pattern) slots of
+            the ones the Poly D did not accept. """
+        for sysex in sysexes:
+            if sysex[0] != 0xF0 or sysex[-1] != 0xF7:
+                raise PolyD_MidiException("Invalid sysex data")
+        # Without a gap between two patterns setting sequences does not work
+        # reliably, because the Poly-D reports an error when the next sysex
+        # packet arrives too soon after this one.
+        failed = yield from self.pacer.send_steps(self.__midi, sysexes, self.policies[PolyD_Policies.PATTERN_WRITE].retries)
+        for i, sysex in enumerate(sysexes):
+            if i not in failed:
+                self.state.apply_sysex(sysex)
+        return [ (sysexes[i][9] + 1, sysexes[i][10] + 1) for i in failed ]
+
+    def __communicate(self, sysex, match, command_class):
+        # Sends a request and waits for the answer. Lost answers are
+        # requested again as the policy of the command class allows.
+        timeouts = self.policies[command_class].timeouts()
+        for attempt, timeout in enumerate(timeouts, 1):
+            future = self.__midi.expect(match, sysex)
+            start = time.monotonic()
+            try:
+                self.__midi.write(sysex)
+            except:
+                self.__midi.cancel(future)
+                raise
+            answer = yield future, timeout
+            if answer is None:
+                self.__timed_out(sysex)
+                if attempt == len(timeouts):
+                    raise MidiException("Timeout while waiting for answer from MIDI device.")
+                continue
+            if command_class != PolyD_Policies.PATTERN_FETCH:
+                # The short answers tell the pacer how long errors take
+                self.pacer.observe(time.monotonic() - start)
+            return answer
+
+    def __timed_out(self, request):
+        stats = self.__midi.stats
+        if stats is not None:
+            stats.timed_out(stats.command(request))
+
+    def __set_settings(self, name, changes):
+        names = { index: name for index in changes }
+        if self.in_transaction:
+            collected = self.__changes.get()
+            collected[0].update(changes)
+            collected[1].update(names)
+        else:
+            yield from PolyD.write_settings.steps(self, changes, names)
+
+    @_requests
+    def write_settings(self, changes, names):
+        """ Writes settings collected with collect_settings(). Values that
+            are not changed are sent as well where a command needs them, the
+            configuration is requested for them if it is not known. """
+        commands = PolyD_Cmd.get_settings_commands(changes.keys())
+        if len(commands) >= self.FULL_WRITE_THRESHOLD:
+            config = yield from PolyD.get_config.steps(self)
+            sysex = config.with_values(changes).sysex
+            yield from PolyD.send_config_sysex.steps(self, sysex, "configuration")
+            return
+        for cmd in commands:
+            indices = PolyD_Cmd.SETTINGS_LAYOUT[cmd][1]
+            if all(index in changes for index in indices):
+                settings = changes
+            else:
+                config = yield from PolyD.get_config.steps(self)
+                settings = config.with_values(changes).values
+            sysex = PolyD_Cmd.make_settings_sysex(0, cmd, settings)
+            name = " and ".join(dict.fromkeys(names[index] for index in indices if index in changes))
+            yield from PolyD.send_config_sysex.steps(self, sysex, name)
+
+    def check_slot(self, bank, pattern):
+        if bank is None or pattern is None:
+            raise PolyD_InvalidArgumentException("'bank' and 'pattern' must be specified.")
+        self.__check_range(bank, 1, 8, "bank")
+        self.__check_range(pattern, 1, 8, "pattern")
+
+    def try_read(self, message_class=None):
+        return self.__midi.try_read(message_class)
 
     def __check_range(self, value, min, max, name):
         if value < min or value > max:
@@ -245,15 +481,9 @@ class PolyD:
     def __text_to_value(self, text, allowed, name):
         value = self.__get_value(text, allowed)
         if value < 0 or value >= len(allowed):
-            raise PolyD_InvalidArgumentException(f"Invalid {name} '{vtext}'")
+            raise PolyD_InvalidArgumentException(f"Invalid {name} '{text}'")
         return value
 
-    @property
-    def __cached_config(self):
-        if self.__config is None:
-            self.get_config()
-        return self.__config
-
     @staticmethod
     def __get_value(text, values):
         text = PolyD.__normalize_text(text)
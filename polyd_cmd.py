@@ -1,3 +1,8 @@
+import hashlib
+import re
+
+from polyd_exc import PolyD_InvalidArgumentException
+
 class PolyD_Cmd:
     SET_DEVICE_ID            = 0x00
     RESULT                   = 0x01
@@ -32,6 +37,34 @@ class PolyD_Cmd:
     SEQ_PATTERN              = 0x78
     RESTORE_FACTORY_SETTINGS = 0x7D
 
+    # Layout of the commands that change settings: constant bytes before the
+    # values, indices of the values in the settings block and constant bytes
+    # after the values.
+    SETTINGS_LAYOUT = {
+        SET_DEVICE_ID:          ((),   (0,),      ()),
+        SET_MIDI_CHANNELS:      ((1,), (2, 1),    ()),
+        SET_MIDI_IN_TRANSPOSE:  ((),   (3,),      ()),
+        SET_VELOCITY_INFO:      ((),   (4, 5, 6), ()),
+        SET_PITCH_BEND_RANGE:   ((),   (9,),      (0,)),
+        SET_KEY_PRIORITY:       ((),   (7,),      ()),
+        SET_MULTI_TRIGGER:      ((),   (8,),      (0,)),
+        SET_MOD_CURVE:          ((),   (11,),     ()),
+        SET_NOTE_AT_ZERO:       ((),   (12,),     ()),
+        SET_CLOCK_OUT:          ((),   (18,),     ()),
+        SET_EXT_CLOCK_POLARITY: ((),   (16,),     ()),
+        SET_SYNC_RATE:          ((),   (13,),     ()),
+        SET_CLOCK_SOURCE:       ((),   (14,),     ()),
+        SET_ACCENT_VELOCITY:    ((),   (17,),     ()),
+        SET_MOD_WHEEL_RANGE:    ((),   (10,),     ()),
+        SET_MOD_WHEEL_OUT:      ((),   (20,),     ()),
+        SET_PITCH_BEND_OUT:     ((),   (19,),     ()),
+        SET_KEY_OUT:            ((),   (21,),     ()),
+        SET_AFTER_TOUCH_OUT:    ((),   (22,),     ()),
+        SET_SEQ_OUT:            ((),   (23,),     ()),
+        SET_ARP_OUT:            ((),   (24,),     ()),
+        SET_LOCAL_MODE:         ((),   (15,),     ()),
+    }
+
     SEQ_PREFIX = (0x23, 0x98, 0x54, 0x76, 0x00, 0x00, 0x00, 0x0C,
                   0x00, 0x50, 0x00, 0x4F, 0x00, 0x4C, 0x00, 0x59,
                   0x00, 0x20, 0x00, 0x44, 0x00, 0x00, 0x00, 0x0A,
@@ -42,6 +75,9 @@ class PolyD_Cmd:
                   0x00, 0x20, 0x32,  # Manufacturer Id
                   0x00, 0x01, 0x0c)  # Model Id
     
+    # Names of the pattern slots, e.g. 'b1p2' for bank 1 pattern 2
+    SLOT_NAME = r'b([1-8])\s*p([1-8])'
+
     SEQ_SIZE = 411
     PATTERN_SYX_SIZE = 389
     PATTERN_SIZE = 373
@@ -54,6 +90,73 @@ class PolyD_Cmd:
         sysex.append(0xF7)
         return sysex
 
+    @staticmethod
+    def make_settings_sysex(did, cmd, settings):
+        """ Creates the sysex of a settings command. 'settings' maps the
+            indices in the settings block to their values. """
+        prefix, indices, suffix = PolyD_Cmd.SETTINGS_LAYOUT[cmd]
+        data = [ cmd ]
+        data.extend(prefix)
+        data.extend([ settings[index] for index in indices ])
+        data.extend(suffix)
+        return PolyD_Cmd.make_sysex(did, data)
+
+    @staticmethod
+    def decode_settings_sysex(sysex):
+        """ Returns the settings indices and values written by a settings command. """
+        prefix, indices, suffix = PolyD_Cmd.SETTINGS_LAYOUT[sysex[8]]
+        start = 9 + len(prefix)
+        return dict(zip(indices, sysex[start:start + len(indices)]))
+
+    @staticmethod
+    def get_settings_commands(indices):
+        """ Returns the settings commands that write any of the given indices. """
+        indices = set(indices)
+        return [ cmd for cmd, layout in PolyD_Cmd.SETTINGS_LAYOUT.items()
+                    if indices.intersection(layout[1]) ]
+
+    @staticmethod
+    def make_reply_matcher(cmd, *args):
+        """ Returns a function that checks if a sysex is a Poly D answer with
+            the given command and first arguments. """
+        prefix = list(PolyD_Cmd.SYX_PREFIX)
+        args = list(args)
+        size = 9 + len(args)
+        def match(sysex):
+            return len(sysex) > size and list(sysex[:7]) == prefix and \
+                   sysex[8] == cmd and list(sysex[9:size]) == args
+        return match
+
+    @staticmethod
+    def make_result_matcher(request):
+        """ Returns a function that checks if a sysex is the RESULT answer to
+            'request'. A RESULT does not name the command it answers, so it is
+            only accepted from the device the request was addressed to. Device
+            id 0 is answered by every Poly D. """
+        match_result = PolyD_Cmd.make_reply_matcher(PolyD_Cmd.RESULT)
+        did = request[7]
+        def match(sysex):
+            return match_result(sysex) and (did == 0 or sysex[7] == did)
+        return match
+
+    @staticmethod
+    def slot_name(bank, pattern):
+        """ Returns the name of a slot, which parse_slot() reads. """
+        return f"b{bank}p{pattern}"
+
+    @staticmethod
+    def parse_slot(name, suffix=None):
+        """ Returns the (bank, pattern) slot of a name like 'b1p2' or
+            (None, None). With 'suffix' the slot name is looked for at the
+            end of a file name, e.g. 'b1p2.seq' in 'live/b1p2.seq'. """
+        if suffix is None:
+            match = re.fullmatch(PolyD_Cmd.SLOT_NAME, name, re.IGNORECASE)
+        else:
+            match = re.search(PolyD_Cmd.SLOT_NAME + re.escape(suffix) + '$', name, re.IGNORECASE)
+        if match is None:
+            return (None, None)
+        return (int(match.group(1)), int(match.group(2)))
+
     @staticmethod
     def extract_pattern_from_syx(sysex):
         if len(sysex) != PolyD_Cmd.PATTERN_SYX_SIZE:
@@ -106,7 +209,14 @@ class PolyD_Cmd:
 
     @staticmethod
     def calc_pattern_checksum(pattern_data):
-        sum = 0
-        for i in range(len(pattern_data)):
-            sum += pattern_data[i]
-        return (sum & 0x7f, (sum & 0x80) >> 7)
+        total = sum(pattern_data)
+        return (total & 0x7f, (total & 0x80) >> 7)
+
+    @staticmethod
+    def calc_hash(data):
+        """ The content hash used for patterns and snapshot data. """
+        return hashlib.sha1(bytes(data)).hexdigest()
+
+    @staticmethod
+    def calc_pattern_hash(pattern_data):
+        return PolyD_Cmd.calc_hash(pattern_data)
@@ -0,0 +1,106 @@
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_InvalidArgumentException
+
+# The 326 bytes of pattern data are sent in groups of one byte holding the
+# high bits followed by seven bytes with the lower seven bits. Bit n of the
+# first byte is the high bit of the n-th byte of the group.
+#
+# The codec works on whole columns instead of single bytes: the n-th bytes
+# of all groups are cut out with one extended slice, their bits are moved
+# with precomputed translation tables and combined as big integers. As every
+# pattern is padded to full groups, a stack of many patterns is processed
+# with the same handful of operations as a single pattern.
+
+RAW_SIZE = 326
+STEP_SIZE = 10
+STEP_COUNT = 32
+STEPS_SIZE = STEP_SIZE * STEP_COUNT
+CONFIG_SIZE = RAW_SIZE - STEPS_SIZE
+
+_GROUP_SIZE = 8
+_PADDED_SIZE = 376
+_PADDED_RAW_SIZE = 329
+
+_HIGH_BIT_TABLES = [ bytes(((v >> n) & 1) << 7 for v in range(256)) for n in range(7) ]
+_LOW_BITS_TABLE = bytes(v & 0x7F for v in range(256))
+_TO_HIGH_BYTE_TABLES = [ bytes(((v >> 7) & 1) << n for v in range(256)) for n in range(7) ]
+
+def decode_pattern(pattern_data):
+    """ Decodes 373 bytes of 7 bit encoded pattern data into 326 bytes. """
+    if len(pattern_data) != PolyD_Cmd.PATTERN_SIZE:
+        raise PolyD_InvalidArgumentException("Invalid pattern (wrong size)")
+    return decode_patterns(pattern_data)
+
+def encode_pattern(raw):
+    """ Encodes 326 bytes of pattern data into 373 bytes with 7 bit encoding. """
+    if len(raw) != RAW_SIZE:
+        raise PolyD_InvalidArgumentException("Invalid decoded pattern (wrong size)")
+    return encode_patterns(raw)
+
+def decode_patterns(patterns):
+    """ Decodes a stack of patterns at once. 'patterns' is either a sequence of
+        373 byte patterns or one bytes-like object with the patterns stored
+        back to back. The result holds the decoded 326 byte patterns back to
+        back. """
+    padded = _pad(patterns, PolyD_Cmd.PATTERN_SIZE, _PADDED_SIZE)
+    high_bytes = padded[0::_GROUP_SIZE]
+    raw = bytearray(len(high_bytes) * 7)
+    for n in range(7):
+        high_bits = high_bytes.translate(_HIGH_BIT_TABLES[n])
+        raw[n::7] = _or(padded[n + 1::_GROUP_SIZE], high_bits)
+    return _unpad(raw, _PADDED_RAW_SIZE, RAW_SIZE)
+
+def encode_patterns(raws):
+    """ Encodes a stack of decoded patterns at once.
+        See decode_patterns() for the layout of the arguments. """
+    padded = _pad(raws, RAW_SIZE, _PADDED_RAW_SIZE)
+    groups = len(padded) // 7
+    data = bytearray(groups * _GROUP_SIZE)
+    high_bytes = 0
+    for n in range(7):
+        column = padded[n::7]
+        data[n + 1::_GROUP_SIZE] = column.translate(_LOW_BITS_TABLE)
+        high_bytes |= int.from_bytes(column.translate(_TO_HIGH_BYTE_TABLES[n]), 'little')
+    data[0::_GROUP_SIZE] = high_bytes.to_bytes(groups, 'little')
+    return _unpad(data, _PADDED_SIZE, PolyD_Cmd.PATTERN_SIZE)
+
+def pattern_count(raws):
+    return len(raws) // RAW_SIZE
+
+def pattern_view(raws, index=0):
+    """ Returns a view of the decoded pattern 'index' of a stack. """
+    start = index * RAW_SIZE
+    return memoryview(raws)[start:start + RAW_SIZE]
+
+def steps_view(raws, index=0):
+    """ Returns a view of the 320 step bytes of a decoded pattern. """
+    start = index * RAW_SIZE
+    return memoryview(raws)[start:start + STEPS_SIZE]
+
+def config_view(raws, index=0):
+    """ Returns a view of the 6 configuration bytes of a decoded pattern. """
+    start = index * RAW_SIZE + STEPS_SIZE
+    return memoryview(raws)[start:start + CONFIG_SIZE]
+
+def _or(a, b):
+    size = len(a)
+    return (int.from_bytes(a, 'little') | int.from_bytes(b[:size], 'little')).to_bytes(size, 'little')
+
+def _pad(items, size, padded_size):
+    if isinstance(items, (bytes, bytearray, memoryview)):
+        items = memoryview(items).cast('B')
+        if len(items) % size != 0:
+            raise PolyD_InvalidArgumentException("Invalid pattern stack (wrong size)")
+        items = [ items[i:i + size] for i in range(0, len(items), size) ]
+    padding = bytes(padded_size - size)
+    parts = []
+    for item in items:
+        if len(item) != size:
+            raise PolyD_InvalidArgumentException("Invalid pattern (wrong size)")
+        parts.append(item)
+        parts.append(padding)
+    return bytearray(b''.join(parts))
+
+def _unpad(data, padded_size, size):
+    view = memoryview(data)
+    return bytearray(b''.join([ view[i:i + size] for i in range(0, len(data), padded_size) ]))
@@ -9,6 +9,35 @@ class PolyD_Config:
     MOD_RANGES = [ '20%', '50%', '100%', '200%', '300%' ]
     OFF_ON = ( 'off', 'on' )
 
+    # Indices of the values in the settings block
+    DEVICE_ID           = 0
+    MIDI_RX_CHANNEL     = 1
+    MIDI_TX_CHANNEL     = 2
+    MIDI_IN_TRANSPOSE   = 3
+    NOTE_ON_VELOCITY    = 4
+    NOTE_OFF_VELOCITY   = 5
+    VELOCITY_CURVE      = 6
+    KEY_PRIORITY        = 7
+    MULTI_TRIGGER       = 8
+    PITCH_BEND_RANGE    = 9
+    MOD_WHEEL_RANGE     = 10
+    MODULATION_CURVE    = 11
+    NOTE_AT_ZERO_CV     = 12
+    SYNC_CLOCK_RATE     = 13
+    SYNC_CLOCK_SOURCE   = 14
+    LOCAL_KEYBOARD_MODE = 15
+    EXT_CLOCK_POLARITY  = 16
+    ACCENT_VELOCITY     = 17
+    MIDI_CLOCK_OUTPUT   = 18
+    PITCH_WHEEL_OUTPUT  = 19
+    MOD_WHEEL_OUTPUT    = 20
+    KEYBOARD_OUTPUT     = 21
+    AFTER_TOUCH_OUTPUT  = 22
+    SEQUENCER_OUTPUT    = 23
+    ARPEGGIATOR_OUTPUT  = 24
+    SIZE                = 25
+    SYSEX_SIZE          = 35
+
     def __init__(self, data):
         self.__data = data
 
@@ -148,3 +177,16 @@ class PolyD_Config:
     @property
     def sysex(self):
         return self.__data
+
+    @property
+    def values(self):
+        """ The settings block without the sysex header. """
+        return self.__data[self.__OFFSET:self.__OFFSET + self.SIZE]
+
+    def with_values(self, values):
+        """ Returns a copy of the configuration with the values at the given
+            settings indices replaced. """
+        data = bytearray(self.__data)
+        for index, value in values.items():
+            data[self.__OFFSET + index] = value
+        return PolyD_Config(bytes(data))
@@ -0,0 +1,186 @@
+import concurrent.futures
+import glob
+import os
+import zipfile
+import zlib
+
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_Exception
+
+FORMATS = ('seq', 'syx', 'zip')
+EXTENSIONS = ('.seq', '.syx', '.zip')
+CONFIGNAME = "config.syx"
+
+class PolyD_ConvertJob:
+    """ Converts one or more input files into one output.
+        Jobs are executed in worker processes and only hold plain data. """
+
+    def __init__(self, inputs, output, format, bank=None, pattern=None):
+        self.inputs = inputs
+        self.output = output
+        self.format = format
+        self.bank = bank
+        self.pattern = pattern
+
+    def run(self):
+        """ Returns the number of converted patterns and a list of error messages. """
+        patterns = []
+        config = None
+        errors = []
+        for path in self.inputs:
+            try:
+                file_patterns, file_config = read_patterns(path)
+            except (OSError, zipfile.BadZipFile, zlib.error, PolyD_Exception) as exc:
+                # A damaged zip member makes the whole file fail
+                errors.append(f"{path}: {getattr(exc, 'message', exc)}")
+                continue
+            patterns.extend(file_patterns)
+            config = config if file_config is None else file_config
+        if (self.bank is not None or self.pattern is not None) and len(patterns) > 1:
+            errors.append(f"{self.output}: --bank and --pattern can only be used for a single pattern, "
+                          f"but there are {len(patterns)}.")
+            return (0, errors)
+        try:
+            patterns = [ (self.__retarget(slot, path), path, data) for slot, path, data in patterns ]
+            self.__write(patterns, config)
+        except (OSError, PolyD_Exception) as exc:
+            errors.append(f"{self.output}: {getattr(exc, 'message', exc)}")
+            return (0, errors)
+        return (len(patterns), errors)
+
+    def __retarget(self, slot, path):
+        bank = self.bank if self.bank is not None else slot[0]
+        pattern = self.pattern if self.pattern is not None else slot[1]
+        if bank is None or pattern is None:
+            if self.format == 'seq':
+                return (bank, pattern)
+            raise PolyD_Exception(f"Bank and pattern of '{path}' are unknown, use --bank and --pattern.")
+        if bank < 1 or bank > 8:
+            raise PolyD_Exception(f"Invalid bank number '{bank}'")
+        if pattern < 1 or pattern > 8:
+            raise PolyD_Exception(f"Invalid pattern number '{pattern}'")
+        return (bank, pattern)
+
+    def __write(self, patterns, config):
+        directory = os.path.dirname(self.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if len(patterns) == 1 and self.format != 'zip':
+            slot, _, data = patterns[0]
+            self.__write_file(self.output, self.__convert(slot, data))
+            return
+        slots = [ slot for slot, _, _ in patterns ]
+        if None in [ value for slot in slots for value in slot ]:
+            raise PolyD_Exception("Bank and pattern numbers are unknown.")
+        if len(set(slots)) != len(slots):
+            raise PolyD_Exception("Several patterns use the same bank and pattern number.")
+        if self.format == 'zip':
+            with zipfile.ZipFile(self.output, "w") as zip:
+                if config is not None:
+                    zip.writestr(CONFIGNAME, config)
+                for (bank, pattern), _, data in sorted(patterns):
+                    zip.writestr(PolyD_Cmd.slot_name(bank, pattern) + ".seq", PolyD_Cmd.pattern2Seq(data))
+            return
+        os.makedirs(self.output, exist_ok=True)
+        for (bank, pattern), _, data in patterns:
+            filename = os.path.join(self.output, f"{PolyD_Cmd.slot_name(bank, pattern)}.{self.format}")
+            self.__write_file(filename, self.__convert((bank, pattern), data))
+
+    def __convert(self, slot, data):
+        if self.format == 'seq':
+            return PolyD_Cmd.pattern2Seq(data)
+        return PolyD_Cmd.pattern2syx(0, slot[0], slot[1], data)
+
+    @staticmethod
+    def __write_file(filename, data):
+        with open(filename, "wb") as fp:
+            fp.write(data)
+
+def run_job(job):
+    return job.run()
+
+def read_patterns(path):
+    """ Reads and validates the patterns in a seq, syx or zip file.
+        Returns a list of ((bank, pattern), path, pattern data) and the
+        configuration sysex of a zip file. Unknown slots are None. """
+    if zipfile.is_zipfile(path):
+        patterns = []
+        config = None
+        with zipfile.ZipFile(path, "r") as zip:
+            for name in zip.namelist():
+                data = zip.read(name)
+                if name == CONFIGNAME:
+                    config = data
+                elif name.lower().endswith(".seq"):
+                    patterns.append((PolyD_Cmd.parse_slot(name, ".seq"), f"{path}:{name}",
+                                     PolyD_Cmd.extract_pattern_from_seq(data)))
+        return (patterns, config)
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if path.lower().endswith(".syx"):
+        pattern_data = PolyD_Cmd.extract_pattern_from_syx(data)
+        if data[8] != PolyD_Cmd.SEQ_PATTERN:
+            raise PolyD_Exception("No pattern sysex")
+        if tuple(data[13:15]) != PolyD_Cmd.calc_pattern_checksum(pattern_data):
+            raise PolyD_Exception("Wrong checksum")
+        return ([ ((data[9] + 1, data[10] + 1), path, pattern_data) ], None)
+    return ([ (PolyD_Cmd.parse_slot(path, ".seq"), path, PolyD_Cmd.extract_pattern_from_seq(data)) ], None)
+
+def find_inputs(paths):
+    """ Expands directories and glob patterns into a sorted list of pattern files. """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.update(os.path.join(root, n) for n in names if n.lower().endswith(EXTENSIONS))
+        else:
+            matches = glob.glob(path, recursive=True)
+            files.update(m for m in matches if os.path.isfile(m))
+            if not matches and os.path.isfile(path):
+                files.add(path)
+    return sorted(files)
+
+def make_jobs(inputs, out_dir, format, bank=None, pattern=None):
+    """ Creates the conversion jobs. For the zip format the loose pattern files
+        of every directory are bundled into one zip file. The outputs keep the
+        paths of the inputs relative to their common directory, so files with
+        the same name in different directories do not overwrite each other.
+        Raises a PolyD_Exception if two inputs would still be written to the
+        same output. """
+    jobs = []
+    bundles = {}
+    base = os.path.commonpath([ os.path.dirname(os.path.abspath(path)) for path in inputs ]) if inputs else ""
+    for path in inputs:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        target = os.path.join(out_dir, os.path.relpath(os.path.dirname(os.path.abspath(path)), base))
+        if format == 'zip' and not path.lower().endswith(".zip"):
+            directory = os.path.dirname(os.path.abspath(path))
+            bundles.setdefault(directory, []).append(path)
+        elif format == 'zip':
+            jobs.append(PolyD_ConvertJob([ path ], os.path.join(target, stem + ".zip"), format, bank, pattern))
+        elif path.lower().endswith(".zip"):
+            jobs.append(PolyD_ConvertJob([ path ], os.path.join(target, stem), format, bank, pattern))
+        else:
+            jobs.append(PolyD_ConvertJob([ path ], os.path.join(target, f"{stem}.{format}"), format, bank, pattern))
+    for directory, paths in sorted(bundles.items()):
+        if directory == base:
+            name = os.path.basename(directory) or "patterns"
+        else:
+            name = os.path.relpath(directory, base)
+        jobs.append(PolyD_ConvertJob(paths, os.path.join(out_dir, name + ".zip"), format, bank, pattern))
+    outputs = {}
+    for job in jobs:
+        output = os.path.normpath(job.output)
+        if output in outputs:
+            raise PolyD_Exception(f"'{outputs[output]}' and '{job.inputs[0]}' would both be written to '{output}'.")
+        outputs[output] = job.inputs[0]
+    return jobs
+
+def convert(jobs, workers=None):
+    """ Runs the jobs in a process pool and yields (job, count, errors)
+        as soon as each job is finished. """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = { executor.submit(run_job, job): job for job in jobs }
+        for future in concurrent.futures.as_completed(futures):
+            count, errors = future.result()
+            yield (futures[future], count, errors)
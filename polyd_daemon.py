@@ -0,0 +1,334 @@
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import midiports
+
+from midiconnection import MidiConnection, MidiException
+from polyd import PolyD
+from polyd_config import PolyD_Config
+from polyd_exc import PolyD_Exception, PolyD_InvalidArgumentException, PolyD_MidiException
+from polyd_pacing import PolyD_Pacer
+
+# The setters of PolyD that can be called through the daemon
+SETTERS = tuple(name for name in vars(PolyD) if name.startswith('set_') and name != 'set_pattern')
+
+def default_socket():
+    """ Returns the path of the daemon socket, which can be set with the
+        environment variable POLYD_DAEMON_SOCKET. """
+    path = os.environ.get('POLYD_DAEMON_SOCKET')
+    if path:
+        return path
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser("~"), ".config", "polyd-cli")
+    return os.path.join(directory, "polyd-daemon.sock")
+
+class PolyD_Session:
+    """ Open connection to one Poly D. The firmware version is requested
+        once. The configuration and patterns mirrored by the PolyD object are
+        kept for the following clients while the settings on the instrument
+        stay the same, and forgotten when the ports are opened again. Only
+        one request at a time may use the session. """
+
+    def __init__(self, in_id, out_id, backend=None, pacing_file=None):
+        self.ports = (in_id, out_id)
+        self.lock = threading.Lock()
+        self.midi = MidiConnection(backend)
+        self.midi.connect(in_id, out_id)
+        self.pacer = PolyD_Pacer(pacing_file)
+        self.polyd = PolyD(self.midi, self.pacer)
+        try:
+            self.version = self.polyd.get_version()
+        except Exception:
+            self.midi.disconnect()
+            raise
+
+    def check_state(self):
+        """ Reads the settings and forgets the mirrored state if they were
+            changed on the instrument, which is taken as a sign that it was
+            edited there. """
+        mirrored = self.polyd.state.config
+        config = self.polyd.read_settings()
+        if mirrored is None or bytes(mirrored.values) != bytes(config.values):
+            self.polyd.state.invalidate()
+            self.polyd.state.config = config
+
+    def close(self):
+        self.pacer.save()
+        self.midi.disconnect()
+
+class PolyD_Daemon:
+    """ Keeps the MIDI connections to the Poly Ds open and serves requests
+        of PolyD_DaemonClient on a Unix socket. Requests and answers are JSON
+        objects, one per line. A request names the port, a method and its
+        arguments:
+            {"port": "POLY D", "method": "get_pattern", "args": [1, 2]}
+        The answer holds either the result or the error message and the name
+        of the exception class:
+            {"result": "f0002032..."}
+            {"error": "Invalid bank '9'", "type": "PolyD_InvalidArgumentException"}
+        Sysex data is sent as hex strings. """
+
+    def __init__(self, path=None, backend=None, pacing_file=None):
+        self.path = path if path is not None else default_socket()
+        self.__backend = backend
+        self.__pacing_file = pacing_file
+        self.__registry = midiports.MidiPortRegistry(backend) if backend is not None else midiports.default_registry()
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+        self.__server = None
+
+    def serve_forever(self):
+        if is_running(self.path):
+            raise PolyD_Exception(f"A daemon is already listening on '{self.path}'.")
+        if os.path.exists(self.path):
+            os.unlink(self.path)    # left over by a daemon that was killed
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                sessions = set()
+                for line in self.rfile:
+                    answer = daemon.handle_request(line, sessions)
+                    self.wfile.write(json.dumps(answer).encode() + b"\n")
+                    self.wfile.flush()
+
+        self.__server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.__server.daemon_threads = True
+        os.chmod(self.path, 0o600)
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.__server.server_close()
+            os.unlink(self.path)
+            self.close_sessions()
+
+    def shutdown(self):
+        """ Stops serve_forever() from another thread. """
+        if self.__server is not None:
+            self.__server.shutdown()
+
+    def close_sessions(self):
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+    def handle_request(self, line, sessions=None):
+        """ Executes one request line and returns the answer. 'sessions' are
+            the ports the client used before; the mirrored state is checked
+            against the instrument when a client uses a session for the first
+            time. Without 'sessions' it is checked before every request. """
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError()
+            session = self.__session(request.get('port', ''))
+        except ValueError:
+            return self.__error("Invalid request", PolyD_InvalidArgumentException)
+        except MidiException as exc:
+            return self.__error(exc.message, PolyD_MidiException)
+        except IOError as exc:
+            return self.__error(str(exc), PolyD_MidiException)
+        except Exception as exc:
+            # Any other failure of the MIDI backend is answered as well, the
+            # client would wait for the answer forever otherwise
+            return self.__error(str(exc) or type(exc).__name__, PolyD_MidiException)
+        with session.lock:
+            try:
+                # The firmware version is known without asking the instrument
+                if (sessions is None or session.ports not in sessions) and request.get('method') != 'get_version':
+                    session.check_state()
+                    if sessions is not None:
+                        sessions.add(session.ports)
+                return { 'result': self.__call(session, request.get('method'), request.get('args', [])) }
+            except PolyD_Exception as exc:
+                return self.__error(exc.message, type(exc))
+            except (TypeError, ValueError):
+                return self.__error("Invalid arguments", PolyD_InvalidArgumentException)
+            except (IOError, MidiException) as exc:
+                # The instrument is gone or did not answer. The ports are
+                # opened again by the next request.
+                self.__drop(session)
+                return self.__error(getattr(exc, 'message', str(exc)), PolyD_MidiException)
+
+    def __session(self, port):
+        in_id, out_id = self.__registry.first_pair(port)
+        if in_id is None or out_id is None:
+            self.__registry.refresh()
+            in_id, out_id = self.__registry.first_pair(port)
+            if in_id is None or out_id is None:
+                raise PolyD_Exception("No Poly D found.")
+        with self.__lock:
+            session = self.__sessions.get((in_id, out_id))
+            if session is None:
+                session = PolyD_Session(in_id, out_id, self.__backend, self.__pacing_file)
+                self.__sessions[(in_id, out_id)] = session
+            return session
+
+    @staticmethod
+    def __error(message, exception):
+        return { 'error': message, 'type': exception.__name__ }
+
+    def __drop(self, session):
+        with self.__lock:
+            if self.__sessions.get(session.ports) is session:
+                del self.__sessions[session.ports]
+        session.close()
+
+    @staticmethod
+    def __call(session, method, args):
+        polyd = session.polyd
+        if method == 'get_version':
+            return list(session.version)
+        if method == 'get_config':
+            return bytes(polyd.get_config().sysex).hex()
+        if method == 'refresh':
+            return bytes(polyd.refresh().sysex).hex()
+        if method == 'read_settings':
+            return bytes(polyd.read_settings().sysex).hex()
+        if method == 'get_pattern':
+            return bytes(polyd.get_pattern(*args)).hex()
+        if method == 'get_patterns':
+            slots, window, skip_failed, cached = args
+            patterns = polyd.get_patterns([ tuple(slot) for slot in slots ], window, skip_failed, cached)
+            return [ [ bank, pattern, bytes(sysex).hex() ] for (bank, pattern), sysex in patterns.items() ]
+        if method == 'send_config_sysex':
+            polyd.send_config_sysex(bytes.fromhex(args[0]), args[1])
+        elif method == 'send_pattern_sysex':
+            polyd.send_pattern_sysex(bytes.fromhex(args[0]))
+        elif method == 'send_patterns':
+            return [ list(slot) for slot in polyd.send_patterns([ bytes.fromhex(sysex) for sysex in args ]) ]
+        elif method == 'factory_restore':
+            polyd.factory_restore()
+        elif method == 'set':
+            # All changes are written in one transaction
+            with polyd.transaction():
+                for name, value in args:
+                    if name not in SETTERS:
+                        raise PolyD_InvalidArgumentException(f"Unknown setting '{name}'")
+                    getattr(polyd, name)(value)
+        else:
+            raise PolyD_InvalidArgumentException(f"Unknown method '{method}'")
+        return None
+
+def is_running(path=None):
+    """ Returns True if a daemon listens on the socket. """
+    path = path if path is not None else default_socket()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+class PolyD_DaemonClient:
+    """ Stands in for a PolyD object and lets the daemon execute the
+        commands, so the ports stay open between the calls of the programs.
+        It offers the methods of PolyD that polyd-cli.py uses. """
+
+    __EXCEPTIONS = { cls.__name__: cls for cls in (PolyD_Exception, PolyD_InvalidArgumentException, PolyD_MidiException) }
+
+    def __init__(self, port, path=None):
+        self.port = port
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__socket.connect(path if path is not None else default_socket())
+        self.__file = self.__socket.makefile('rwb')
+        self.__changes = None
+
+    @classmethod
+    def connect(cls, port, path=None):
+        """ Returns a client or None if no daemon is running. """
+        try:
+            return cls(port, path)
+        except OSError:
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.__file.close()
+        self.__socket.close()
+
+    def get_version(self):
+        return tuple(self.__request('get_version'))
+
+    def get_config(self):
+        return PolyD_Config(bytes.fromhex(self.__request('get_config')))
+
+    def refresh(self):
+        return PolyD_Config(bytes.fromhex(self.__request('refresh')))
+
+    def read_settings(self):
+        return PolyD_Config(bytes.fromhex(self.__request('read_settings')))
+
+    def get_pattern(self, bank, pattern, cached=True):
+        return bytes.fromhex(self.__request('get_pattern', bank, pattern, cached))
+
+    def get_patterns(self, slots, window=1, skip_failed=False, cached=True):
+        patterns = self.__request('get_patterns', list(slots), window, skip_failed, cached)
+        return { (bank, pattern): bytes.fromhex(sysex) for bank, pattern, sysex in patterns }
+
+    def send_config_sysex(self, sysex, name):
+        self.__request('send_config_sysex', bytes(sysex).hex(), name)
+
+    def send_pattern_sysex(self, sysex):
+        self.__request('send_pattern_sysex', bytes(sysex).hex())
+
+    def send_patterns(self, sysexes):
+        failed = self.__request('send_patterns', *[ bytes(sysex).hex() for sysex in sysexes ])
+        return [ tuple(slot) for slot in failed ]
+
+    def factory_restore(self):
+        self.__request('factory_restore')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Collects the settings changed inside the 'with' block and lets
+            the daemon write them in one transaction. """
+        if self.__changes is not None:
+            yield self
+            return
+        self.__changes = []
+        try:
+            yield self
+            changes = self.__changes
+        finally:
+            self.__changes = None
+        if changes:
+            self.__request('set', *changes)
+
+    def __getattr__(self, name):
+        # The setters of PolyD
+        if name not in SETTERS:
+            raise AttributeError(name)
+        return lambda value: self.__set(name, value)
+
+    def __set(self, name, value):
+        if self.__changes is not None:
+            self.__changes.append([ name, value ])
+        else:
+            self.__request('set', [ name, value ])
+
+    def __request(self, method, *args):
+        request = { 'port': self.port, 'method': method, 'args': args }
+        self.__file.write(json.dumps(request).encode() + b"\n")
+        self.__file.flush()
+        line = self.__file.readline()
+        if not line:
+            raise PolyD_MidiException("The daemon closed the connection.")
+        answer = json.loads(line)
+        if 'error' in answer:
+            raise self.__EXCEPTIONS.get(answer.get('type'), PolyD_Exception)(answer['error'])
+        return answer['result']
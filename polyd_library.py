@@ -0,0 +1,186 @@
+import os
+import sqlite3
+import zipfile
+import zlib
+
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_Exception
+from polyd_pattern import PolyD_Pattern
+
+class PolyD_LibraryEntry:
+    __slots__ = ('path', 'entry', 'bank', 'pattern', 'hash', 'steps', 'swing',
+                 'transpose', 'division', 'note_min', 'note_max')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @property
+    def location(self):
+        if self.entry is None:
+            return self.path
+        return f"{self.path}:{self.entry}"
+
+class PolyD_Library:
+    """ SQLite index of the patterns in zip, seq and syx files.
+        Files whose modification time and size did not change since they
+        were indexed are skipped when a directory is indexed again. Every
+        file is stored together with its patterns in one transaction. """
+
+    EXTENSIONS = ('.zip', '.seq', '.syx')
+
+    __SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS patterns (
+            file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+            entry TEXT,
+            bank INTEGER,
+            pattern INTEGER,
+            hash TEXT NOT NULL,
+            steps INTEGER NOT NULL,
+            swing INTEGER NOT NULL,
+            transpose INTEGER NOT NULL,
+            division INTEGER NOT NULL,
+            note_min INTEGER,
+            note_max INTEGER);
+        CREATE INDEX IF NOT EXISTS patterns_file ON patterns(file_id);
+        CREATE INDEX IF NOT EXISTS patterns_hash ON patterns(hash);
+        CREATE INDEX IF NOT EXISTS patterns_config ON patterns(steps, division, swing, transpose);
+        CREATE INDEX IF NOT EXISTS patterns_notes ON patterns(note_min, note_max);
+    '''
+
+    def __init__(self, filename):
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__db = sqlite3.connect(filename)
+        self.__db.execute("PRAGMA foreign_keys = ON")
+        self.__db.executescript(self.__SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.__db.close()
+
+    def index(self, directory):
+        """ Indexes all pattern files below 'directory'.
+            Returns the number of indexed, unchanged and removed files. """
+        directory = os.path.abspath(directory)
+        prefix = os.path.join(directory, '')
+        known = { path: (file_id, mtime, size) for file_id, path, mtime, size in
+                    self.__db.execute("SELECT id, path, mtime, size FROM files")
+                        if path.startswith(prefix) }
+        indexed = unchanged = 0
+        for path in self.__find_files(directory):
+            stat = os.stat(path)
+            row = known.pop(path, None)
+            if row is not None and row[1] == stat.st_mtime and row[2] == stat.st_size:
+                unchanged += 1
+                continue
+            patterns = self.__read_patterns(path)
+            with self.__db:
+                if row is not None:
+                    self.__db.execute("DELETE FROM files WHERE id = ?", (row[0],))
+                self.__add_file(path, stat, patterns)
+            indexed += 1
+        with self.__db:
+            for file_id, _, _ in known.values():
+                self.__db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        return (indexed, unchanged, len(known))
+
+    def query(self, steps=None, swing=None, transpose=None, division=None,
+              note_min=None, note_max=None, hash=None):
+        """ Returns the patterns matching all given criteria. 'note_min' and
+            'note_max' select patterns whose notes are all in that range,
+            'hash' may be the beginning of a content hash. """
+        conditions = []
+        args = []
+        for column, value in (('steps', steps), ('swing', swing), ('transpose', transpose),
+                              ('division', division)):
+            if value is not None:
+                conditions.append(f"p.{column} = ?")
+                args.append(value)
+        if hash is not None:
+            conditions.append("p.hash >= ? AND p.hash < ?")
+            args.extend([hash, hash + '~'])
+        if note_min is not None:
+            conditions.append("p.note_min >= ?")
+            args.append(note_min)
+        if note_max is not None:
+            conditions.append("p.note_max <= ?")
+            args.append(note_max)
+        sql = '''SELECT f.path, p.entry, p.bank, p.pattern, p.hash, p.steps, p.swing,
+                        p.transpose, p.division, p.note_min, p.note_max
+                 FROM patterns p JOIN files f ON f.id = p.file_id'''
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY f.path, p.entry"
+        return [ PolyD_LibraryEntry(*row) for row in self.__db.execute(sql, args) ]
+
+    def __find_files(self, directory):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(self.EXTENSIONS):
+                    yield os.path.join(root, name)
+
+    def __add_file(self, path, stat, patterns):
+        cursor = self.__db.execute("INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)",
+                                   (path, stat.st_mtime, stat.st_size))
+        file_id = cursor.lastrowid
+        for entry, bank, pattern, pattern_data in patterns:
+            self.__add_pattern(file_id, entry, bank, pattern, pattern_data)
+
+    def __add_pattern(self, file_id, entry, bank, pattern, pattern_data):
+        model = PolyD_Pattern.from_pattern_data(pattern_data)
+        notes = self.__used_notes(model)
+        self.__db.execute('''INSERT INTO patterns (file_id, entry, bank, pattern, hash, steps,
+                                 swing, transpose, division, note_min, note_max)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                          (file_id, entry, bank, pattern, PolyD_Cmd.calc_pattern_hash(pattern_data),
+                           model.step_count, model.swing, model.transpose, model.division_value,
+                           min(notes, default=None), max(notes, default=None)))
+
+    @staticmethod
+    def __used_notes(model):
+        notes = []
+        for voice in range(PolyD_Pattern.VOICE_COUNT):
+            voice_notes = model.notes(voice)
+            for step in range(min(model.step_count, PolyD_Pattern.STEP_COUNT)):
+                if not model.rest(step) and model.voice_used(step, voice):
+                    notes.append(voice_notes[step])
+        return notes
+
+    @staticmethod
+    def __read_patterns(path):
+        """ Returns (entry, bank, pattern, pattern data) for every pattern in a file.
+            Files that are damaged or contain no patterns have no patterns. """
+        patterns = []
+        try:
+            if zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path, "r") as zip:
+                    for name in zip.namelist():
+                        data = zip.read(name)
+                        if len(data) == PolyD_Cmd.SEQ_SIZE:
+                            bank, pattern = PolyD_Cmd.parse_slot(name, ".seq")
+                            patterns.append((name, bank, pattern, PolyD_Cmd.extract_pattern_from_seq(data)))
+                return patterns
+            with open(path, "rb") as fp:
+                data = fp.read()
+            if len(data) == PolyD_Cmd.SEQ_SIZE:
+                bank, pattern = PolyD_Cmd.parse_slot(os.path.basename(path), ".seq")
+                patterns.append((None, bank, pattern, PolyD_Cmd.extract_pattern_from_seq(data)))
+            elif len(data) == PolyD_Cmd.PATTERN_SYX_SIZE and data[8] == PolyD_Cmd.SEQ_PATTERN:
+                patterns.append((None, data[9] + 1, data[10] + 1, PolyD_Cmd.extract_pattern_from_syx(data)))
+            return patterns
+        except (OSError, zipfile.BadZipFile, zlib.error, PolyD_Exception):
+            # A damaged zip entry makes the whole file damaged
+            return []
@@ -0,0 +1,196 @@
+import collections
+import json
+import os
+import time
+
+from midiconnection import MidiConnection
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_MidiException
+
+class PolyD_Pacer:
+    """ Paces pattern writes to the Poly D.
+        The Poly D reports an error when a pattern arrives too soon after the
+        previous one. The pacer starts with a safe gap between two patterns and
+        shrinks it after every accepted pattern. When the Poly D answers with an
+        error the gap is increased again, the lower limit is raised and the
+        pattern is sent again. The learned timing is kept per firmware version
+        and can be stored in a file.
+        After every pattern the pacer waits for its error at least twice as
+        long as the Poly D took to answer recently, so every error is paired
+        with the pattern that caused it. """
+
+    DEFAULT_GAP = 0.1
+    MIN_GAP = 0.005
+    MAX_GAP = 1.0
+    SHRINK = 0.8
+    BACKOFF = 2.0
+    FLOOR_MARGIN = 1.25
+    RETRIES = 3
+    # The error window is this many times the longest reply latency
+    LATENCY_MARGIN = 2.0
+    LATENCY_SAMPLES = 16
+
+    def __init__(self, filename=None):
+        self.__filename = filename
+        self.__timings = {}
+        self.__firmware = None
+        self.gap = self.DEFAULT_GAP
+        self.floor = self.MIN_GAP
+        self.__latencies = collections.deque(maxlen=self.LATENCY_SAMPLES)
+        if filename is not None:
+            self.load()
+
+    @property
+    def firmware(self):
+        return self.__firmware
+
+    @firmware.setter
+    def firmware(self, version):
+        """ Selects the timing learned for the given firmware version. """
+        self.__store_timing()
+        self.__firmware = ".".join([str(v) for v in version])
+        timing = self.__timings.get(self.__firmware, {})
+        self.gap = timing.get('gap', self.DEFAULT_GAP)
+        self.floor = timing.get('floor', self.MIN_GAP)
+
+    def load(self):
+        if not os.path.isfile(self.__filename):
+            return
+        with open(self.__filename, "r") as fp:
+            self.__timings = json.load(fp)
+
+    def save(self):
+        if self.__filename is None:
+            return
+        self.__store_timing()
+        directory = os.path.dirname(self.__filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.__filename, "w") as fp:
+            json.dump(self.__timings, fp, indent=2)
+
+    @property
+    def latency(self):
+        """ The longest of the recently measured reply times of the Poly D
+            or None if nothing was measured yet. """
+        return max(self.__latencies, default=None)
+
+    def observe(self, latency):
+        """ Records the time the Poly D took to answer a request. """
+        self.__latencies.append(latency)
+
+    @property
+    def window(self):
+        """ Time to wait for the error answer of a pattern. It is never shorter
+            than the reply latency, so an error arrives before the next pattern
+            is sent and is not blamed on it. """
+        if self.latency is None:
+            return max(self.gap, self.DEFAULT_GAP)
+        return max(self.gap, self.latency * self.LATENCY_MARGIN)
+
+    def send(self, midi, sysex, retries=None):
+        """ Sends a pattern sysex and retransmits it up to 'retries' times
+            (default RETRIES) if the Poly D reports an error. """
+        if self.send_all(midi, [ sysex ], retries):
+            raise PolyD_MidiException("Could not set pattern")
+
+    def send_all(self, midi, sysexes, retries=None):
+        """ Sends pattern sysexes one after another. Returns the indices of
+            the patterns that the Poly D rejected 'retries' + 1 times. """
+        return midi.run(self.send_steps(midi, sysexes, retries))
+
+    async def send_async(self, midi, sysex, retries=None):
+        """ Like send(), but waits without blocking the event loop. 'midi'
+            is an AsyncMidiConnection. """
+        if await self.send_all_async(midi, [ sysex ], retries):
+            raise PolyD_MidiException("Could not set pattern")
+
+    async def send_all_async(self, midi, sysexes, retries=None):
+        """ Like send_all(), but waits without blocking the event loop. """
+        return await midi.run(self.send_steps(midi.midi, sysexes, retries))
+
+    def send_steps(self, midi, sysexes, retries=None):
+        """ The requests of send_all() as a generator for MidiConnection.run()
+            and AsyncMidiConnection.run(). 'midi' is the MidiConnection. """
+        retries = self.RETRIES if retries is None else retries
+        failed = []
+        previous = None
+        for i, sysex in enumerate(sysexes):
+            late = yield from self.__transfer(midi, sysex, retries)
+            if late and previous is not None:
+                # The error of the previous pattern came after its window
+                if not (yield from self.__resend(midi, sysexes[previous], retries)):
+                    failed.append(previous)
+            if late is None:
+                failed.append(i)
+            previous = None if late is None else i
+        if previous is not None:
+            # The error of the last pattern may still be on its way
+            yield None, self.window
+            if self.__late_error(midi) and not (yield from self.__resend(midi, sysexes[previous], retries)):
+                failed.append(previous)
+        return sorted(failed)
+
+    def __resend(self, midi, sysex, retries):
+        # Sends a pattern again whose error came too late. The window is
+        # widened, so that this does not happen again.
+        self.observe(self.window)
+        self.__rejected()
+        late = yield from self.__transfer(midi, sysex, retries)
+        return late is not None
+
+    def __transfer(self, midi, sysex, retries):
+        # Sends a pattern until it is accepted. Returns None if it was
+        # rejected every time, otherwise whether an error that belongs to
+        # the pattern before was received.
+        late = self.__late_error(midi)
+        fastest = min(self.__latencies, default=0)
+        for _ in range(retries + 1):
+            future = midi.expect(PolyD_Cmd.make_result_matcher(sysex), sysex)
+            start = time.monotonic()
+            try:
+                midi.write(sysex)
+            except:
+                midi.cancel(future)
+                raise
+            # No answer means that everything is ok. Otherwise an error
+            # response is sent.
+            answer = yield future, self.window
+            elapsed = time.monotonic() - start
+            if answer is None or not any(answer[9:-1]):
+                self.__accepted()
+                if midi.stats is not None:
+                    # Pattern writes are not answered, the time until the
+                    # pattern was accepted is recorded instead.
+                    midi.stats.answered(PolyD_Cmd.SEQ_PATTERN, elapsed)
+                return late
+            if elapsed < fastest / 2:
+                # Too early to answer this pattern. It is sent again,
+                # because its own error may still be on its way.
+                late = True
+                continue
+            self.observe(elapsed)
+            self.__rejected()
+        return None
+
+    def __accepted(self):
+        self.gap = max(self.floor, self.gap * self.SHRINK)
+
+    def __rejected(self):
+        self.floor = min(self.MAX_GAP, max(self.floor, self.gap * self.FLOOR_MARGIN))
+        self.gap = min(self.MAX_GAP, max(self.floor, self.gap * self.BACKOFF))
+
+    def __store_timing(self):
+        if self.__firmware is not None:
+            self.__timings[self.__firmware] = { 'gap': self.gap, 'floor': self.floor }
+
+    @staticmethod
+    def __late_error(midi):
+        # Error answers that were not expected any more are buffered
+        error = False
+        while True:
+            answer = midi.try_read(MidiConnection.SYSEX)
+            if answer is None:
+                return error
+            if len(answer) > 9 and answer[8] == PolyD_Cmd.RESULT:
+                error = error or any(answer[9:-1])
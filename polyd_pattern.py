@@ -0,0 +1,231 @@
+import polyd_codec
+
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_InvalidArgumentException
+
+class PolyD_Pattern:
+    """ A sequencer pattern backed by one buffer with the 326 decoded bytes.
+        Steps (0-31) and voices (0-3) are counted from zero. The per step
+        fields are returned as memoryviews into the buffer, so no objects are
+        created per step and writing to a view changes the pattern. """
+
+    __slots__ = ('__raw', '__view', '__unused_bits')
+
+    GATES = [ '12.5%', '25%', '37.5%', '50%', '62.5%', '75%', '87.5%', '100%' ]
+    DIVISIONS = [ 'unused', '1/4', '1/4T', '1/8', '1/8T', '1/16', '1/16T', '1/32', '1/32T' ]
+
+    STEP_COUNT = polyd_codec.STEP_COUNT
+    VOICE_COUNT = 4
+
+    __STEP_SIZE = polyd_codec.STEP_SIZE
+    __STEPS_SIZE = polyd_codec.STEPS_SIZE
+    __NOTE = 0
+    __VELOCITY = 4
+    __FLAGS = 8
+    __STEP_CONFIG = 9
+    __GLIDE = 0x01
+    __ACCENT = 0x04
+    __REST = 0x08
+    __VOICE_USED = 0x10
+    __STEP_COUNT = polyd_codec.STEPS_SIZE + 2
+    __SWING = polyd_codec.STEPS_SIZE + 3
+    __TRANSPOSE = polyd_codec.STEPS_SIZE + 4
+    __DIVISION = polyd_codec.STEPS_SIZE + 5
+    # High bits of the last, incomplete group that belong to no byte.
+    # They are kept, so that the pattern data round-trips unchanged.
+    __LAST_HIGH_BYTE = PolyD_Cmd.PATTERN_SIZE - 5
+    __UNUSED_BITS_MASK = 0x70
+
+    def __init__(self, raw, unused_bits=0):
+        if len(raw) != polyd_codec.RAW_SIZE:
+            raise PolyD_InvalidArgumentException("Invalid decoded pattern (wrong size)")
+        self.__raw = bytearray(raw)
+        self.__view = memoryview(self.__raw)
+        self.__unused_bits = unused_bits
+
+    @classmethod
+    def from_pattern_data(cls, pattern_data):
+        raw = polyd_codec.decode_pattern(pattern_data)
+        return cls(raw, pattern_data[cls.__LAST_HIGH_BYTE] & cls.__UNUSED_BITS_MASK)
+
+    @classmethod
+    def from_syx(cls, sysex):
+        return cls.from_pattern_data(PolyD_Cmd.extract_pattern_from_syx(sysex))
+
+    @classmethod
+    def from_seq(cls, seq):
+        return cls.from_pattern_data(PolyD_Cmd.extract_pattern_from_seq(seq))
+
+    def to_pattern_data(self):
+        data = polyd_codec.encode_pattern(self.__raw)
+        data[self.__LAST_HIGH_BYTE] |= self.__unused_bits
+        return data
+
+    def to_syx(self, did, bank, pattern):
+        return PolyD_Cmd.pattern2syx(did, bank, pattern, self.to_pattern_data())
+
+    def to_seq(self):
+        return PolyD_Cmd.pattern2Seq(self.to_pattern_data())
+
+    @property
+    def raw(self):
+        """ View of all 326 decoded bytes. """
+        return self.__view
+
+    @property
+    def steps(self):
+        """ View of the 320 step bytes, 10 bytes per step. """
+        return self.__view[:self.__STEPS_SIZE]
+
+    @property
+    def config(self):
+        """ View of the 6 pattern configuration bytes. """
+        return self.__view[self.__STEPS_SIZE:]
+
+    def notes(self, voice):
+        """ View of the MIDI notes of a voice in all 32 steps. """
+        return self.__column(self.__NOTE + self.__check_voice(voice))
+
+    def velocities(self, voice):
+        """ View of the velocities of a voice in all 32 steps. """
+        return self.__column(self.__VELOCITY + self.__check_voice(voice))
+
+    @property
+    def flags(self):
+        """ View of step config byte 1 (glide, accent, rest, voices used) of all steps. """
+        return self.__column(self.__FLAGS)
+
+    @property
+    def step_configs(self):
+        """ View of step config byte 2 (gate, ratchet, voice count) of all steps. """
+        return self.__column(self.__STEP_CONFIG)
+
+    def note(self, step, voice):
+        return self.notes(voice)[step]
+
+    def set_note(self, step, voice, note):
+        self.__check_range(note, 0, 127, "note")
+        self.notes(voice)[step] = note
+
+    def velocity(self, step, voice):
+        return self.velocities(voice)[step]
+
+    def set_velocity(self, step, voice, velocity):
+        self.__check_range(velocity, 0, 127, "velocity")
+        self.velocities(voice)[step] = velocity
+
+    def glide(self, step):
+        return self.__flag(step, self.__GLIDE)
+
+    def set_glide(self, step, on):
+        self.__set_flag(step, self.__GLIDE, on)
+
+    def accent(self, step):
+        return self.__flag(step, self.__ACCENT)
+
+    def set_accent(self, step, on):
+        self.__set_flag(step, self.__ACCENT, on)
+
+    def rest(self, step):
+        return self.__flag(step, self.__REST)
+
+    def set_rest(self, step, on):
+        self.__set_flag(step, self.__REST, on)
+
+    def voice_used(self, step, voice):
+        return self.__flag(step, self.__VOICE_USED << self.__check_voice(voice))
+
+    def set_voice_used(self, step, voice, on):
+        self.__set_flag(step, self.__VOICE_USED << self.__check_voice(voice), on)
+
+    def gate(self, step):
+        """ Gate length (0-7, see GATES). """
+        return self.step_configs[step] & 0x07
+
+    def set_gate(self, step, gate):
+        self.__check_range(gate, 0, 7, "gate")
+        self.__set_bits(step, 0x07, gate)
+
+    def ratchet(self, step):
+        return (self.step_configs[step] >> 3) & 0x03
+
+    def set_ratchet(self, step, ratchet):
+        self.__check_range(ratchet, 0, 3, "ratchet")
+        self.__set_bits(step, 0x18, ratchet << 3)
+
+    def voice_count(self, step):
+        return self.step_configs[step] >> 5
+
+    def set_voice_count(self, step, count):
+        self.__check_range(count, 1, 4, "voice count")
+        self.__set_bits(step, 0xE0, count << 5)
+
+    @property
+    def step_count(self):
+        return self.__raw[self.__STEP_COUNT] + 1
+
+    @step_count.setter
+    def step_count(self, count):
+        self.__check_range(count, 1, self.STEP_COUNT, "step count")
+        self.__raw[self.__STEP_COUNT] = count - 1
+
+    @property
+    def swing(self):
+        """ Swing in percent (50-75). """
+        return self.__raw[self.__SWING] + 50
+
+    @swing.setter
+    def swing(self, swing):
+        self.__check_range(swing, 50, 75, "swing")
+        self.__raw[self.__SWING] = swing - 50
+
+    @property
+    def transpose(self):
+        value = self.__raw[self.__TRANSPOSE]
+        return value - 256 if value > 127 else value
+
+    @transpose.setter
+    def transpose(self, transpose):
+        self.__check_range(transpose, -24, 36, "transpose")
+        self.__raw[self.__TRANSPOSE] = transpose & 0xFF
+
+    @property
+    def division_value(self):
+        return self.__raw[self.__DIVISION]
+
+    @division_value.setter
+    def division_value(self, value):
+        self.__check_range(value, 0, len(self.DIVISIONS) - 1, "division")
+        self.__raw[self.__DIVISION] = value
+
+    @property
+    def division(self):
+        return self.DIVISIONS[self.division_value]
+
+    def __eq__(self, other):
+        if not isinstance(other, PolyD_Pattern):
+            return NotImplemented
+        return self.to_pattern_data() == other.to_pattern_data()
+
+    def __column(self, offset):
+        return self.__view[offset:self.__STEPS_SIZE:self.__STEP_SIZE]
+
+    def __flag(self, step, mask):
+        return (self.flags[step] & mask) != 0
+
+    def __set_flag(self, step, mask, on):
+        flags = self.flags
+        flags[step] = (flags[step] | mask) if on else (flags[step] & ~mask)
+
+    def __set_bits(self, step, mask, value):
+        configs = self.step_configs
+        configs[step] = (configs[step] & ~mask) | value
+
+    def __check_voice(self, voice):
+        self.__check_range(voice, 0, self.VOICE_COUNT - 1, "voice")
+        return voice
+
+    @staticmethod
+    def __check_range(value, min, max, name):
+        if value < min or value > max:
+            raise PolyD_InvalidArgumentException(f"Invalid {name} '{value}'")
@@ -0,0 +1,59 @@
+from polyd_exc import PolyD_InvalidArgumentException
+
+class PolyD_Policy:
+    """ Timeout and retry behaviour of one class of commands.
+        The first attempt waits 'timeout' seconds for the answer, every retry
+        waits 'backoff' times longer than the one before. Commands that are
+        not 'idempotent' are never sent twice, because a lost answer does not
+        tell if the Poly D executed the command. """
+
+    __slots__ = ('timeout', 'retries', 'backoff', 'idempotent')
+
+    def __init__(self, timeout=5.0, retries=0, backoff=2.0, idempotent=True):
+        if timeout is not None and timeout <= 0:
+            raise PolyD_InvalidArgumentException(f"Invalid timeout '{timeout}'")
+        if retries < 0:
+            raise PolyD_InvalidArgumentException(f"Invalid retry count '{retries}'")
+        if backoff < 1:
+            raise PolyD_InvalidArgumentException(f"Invalid backoff factor '{backoff}'")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.idempotent = idempotent
+
+    @property
+    def attempts(self):
+        return self.retries + 1 if self.idempotent else 1
+
+    def timeouts(self):
+        """ Returns the timeout of every attempt. """
+        return [ self.timeout * self.backoff ** attempt for attempt in range(self.attempts) ]
+
+class PolyD_Policies:
+    """ Policies of the command classes of the Poly D. The answers to the
+        version and settings requests are tiny, so their timeouts are short.
+        Pattern writes are not answered; their retries are the number of
+        times the pacer resends a pattern the Poly D rejected. """
+
+    VERSION = 'version'
+    SETTINGS = 'settings'
+    PATTERN_FETCH = 'pattern_fetch'
+    PATTERN_WRITE = 'pattern_write'
+
+    def __init__(self, **policies):
+        self.__policies = {
+            self.VERSION:       PolyD_Policy(timeout=1.0, retries=2),
+            self.SETTINGS:      PolyD_Policy(timeout=1.0, retries=2),
+            self.PATTERN_FETCH: PolyD_Policy(timeout=2.0, retries=3),
+            self.PATTERN_WRITE: PolyD_Policy(timeout=None, retries=3),
+        }
+        for name, policy in policies.items():
+            self[name] = policy
+
+    def __getitem__(self, name):
+        return self.__policies[name]
+
+    def __setitem__(self, name, policy):
+        if name not in self.__policies:
+            raise PolyD_InvalidArgumentException(f"Unknown command class '{name}'")
+        self.__policies[name] = policy
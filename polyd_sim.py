@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+
+import polyd_codec
+from polyd_cmd import PolyD_Cmd
+from polyd_config import PolyD_Config
+
+class PolyD_SimulatorPort:
+    """ Input or output port of a PolyD_Simulator. """
+
+    def __init__(self, simulator, callback=None):
+        self.__simulator = simulator
+        self.__callback = callback
+
+    def send(self, data):
+        self.__simulator.receive(bytes(data))
+
+    def panic(self):
+        pass
+
+    def close(self):
+        if self.__callback is not None:
+            self.__simulator.remove_callback(self.__callback)
+            self.__callback = None
+
+class PolyD_Simulator:
+    """ In-process Poly D that implements the sysex protocol of polyd-sysex.md.
+        It is passed as backend to a MidiConnection instead of a real MIDI port.
+        Replies are delivered from a timer thread after 'latency' plus up to
+        'jitter' seconds. 'error_rate' is the probability that a write is
+        answered with an error and 'drop_rate' the probability that a reply
+        is lost. Patterns that arrive less than 'min_pattern_gap' seconds after
+        the previous one are rejected like the Poly D does. """
+
+    PORT_NAME = "POLY D Simulator"
+    SUCCESS = 0x00
+    FAILURE = 0x05
+    DEFAULT_SETTINGS = (0x00, 0x00, 0x00, 0x0C, 0x00, 0x00, 0x00, 0x02,
+                        0x01, 0x0C, 0x02, 0x00, 0x24, 0x02, 0x00, 0x01,
+                        0x01, 0x60, 0x03, 0x03, 0x03, 0x03, 0x03, 0x03, 0x03)
+
+    def __init__(self, latency=0.002, jitter=0.0, error_rate=0.0, drop_rate=0.0,
+                 min_pattern_gap=0.0, firmware=(1, 1, 3), seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.min_pattern_gap = min_pattern_gap
+        self.firmware = tuple(firmware)
+        self.settings = bytearray(self.DEFAULT_SETTINGS)
+        self.patterns = {}
+        self.factory_restore()
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__callbacks = []
+        self.__last_pattern_time = None
+
+    @staticmethod
+    def default_pattern():
+        """ Returns the data of an empty pattern in 7 bit encoding. """
+        step = [ 0x24 ] * 4 + [ 0x64 ] * 4 + [ 0x10, 0x23 ]
+        raw = bytes(step * polyd_codec.STEP_COUNT) + bytes([ 0x00, 0x00, 0x1F, 0x00, 0x00, 0x05 ])
+        return bytes(polyd_codec.encode_pattern(raw))
+
+    def factory_restore(self):
+        self.settings[:] = self.DEFAULT_SETTINGS
+        data = self.default_pattern()
+        self.patterns = { (bank, pattern): data for bank in range(8) for pattern in range(8) }
+
+    # Backend interface used by MidiConnection
+
+    def get_input_names(self):
+        return [ self.PORT_NAME ]
+
+    def get_output_names(self):
+        return [ self.PORT_NAME ]
+
+    def open_input(self, name=None, callback=None):
+        with self.__lock:
+            self.__callbacks.append(callback)
+        return PolyD_SimulatorPort(self, callback)
+
+    def open_output(self, name=None):
+        return PolyD_SimulatorPort(self)
+
+    def remove_callback(self, callback):
+        with self.__lock:
+            if callback in self.__callbacks:
+                self.__callbacks.remove(callback)
+
+    # Protocol
+
+    def receive(self, data):
+        """ Handles a message sent to the Poly D. """
+        if len(data) < 10 or tuple(data[:7]) != PolyD_Cmd.SYX_PREFIX or data[-1] != 0xF7:
+            return
+        did = data[7]
+        if did != 0 and did != self.settings[PolyD_Config.DEVICE_ID]:
+            return
+        cmd = data[8]
+        with self.__lock:
+            if cmd == PolyD_Cmd.GET_FW_VERSION:
+                self.__reply([ PolyD_Cmd.FW_VERSION_RESULT, 0x00, *self.firmware ])
+            elif cmd == PolyD_Cmd.GET_SETTINGS:
+                self.__reply([ PolyD_Cmd.SETTINGS_RESULT, *self.settings ])
+            elif cmd == PolyD_Cmd.GET_SEQ_PATTERN:
+                self.__send_pattern(data[9], data[10])
+            elif cmd == PolyD_Cmd.SEQ_PATTERN:
+                self.__set_pattern(data)
+            elif cmd == PolyD_Cmd.SETTINGS_RESULT:
+                self.__set_all_settings(data)
+            elif cmd in PolyD_Cmd.SETTINGS_LAYOUT:
+                self.__set_settings(data)
+            elif cmd == PolyD_Cmd.RESTORE_FACTORY_SETTINGS:
+                self.factory_restore()
+                self.__result(self.SUCCESS)
+            else:
+                self.__result(self.FAILURE)
+
+    def __send_pattern(self, bank, pattern):
+        data = self.patterns.get((bank, pattern))
+        if data is None:
+            self.__result(self.FAILURE)
+            return
+        sysex = PolyD_Cmd.pattern2syx(self.settings[PolyD_Config.DEVICE_ID], bank + 1, pattern + 1, data)
+        self.__deliver(sysex)
+
+    def __set_pattern(self, data):
+        # Only errors are answered.
+        now = time.monotonic()
+        too_soon = self.__last_pattern_time is not None and \
+                   now - self.__last_pattern_time < self.min_pattern_gap
+        self.__last_pattern_time = now
+        slot = (data[9], data[10])
+        if too_soon or self.__inject_error() or len(data) != PolyD_Cmd.PATTERN_SYX_SIZE or \
+           slot not in self.patterns:
+            self.__result(self.FAILURE)
+            return
+        pattern_data = bytes(PolyD_Cmd.extract_pattern_from_syx(data))
+        if tuple(data[13:15]) != PolyD_Cmd.calc_pattern_checksum(pattern_data):
+            self.__result(self.FAILURE)
+            return
+        self.patterns[slot] = pattern_data
+
+    def __set_all_settings(self, data):
+        if len(data) != PolyD_Config.SYSEX_SIZE or self.__inject_error():
+            self.__result(self.FAILURE)
+            return
+        self.settings[:] = data[9:9 + PolyD_Config.SIZE]
+        self.__result(self.SUCCESS)
+
+    def __set_settings(self, data):
+        prefix, indices, suffix = PolyD_Cmd.SETTINGS_LAYOUT[data[8]]
+        if len(data) != 10 + len(prefix) + len(indices) + len(suffix) or self.__inject_error():
+            self.__result(self.FAILURE)
+            return
+        for index, value in PolyD_Cmd.decode_settings_sysex(data).items():
+            self.settings[index] = value
+        self.__result(self.SUCCESS)
+
+    def __inject_error(self):
+        return self.error_rate > 0 and self.__random.random() < self.error_rate
+
+    def __result(self, status):
+        self.__reply([ PolyD_Cmd.RESULT, 0x00, status ])
+
+    def __reply(self, data):
+        self.__deliver(PolyD_Cmd.make_sysex(self.settings[PolyD_Config.DEVICE_ID], data))
+
+    def __deliver(self, sysex):
+        if self.drop_rate > 0 and self.__random.random() < self.drop_rate:
+            return
+        delay = self.latency + self.__random.uniform(0, self.jitter)
+        callbacks = list(self.__callbacks)
+        timer = threading.Timer(delay, self.__call, (callbacks, bytes(sysex)))
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def __call(callbacks, data):
+        for callback in callbacks:
+            callback(data)
@@ -0,0 +1,129 @@
+import datetime
+import json
+import os
+
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_Exception
+
+class PolyD_SnapshotStore:
+    """ Content addressed store for snapshots of a Poly D.
+        Every configuration and pattern is stored once as a blob named after
+        its hash. A snapshot is a small manifest that maps the configuration
+        and the pattern slots to blob hashes, so a new snapshot only writes
+        the blobs that changed since any earlier snapshot. Snapshots are named
+        after the time they were taken; a suffix is added to the name when
+        several are taken in the same second. """
+
+    CONFIG = "config"
+
+    def __init__(self, root):
+        self.__root = root
+        self.__blobs = os.path.join(root, "blobs")
+        self.__snapshots = os.path.join(root, "snapshots")
+
+    def put_blob(self, data):
+        """ Stores a blob unless it exists already.
+            Returns the hash and True if the blob was written. """
+        digest = PolyD_Cmd.calc_hash(data)
+        path = self.__blob_path(digest)
+        if os.path.exists(path):
+            return (digest, False)
+        self.__write_file(path, data)
+        return (digest, True)
+
+    def get_blob(self, digest):
+        try:
+            with open(self.__blob_path(digest), "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            raise PolyD_Exception(f"Snapshot data {digest} is missing.")
+
+    def create(self, config, patterns, name=None):
+        """ Stores a snapshot. 'config' is the configuration sysex and 'patterns'
+            maps (bank, pattern) to seq data. Returns the snapshot name and the
+            number of blobs that had to be written. """
+        if name is None:
+            name = self.__unused_name(datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+        elif os.path.exists(self.__manifest_path(name)):
+            raise PolyD_Exception(f"Snapshot '{name}' exists already.")
+        items = {}
+        written = 0
+        if config is not None:
+            items[self.CONFIG], new = self.put_blob(bytes(config))
+            written += new
+        for (bank, pattern), seq in sorted(patterns.items()):
+            items[PolyD_Cmd.slot_name(bank, pattern)], new = self.put_blob(bytes(seq))
+            written += new
+        manifest = {
+            "name": name,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "items": items,
+        }
+        self.__write_file(self.__manifest_path(name), json.dumps(manifest, indent=1).encode())
+        return (name, written)
+
+    def list(self):
+        """ Returns the manifests of all snapshots, oldest first. """
+        if not os.path.isdir(self.__snapshots):
+            return []
+        names = sorted(n[:-5] for n in os.listdir(self.__snapshots) if n.endswith(".json"))
+        return [ self.load(name) for name in names ]
+
+    def load(self, name):
+        try:
+            with open(self.__manifest_path(name), "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            raise PolyD_Exception(f"Snapshot '{name}' does not exist.")
+
+    def diff(self, name_a, name_b):
+        """ Returns (item, hash in a, hash in b) for every item that differs
+            between two snapshots. A missing item has the hash None. """
+        items_a = self.load(name_a)["items"]
+        items_b = self.load(name_b)["items"]
+        return [ (item, items_a.get(item), items_b.get(item))
+                    for item in sorted(set(items_a) | set(items_b))
+                        if items_a.get(item) != items_b.get(item) ]
+
+    def get_config(self, name):
+        """ Returns the configuration sysex of a snapshot or None. """
+        digest = self.load(name)["items"].get(self.CONFIG)
+        return None if digest is None else self.get_blob(digest)
+
+    def get_patterns(self, name):
+        """ Returns a dict mapping (bank, pattern) to the seq data of a snapshot. """
+        patterns = {}
+        for item, digest in self.load(name)["items"].items():
+            if item == self.CONFIG:
+                continue
+            slot = PolyD_Cmd.parse_slot(item)
+            if slot == (None, None):
+                raise PolyD_Exception(f"Snapshot '{name}' contains the unknown item '{item}'.")
+            patterns[slot] = self.get_blob(digest)
+        return patterns
+
+    def __unused_name(self, name):
+        unused = name
+        number = 1
+        while os.path.exists(self.__manifest_path(unused)):
+            number += 1
+            unused = f"{name}-{number}"
+        return unused
+
+    def __blob_path(self, digest):
+        return os.path.join(self.__blobs, digest[:2], digest)
+
+    def __manifest_path(self, name):
+        if os.sep in name or name.startswith("."):
+            raise PolyD_Exception(f"Invalid snapshot name '{name}'.")
+        return os.path.join(self.__snapshots, name + ".json")
+
+    @staticmethod
+    def __write_file(path, data):
+        # Write to a temporary file first, so that an interrupted
+        # backup never leaves a damaged blob or manifest behind.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + ".tmp"
+        with open(temp, "wb") as fp:
+            fp.write(data)
+        os.replace(temp, path)
@@ -0,0 +1,74 @@
+import threading
+
+from polyd_cmd import PolyD_Cmd
+from polyd_config import PolyD_Config
+
+class PolyD_State:
+    """ Mirror of the configuration and the patterns of a Poly D.
+        The mirror is updated from the sysex messages that the instrument
+        confirmed, so the values do not need to be requested again. Changes
+        made on the instrument itself are not noticed. 'version' is
+        incremented on every change. """
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__config = None
+        self.__patterns = {}
+        self.version = 0
+
+    @property
+    def config(self):
+        """ The mirrored configuration or None if it is not known. """
+        return self.__config
+
+    @config.setter
+    def config(self, config):
+        with self.__lock:
+            self.__config = config
+            self.version += 1
+
+    @property
+    def is_current(self):
+        return self.__config is not None
+
+    def get_pattern(self, bank, pattern):
+        """ Returns the mirrored pattern sysex or None if it is not known. """
+        return self.__patterns.get((bank, pattern))
+
+    def set_pattern(self, bank, pattern, sysex):
+        with self.__lock:
+            self.__patterns[(bank, pattern)] = bytes(sysex)
+            self.version += 1
+
+    def forget_pattern(self, bank, pattern):
+        """ Forgets a pattern whose content on the Poly D is not known. """
+        with self.__lock:
+            if self.__patterns.pop((bank, pattern), None) is not None:
+                self.version += 1
+
+    def update_settings(self, values):
+        """ Applies changed settings values. Nothing happens while the
+            configuration is not known. """
+        with self.__lock:
+            if self.__config is not None:
+                self.__config = self.__config.with_values(values)
+                self.version += 1
+
+    def apply_sysex(self, sysex):
+        """ Updates the mirror from a sysex message that was accepted by the Poly D. """
+        cmd = sysex[8]
+        if cmd == PolyD_Cmd.SETTINGS_RESULT and len(sysex) == PolyD_Config.SYSEX_SIZE:
+            self.config = PolyD_Config(bytes(sysex))
+        elif cmd in PolyD_Cmd.SETTINGS_LAYOUT:
+            self.update_settings(PolyD_Cmd.decode_settings_sysex(sysex))
+        elif cmd == PolyD_Cmd.SEQ_PATTERN and len(sysex) == PolyD_Cmd.PATTERN_SYX_SIZE:
+            self.set_pattern(sysex[9] + 1, sysex[10] + 1, sysex)
+        else:
+            self.invalidate()
+
+    def invalidate(self):
+        """ Forgets everything, e.g. after a factory restore. """
+        with self.__lock:
+            self.__config = None
+            self.__patterns.clear()
+            self.version += 1
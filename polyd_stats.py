@@ -0,0 +1,164 @@
+import bisect
+import json
+import platform
+import threading
+
+from polyd_cmd import PolyD_Cmd
+
+class PolyD_CommandStats:
+    """ Counters and latency histogram of one command. """
+
+    __slots__ = ('requests', 'answers', 'timeouts', 'errors', 'bytes_sent',
+                 'bytes_received', 'latency_total', 'latency_max', 'histogram')
+
+    # Upper bounds of the latency histogram buckets in seconds
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, float('inf'))
+
+    def __init__(self):
+        self.requests = 0
+        self.answers = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.histogram = [ 0 ] * len(self.BUCKETS)
+
+    def add_latency(self, latency):
+        self.answers += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.histogram[bisect.bisect_left(self.BUCKETS, latency)] += 1
+
+    @property
+    def latency_mean(self):
+        return self.latency_total / self.answers if self.answers else None
+
+    def percentile(self, percent):
+        """ Returns the upper bound of the histogram bucket that contains the
+            given percentile, which is never more than the maximum latency. """
+        if not self.answers:
+            return None
+        rank = self.answers * percent / 100
+        count = 0
+        for bound, n in zip(self.BUCKETS, self.histogram):
+            count += n
+            if count >= rank:
+                return min(bound, self.latency_max)
+        return self.latency_max
+
+    def to_dict(self):
+        result = { name: getattr(self, name) for name in self.__slots__ if name != 'histogram' }
+        result['latency_mean'] = self.latency_mean
+        result['latency_p50'] = self.percentile(50)
+        result['latency_p90'] = self.percentile(90)
+        result['latency_p99'] = self.percentile(99)
+        result['histogram'] = { str(bound): n for bound, n in zip(self.BUCKETS, self.histogram) if n }
+        return result
+
+class PolyD_Stats:
+    """ Request counts, latencies, timeouts, error replies and transferred
+        bytes per Poly D command, plus the number of dropped input messages.
+        Assign an instance to MidiConnection.stats to collect them.
+        Messages that are no Poly D sysex are counted under OTHER. """
+
+    OTHER = 'other'
+    # Requests that only read data, error replies never belong to them.
+    __READ_COMMANDS = (PolyD_Cmd.RESERVED, PolyD_Cmd.GET_FW_VERSION,
+                       PolyD_Cmd.GET_SETTINGS, PolyD_Cmd.GET_SEQ_PATTERN)
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__commands = {}
+        self.__last_write = self.OTHER
+        self.dropped = {}
+        self.info = { 'host': platform.node() }
+
+    @staticmethod
+    def command(data):
+        """ Returns the command id of a message. """
+        if len(data) > 9 and tuple(data[:7]) == PolyD_Cmd.SYX_PREFIX:
+            return data[8]
+        return PolyD_Stats.OTHER
+
+    @staticmethod
+    def command_name(command):
+        for name, value in vars(PolyD_Cmd).items():
+            if name.isupper() and value == command:
+                return name
+        return command if command == PolyD_Stats.OTHER else f"0x{command:02X}"
+
+    @property
+    def commands(self):
+        """ Dict mapping the command ids to their PolyD_CommandStats. """
+        with self.__lock:
+            return dict(self.__commands)
+
+    def sent(self, data):
+        command = self.command(data)
+        with self.__lock:
+            stats = self.__get(command)
+            stats.requests += 1
+            stats.bytes_sent += len(data)
+            if command not in self.__READ_COMMANDS:
+                self.__last_write = command
+
+    def received(self, data, request=None):
+        """ Counts a received message for 'request', the command id of the
+            request it answers. Without a request it is counted for its own
+            command, and an error result for the last command that changed
+            something on the Poly D. """
+        command = self.command(data)
+        with self.__lock:
+            self.__get(command if request is None else request).bytes_received += len(data)
+            if command == PolyD_Cmd.RESULT and any(data[9:-1]):
+                self.__get(self.__last_write if request is None else request).errors += 1
+
+    def answered(self, command, latency):
+        with self.__lock:
+            self.__get(command).add_latency(latency)
+
+    def timed_out(self, command):
+        with self.__lock:
+            self.__get(command).timeouts += 1
+
+    def dropped_message(self, message_class):
+        with self.__lock:
+            self.dropped[message_class] = self.dropped.get(message_class, 0) + 1
+
+    def to_dict(self):
+        with self.__lock:
+            return {
+                'info': dict(self.info),
+                'commands': { self.command_name(c): s.to_dict() for c, s in sorted(self.__commands.items(), key=self.__sort_key) },
+                'dropped': dict(self.dropped),
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def summary(self):
+        """ Returns a table with one line per command. """
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.1f}"
+        lines = [ f"{'command':24} {'sent':>6} {'answers':>7} {'timeouts':>8} {'errors':>6} "
+                  f"{'bytes out':>9} {'bytes in':>9} {'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7} {'max ms':>7}" ]
+        for command, s in sorted(self.commands.items(), key=self.__sort_key):
+            lines.append(f"{self.command_name(command):24} {s.requests:6} {s.answers:7} {s.timeouts:8} {s.errors:6} "
+                         f"{s.bytes_sent:9} {s.bytes_received:9} {ms(s.latency_mean):>8} "
+                         f"{ms(s.percentile(50)):>7} {ms(s.percentile(90)):>7} {ms(s.latency_max if s.answers else None):>7}")
+        dropped = ", ".join(f"{c} {n}" for c, n in sorted(self.dropped.items()))
+        lines.append(f"Dropped input messages: {dropped or 'none'}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def __sort_key(item):
+        command = item[0]
+        return (1, 0) if command == PolyD_Stats.OTHER else (0, command)
+
+    def __get(self, command):
+        stats = self.__commands.get(command)
+        if stats is None:
+            stats = self.__commands[command] = PolyD_CommandStats()
+        return stats
@@ -0,0 +1,225 @@
+import queue
+import threading
+
+from delegate import Delegate
+
+from polyd_config import PolyD_Config
+
+# The classes keeping the GUI and the Poly D in sync do not import kivy.
+# They get its Clock, or any object with schedule_once() and get_time(),
+# so that they can be used and tested without a window.
+
+def changed_settings(shown, config):
+    """ Returns the indices of the settings of 'config' that differ from the
+        settings block 'shown', all indices if 'shown' is None. """
+    if shown is None:
+        return list(range(PolyD_Config.SIZE))
+    settings = bytes(config.values)
+    return [ index for index in range(len(settings)) if settings[index] != shown[index] ]
+
+class PolyDWorker:
+    """ Executes the commands to the Poly D one after the other on a
+        background thread, so a slow or missing answer does not block the
+        window. The results and errors are passed to the callbacks through
+        the clock, i.e. on the Kivy thread. """
+
+    # Seconds stop() waits for the submitted commands
+    STOP_TIMEOUT = 3.0
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, func, on_done=None, on_error=None):
+        """ Calls func() on the worker thread, then on_done(result) or
+            on_error(exception) on the Kivy thread. """
+        self.__queue.put((func, on_done, on_error))
+
+    def drop(self, exc):
+        """ Forgets the commands that were not started yet, e.g. because the
+            instrument is gone. Their on_error gets 'exc'. """
+        while True:
+            try:
+                command = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+            if command is None:
+                self.__queue.put(None)
+                return
+            self.__failed(command[2], exc)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """ Executes the submitted commands and stops the thread. Returns
+            False if the commands did not finish within 'timeout' seconds;
+            the thread is left behind then and ends with the program. """
+        self.__queue.put(None)
+        self.__thread.join(timeout)
+        return not self.__thread.is_alive()
+
+    def __run(self):
+        while True:
+            command = self.__queue.get()
+            if command is None:
+                return
+            func, on_done, on_error = command
+            try:
+                result = func()
+            except Exception as exc:
+                # Every error is passed on, so that no callback waits forever
+                self.__failed(on_error, exc)
+                continue
+            if on_done is not None:
+                self.clock.schedule_once(lambda _, result=result: on_done(result))
+
+    def __failed(self, on_error, exc):
+        if on_error is not None:
+            self.clock.schedule_once(lambda _, exc=exc: on_error(exc))
+        else:
+            print("Error:", getattr(exc, 'message', exc))
+
+class WriteScheduler:
+    """ Collects the changes of the view and writes them together. Only the
+        latest value of every field is kept. Every change delays the writes
+        until its field has not changed for the given delay, then all pending
+        changes are written in one PolyD transaction by the worker. The
+        'written' and 'failed' events get the fields of the transaction,
+        'failed' also the exception. """
+
+    def __init__(self, polyd, worker, clock):
+        self.polyd = polyd
+        self.worker = worker
+        self.clock = clock
+        self.written = Delegate()
+        self.failed = Delegate()
+        self.__pending = {}
+        self.__deadline = 0
+        self.__event = None
+
+    @property
+    def pending(self):
+        return len(self.__pending) > 0
+
+    def is_pending(self, field):
+        return field in self.__pending
+
+    def schedule(self, field, func, value, delay):
+        """ Calls func(value) inside the transaction of the next flush. """
+        now = self.clock.get_time()
+        self.__deadline = max(self.__deadline, now + delay) if self.__pending else now + delay
+        self.__pending[field] = (func, value)
+        if self.__event is not None:
+            self.__event.cancel()
+        self.__event = self.clock.schedule_once(self.flush, self.__deadline - now)
+
+    def cancel(self):
+        """ Forgets the pending changes. """
+        if self.__event is not None:
+            self.__event.cancel()
+            self.__event = None
+        self.__pending = {}
+
+    def flush(self, *_):
+        pending = self.__pending
+        self.cancel()
+        if not pending:
+            return
+
+        def write():
+            with self.polyd.transaction():
+                for func, value in pending.values():
+                    func(value)
+
+        fields = list(pending)
+        self.worker.submit(write, lambda _: self.written(fields), lambda exc: self.failed(fields, exc))
+
+class LiveSync:
+    """ Polls the settings of the Poly D, so that changes made on the
+        instrument are shown. A poll starts MIN_INTERVAL seconds after a
+        change in the GUI or on the instrument, every poll without a change
+        doubles the interval up to MAX_INTERVAL. The 'changed' event gets
+        the new PolyD_Config and the indices of the changed settings. """
+
+    MIN_INTERVAL = 0.5
+    MAX_INTERVAL = 8.0
+
+    def __init__(self, polyd, worker, writer, clock):
+        self.polyd = polyd
+        self.worker = worker
+        self.writer = writer
+        self.clock = clock
+        self.changed = Delegate()
+        self.interval = self.MIN_INTERVAL
+        self.__settings = None
+        self.__running = False
+        self.__polling = False
+        self.__generation = 0
+        self.__event = None
+        writer.written += self.__written
+
+    def start(self, config):
+        """ Starts polling, 'config' are the settings shown by the GUI. """
+        self.__settings = bytes(config.values)
+        self.__running = True
+        self.interval = self.MIN_INTERVAL
+        self.__schedule()
+
+    def stop(self):
+        self.__running = False
+        if self.__event is not None:
+            self.__event.cancel()
+            self.__event = None
+
+    def interaction(self):
+        """ Polls sooner after a change in the GUI. An answer that is on its
+            way may not contain the change yet, so it is ignored. """
+        self.__generation += 1
+        self.interval = self.MIN_INTERVAL
+        if self.__running:
+            self.__schedule()
+
+    def __schedule(self):
+        if self.__event is not None:
+            self.__event.cancel()
+        self.__event = self.clock.schedule_once(self.__poll, self.interval)
+
+    def __poll(self, _):
+        self.__event = None
+        if self.__polling or self.writer.pending:
+            self.__schedule()
+            return
+        self.__polling = True
+        generation = self.__generation
+        # The mirrored patterns are kept, only the settings are read
+        self.worker.submit(self.polyd.read_settings,
+                           lambda config: self.__received(config, generation),
+                           self.__failed)
+
+    def __received(self, config, generation):
+        self.__polling = False
+        if not self.__running:
+            return
+        if generation != self.__generation:
+            self.__schedule()
+            return
+        indices = changed_settings(self.__settings, config)
+        self.__settings = bytes(config.values)
+        if indices:
+            self.interval = self.MIN_INTERVAL
+            self.changed(config, indices)
+        else:
+            self.interval = min(self.MAX_INTERVAL, self.interval * 2)
+        self.__schedule()
+
+    def __written(self, fields):
+        # The changes of the GUI are not reported as changes on the instrument
+        config = self.polyd.state.config
+        if config is not None and self.__settings is not None:
+            self.__settings = bytes(config.values)
+
+    def __failed(self, exc):
+        self.__polling = False
+        if self.__running:
+            self.interval = self.MAX_INTERVAL
+            self.__schedule()
@@ -1,7 +1,13 @@
+import midiports
+
 from delegate import Delegate
 
+from midiconnection import MidiException
 from polyd_config import PolyD_Config
+from polydguisync import LiveSync, PolyDWorker, WriteScheduler, changed_settings
 
+from kivy.app import App
+from kivy.clock import Clock
 from kivy.properties import NumericProperty, ObjectProperty, StringProperty
 
 from kivy.core.window import Window
@@ -144,81 +150,170 @@ class PolyDGuiView(BoxLayout):
     polarities = PolyD_Config.POLARITIES
     ports = PolyD_Config.PORTS
 
-    def __init__(self, polyd, **kwargs):
+    # Seconds without changes before the changes are written. Typed numbers
+    # wait longer, so that "127" is written once instead of three times.
+    TYPING_DELAY = 0.6
+    SELECT_DELAY = 0.15
+
+    # Background colors of fields whose changes are not written yet or failed
+    NORMAL_COLOR = (1, 1, 1, 1)
+    PENDING_COLOR = (1, 0.95, 0.6, 1)
+    FAILED_COLOR = (1, 0.65, 0.65, 1)
+
+    def __init__(self, polyd, version, live_sync=True, **kwargs):
+        """ 'version' is the firmware version read when connecting. With
+            'live_sync' the settings are polled, so that changes made on the
+            instrument are shown. """
         self.polyd = polyd
         self.raise_events = True
+        # The settings the fields show, None before they are filled
+        self.__shown = None
+        self.worker = PolyDWorker(Clock)
+        self.writer = WriteScheduler(polyd, self.worker, Clock)
+        self.writer.written += self._written
+        self.writer.failed += self._write_failed
+        self.sync = None
+        if live_sync:
+            self.sync = LiveSync(polyd, self.worker, self.writer, Clock)
+            self.sync.changed += self._settings_changed
         super().__init__(**kwargs)
+        self.show_version(version)
 
     def on_kv_post(self, _):
         self._show_config()
-        self.dev_id.bind(text=lambda _,v: self._value_changed(self._id_changed, v))
-        self.rx.bind(text=lambda _,v: self._value_changed(self._rx_changed, v))
-        self.tx.bind(text=lambda _,v: self._value_changed(self._tx_changed, v))
-        self.in_transpose.bind(text=lambda _,v: self._value_changed(self._in_transpose_changed, v))
-        self.velocity_on.velocity_changed += lambda v: self._value_changed(self._velocity_on_changed, v)
-        self.velocity_off.velocity_changed += lambda v: self._value_changed(self._velocity_off_changed, v)
-        self.velocity_curve.bind(text=lambda _,v: self._value_changed(self._velocity_curve_changed, v))
-        self.key_priority.bind(text=lambda _,v: self._value_changed(self._key_priority_changed, v))
-        self.multi_trig.bind(text=lambda _,v: self._value_changed(self._multi_trig_changed, v))
-        self.pitch_bend.bind(text=lambda _,v: self._value_changed(self._pitch_bend_changed, v))
-        self.mod_range.bind(text=lambda _,v: self._value_changed(self._mod_range_changed, v))
-        self.modulation_curve.bind(text=lambda _,v: self._value_changed(self._modulation_curve_changed, v))
-        self.note_zero.bind(text=lambda _,v: self._value_changed(self._note_zero_changed, v))
-        self.sync_rate.bind(text=lambda _,v: self._value_changed(self._sync_rate_changed, v))
-        self.sync_source.bind(text=lambda _,v: self._value_changed(self._sync_source_changed, v))
-        self.ext_clock_pol.bind(text=lambda _,v: self._value_changed(self._ext_clock_pol_changed, v))
-        self.accent_velocity.bind(text=lambda _,v: self._value_changed(self._accent_velocity_changed, v))
-        self.local_control.bind(text=lambda _,v: self._value_changed(self._local_control_changed, v))
-        self.clock_out.bind(text=lambda _,v: self._value_changed(self._clock_out_changed, v))
-        self.pbend_out.bind(text=lambda _,v: self._value_changed(self._pbend_out_changed, v))
-        self.modwheel_out.bind(text=lambda _,v: self._value_changed(self._modwheel_out_changed, ))
-        self.key_out.bind(text=lambda _,v: self._value_changed(self._key_out_changed, v))
-        self.at_out.bind(text=lambda _,v: self._value_changed(self._at_out_changed, v))
-        self.seq_out.bind(text=lambda _,v: self._value_changed(self.seq_out_changed, v))
-        self.arp_out.bind(text=lambda _,v: self._value_changed(self._arp_out_changed, v))
+        self.dev_id.bind(text=lambda _,v: self._value_changed(self.dev_id, self._id_changed, v, self.TYPING_DELAY))
+        self.rx.bind(text=lambda _,v: self._value_changed(self.rx, self._rx_changed, v))
+        self.tx.bind(text=lambda _,v: self._value_changed(self.tx, self._tx_changed, v))
+        self.in_transpose.bind(text=lambda _,v: self._value_changed(self.in_transpose, self._in_transpose_changed, v))
+        self.velocity_on.velocity_changed += lambda v: self._value_changed(self.velocity_on, self._velocity_on_changed, v, self.TYPING_DELAY)
+        self.velocity_off.velocity_changed += lambda v: self._value_changed(self.velocity_off, self._velocity_off_changed, v, self.TYPING_DELAY)
+        self.velocity_curve.bind(text=lambda _,v: self._value_changed(self.velocity_curve, self._velocity_curve_changed, v))
+        self.key_priority.bind(text=lambda _,v: self._value_changed(self.key_priority, self._key_priority_changed, v))
+        self.multi_trig.bind(text=lambda _,v: self._value_changed(self.multi_trig, self._multi_trig_changed, v))
+        self.pitch_bend.bind(text=lambda _,v: self._value_changed(self.pitch_bend, self._pitch_bend_changed, v))
+        self.mod_range.bind(text=lambda _,v: self._value_changed(self.mod_range, self._mod_range_changed, v))
+        self.modulation_curve.bind(text=lambda _,v: self._value_changed(self.modulation_curve, self._modulation_curve_changed, v))
+        self.note_zero.bind(text=lambda _,v: self._value_changed(self.note_zero, self._note_zero_changed, v, self.TYPING_DELAY))
+        self.sync_rate.bind(text=lambda _,v: self._value_changed(self.sync_rate, self._sync_rate_changed, v))
+        self.sync_source.bind(text=lambda _,v: self._value_changed(self.sync_source, self._sync_source_changed, v))
+        self.ext_clock_pol.bind(text=lambda _,v: self._value_changed(self.ext_clock_pol, self._ext_clock_pol_changed, v))
+        self.accent_velocity.bind(text=lambda _,v: self._value_changed(self.accent_velocity, self._accent_velocity_changed, v, self.TYPING_DELAY))
+        self.local_control.bind(text=lambda _,v: self._value_changed(self.local_control, self._local_control_changed, v))
+        self.clock_out.bind(text=lambda _,v: self._value_changed(self.clock_out, self._clock_out_changed, v))
+        self.pbend_out.bind(text=lambda _,v: self._value_changed(self.pbend_out, self._pbend_out_changed, v))
+        self.modwheel_out.bind(text=lambda _,v: self._value_changed(self.modwheel_out, self._modwheel_out_changed, v))
+        self.key_out.bind(text=lambda _,v: self._value_changed(self.key_out, self._key_out_changed, v))
+        self.at_out.bind(text=lambda _,v: self._value_changed(self.at_out, self._at_out_changed, v))
+        self.seq_out.bind(text=lambda _,v: self._value_changed(self.seq_out, self.seq_out_changed, v))
+        self.arp_out.bind(text=lambda _,v: self._value_changed(self.arp_out, self._arp_out_changed, v))
 
     def restore_factory_settings(self):
         print("Restore Factory Settings")
-        self.polyd.factory_restore()
-        self._show_config()
+        self.writer.cancel()
+        self.worker.submit(self.polyd.factory_restore, lambda _: self._show_config())
+
+    def show_version(self, version):
+        self.version = ".".join([str(v) for v in version])
 
     def _show_config(self):
+        # The configuration is read by the worker, the version is only
+        # read again when the Poly D is connected again
+        self.worker.submit(self.polyd.get_config, self._fill_config)
+
+    def _fill_config(self, config):
+        # Only the fields whose settings differ from the shown ones are set
+        indices = changed_settings(self.__shown, config)
+        self._update_fields(config, indices)
+        self.__shown = bytes(config.values)
+        if self.sync is not None:
+            self.sync.start(config)
+
+    def _setting_fields(self):
+        # Maps the index of every setting to its field and a function
+        # that returns the text or velocity shown for it
+        return {
+            PolyD_Config.DEVICE_ID:           (self.dev_id, lambda config: str(config.device_id)),
+            PolyD_Config.MIDI_RX_CHANNEL:     (self.rx, lambda config: self.midi_in_channels[config.midi_rx_channel_value]),
+            PolyD_Config.MIDI_TX_CHANNEL:     (self.tx, lambda config: self.midi_out_channels[config.midi_tx_channel_value]),
+            PolyD_Config.MIDI_IN_TRANSPOSE:   (self.in_transpose, lambda config: self.in_transposes[config.midi_in_transpose + 12]),
+            PolyD_Config.NOTE_ON_VELOCITY:    (self.velocity_on, lambda config: config.note_on_velocity),
+            PolyD_Config.NOTE_OFF_VELOCITY:   (self.velocity_off, lambda config: config.note_off_velocity),
+            PolyD_Config.VELOCITY_CURVE:      (self.velocity_curve, lambda config: config.velocity_curve),
+            PolyD_Config.KEY_PRIORITY:        (self.key_priority, lambda config: config.key_priority),
+            PolyD_Config.MULTI_TRIGGER:       (self.multi_trig, lambda config: config.multi_trigger),
+            PolyD_Config.PITCH_BEND_RANGE:    (self.pitch_bend, lambda config: self.pitch_bends[config.pitch_bend_range]),
+            PolyD_Config.MOD_WHEEL_RANGE:     (self.mod_range, lambda config: self.mod_ranges[config.mod_wheel_range]),
+            PolyD_Config.MODULATION_CURVE:    (self.modulation_curve, lambda config: config.modulation_curve),
+            PolyD_Config.NOTE_AT_ZERO_CV:     (self.note_zero, lambda config: str(config.note_at_zero_cv)),
+            PolyD_Config.SYNC_CLOCK_RATE:     (self.sync_rate, lambda config: config.sync_clock_rate),
+            PolyD_Config.SYNC_CLOCK_SOURCE:   (self.sync_source, lambda config: config.sync_clock_source),
+            PolyD_Config.LOCAL_KEYBOARD_MODE: (self.local_control, lambda config: config.local_keyboard_mode),
+            PolyD_Config.EXT_CLOCK_POLARITY:  (self.ext_clock_pol, lambda config: config.ext_clock_polarity),
+            PolyD_Config.ACCENT_VELOCITY:     (self.accent_velocity, lambda config: str(config.accent_velocity)),
+            PolyD_Config.MIDI_CLOCK_OUTPUT:   (self.clock_out, lambda config: config.midi_clock_output),
+            PolyD_Config.PITCH_WHEEL_OUTPUT:  (self.pbend_out, lambda config: config.pitch_wheel_output),
+            PolyD_Config.MOD_WHEEL_OUTPUT:    (self.modwheel_out, lambda config: config.mod_wheel_output),
+            PolyD_Config.KEYBOARD_OUTPUT:     (self.key_out, lambda config: config.keyboard_output),
+            PolyD_Config.AFTER_TOUCH_OUTPUT:  (self.at_out, lambda config: config.after_touch_output),
+            PolyD_Config.SEQUENCER_OUTPUT:    (self.seq_out, lambda config: config.sequencer_output),
+            PolyD_Config.ARPEGGIATOR_OUTPUT:  (self.arp_out, lambda config: config.arpeggiator_output),
+        }
+
+    def _update_fields(self, config, indices):
+        # Shows the settings with the given indices without writing them.
+        # Fields with changes that are not written yet keep their value.
+        fields = self._setting_fields()
         self.raise_events = False
-        self.version = ".".join([str(v) for v in self.polyd.get_version()])
-        config = self.polyd.get_config()
-        self.dev_id.text = str(config.device_id)
-        self.rx.text = self.midi_in_channels[config.midi_rx_channel_value]
-        self.tx.text = self.midi_out_channels[config.midi_tx_channel_value]
-        self.in_transpose.text = self.in_transposes[config.midi_in_transpose + 12]
-        self.velocity_on.set_velocity(config.note_on_velocity)
-        self.velocity_off.set_velocity(config.note_off_velocity)
-        self.velocity_curve.text = config.velocity_curve
-        self.key_priority.text = config.key_priority
-        self.multi_trig.text = config.multi_trigger
-        self.pitch_bend.text = self.pitch_bends[config.pitch_bend_range]
-        self.mod_range.text = self.mod_ranges[config.mod_wheel_range]
-        self.modulation_curve.text = config.modulation_curve
-        self.note_zero.text = str(config.note_at_zero_cv)
-        self.sync_rate.text = config.sync_clock_rate
-        self.sync_source.text = config.sync_clock_source
-        self.ext_clock_pol.text = config.ext_clock_polarity
-        self.accent_velocity.text = str(config.accent_velocity)
-        self.local_control.text = config.local_keyboard_mode
-        self.clock_out.text = config.midi_clock_output
-        self.pbend_out.text = config.pitch_wheel_output
-        self.modwheel_out.text = config.mod_wheel_output
-        self.key_out.text = config.keyboard_output
-        self.at_out.text = config.after_touch_output
-        self.seq_out.text = config.sequencer_output
-        self.arp_out.text = config.arpeggiator_output
+        for index in indices:
+            field, value = fields[index]
+            if self.writer.is_pending(field):
+                continue
+            if isinstance(field, VelocityEditor):
+                field.set_velocity(value(config))
+            else:
+                field.text = value(config)
         self.raise_events = True
 
-    def _value_changed(self, func, value):
+    def _settings_changed(self, config, indices):
+        # Changes made on the instrument
+        fields = self._setting_fields()
+        self._update_fields(config, indices)
+        self.__shown = bytes(config.values)
+        self._show_state([ fields[index][0] for index in indices if not self.writer.is_pending(fields[index][0]) ], None)
+
+    def _value_changed(self, field, func, value, delay=SELECT_DELAY):
         if not self.raise_events:
             return
-        func(value)
-
-    def _id_changed(value):
+        self._show_state([ field ], self.PENDING_COLOR)
+        self.writer.schedule(field, func, value, delay)
+        if self.sync is not None:
+            self.sync.interaction()
+
+    def _written(self, fields):
+        # The fields show the written values already
+        config = self.polyd.state.config
+        if config is not None and self.__shown is not None:
+            self.__shown = bytes(config.values)
+        self._show_state(fields, None)
+
+    def _write_failed(self, fields, exc):
+        print("Error:", getattr(exc, 'message', exc))
+        # The fields show values the Poly D does not have, so they are all
+        # set again by the next _fill_config()
+        self.__shown = None
+        self._show_state(fields, self.FAILED_COLOR)
+
+    def _show_state(self, fields, color):
+        # 'color' None shows the field as written
+        for field in fields:
+            widgets = [ field.mode, field.value ] if isinstance(field, VelocityEditor) else [ field ]
+            for widget in widgets:
+                if color is None and isinstance(widget, IntInput):
+                    widget.on_text(widget, widget.text)    # marks invalid numbers again
+                else:
+                    widget.background_color = color if color is not None else self.NORMAL_COLOR
+
+    def _id_changed(self, value):
         if value == "":
             return
         id = int(value)
@@ -338,3 +433,74 @@ class PolyDGuiView(BoxLayout):
     def _arp_out_changed(self, value):
         print("Arpeggiator Out", value)
         self.polyd.set_arp_out(value)
+
+class PolyDGui(App):
+    TITLE = "Poly D GUI"
+
+    def __init__(self, polyd, midi, port, ports, version, live_sync=True, **kwargs):
+        self.polyd = polyd
+        self.version = version
+        self.midi = midi
+        self.port = port
+        self.ports = ports
+        self.live_sync = live_sync
+        self.view = None
+        super().__init__(**kwargs)
+
+    def build(self):
+        self.title = self.TITLE
+        self.view = PolyDGuiView(self.polyd, self.version, self.live_sync)
+        # Reconnect automatically when the instrument is plugged in again.
+        # The events come from the watcher thread.
+        registry = midiports.default_registry()
+        registry.added += lambda in_id, out_id: Clock.schedule_once(lambda _: self._connect(in_id, out_id))
+        registry.removed += lambda in_id, out_id: Clock.schedule_once(lambda _: self._disconnect(in_id, out_id))
+        registry.watch(self.port)
+        return self.view
+
+    def on_stop(self):
+        if self.view.sync is not None:
+            self.view.sync.stop()
+        # Pending changes cannot be written while the instrument is gone
+        if self.ports is not None:
+            self.view.writer.flush()
+        else:
+            self.view.writer.cancel()
+        if not self.view.worker.stop():
+            print("Error: The Poly D did not answer, changes may not be written.")
+        midiports.default_registry().stop_watching()
+
+    def _connect(self, in_id, out_id):
+        if self.ports is not None:
+            return
+
+        def connect():
+            try:
+                self.midi.connect(in_id, out_id)
+                self.polyd.refresh()
+                # Another Poly D may have been plugged in
+                return self.polyd.get_version()
+            except (IOError, MidiException):
+                self.midi.disconnect()
+                raise
+
+        self.view.worker.submit(connect, lambda version: self._connected(in_id, out_id, version), lambda _: None)
+
+    def _connected(self, in_id, out_id, version):
+        self.ports = (in_id, out_id)
+        self.view.show_version(version)
+        self.view._show_config()
+        self.view.disabled = False
+        self.title = self.TITLE
+
+    def _disconnect(self, in_id, out_id):
+        if self.ports != (in_id, out_id):
+            return
+        self.ports = None
+        if self.view.sync is not None:
+            self.view.sync.stop()
+        self.view.writer.cancel()
+        self.view.worker.drop(MidiException("The Poly D was disconnected."))
+        self.view.worker.submit(self.midi.disconnect)
+        self.view.disabled = True
+        self.title = f"{self.TITLE} (disconnected)"
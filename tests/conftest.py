@@ -0,0 +1,100 @@
+import importlib.util
+import os
+import sys
+import threading
+import zipfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import polyd_codec
+from midiconnection import MidiConnection
+from polyd import PolyD
+from polyd_cmd import PolyD_Cmd
+from polyd_pacing import PolyD_Pacer
+from polyd_sim import PolyD_Simulator
+
+def load_script(name):
+    """ Imports one of the programs, whose file names are no module names. """
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_seq(note):
+    """ Returns a seq whose first step plays 'note'. """
+    step = [ 0x24 ] * 4 + [ 0x64 ] * 4 + [ 0x10, 0x23 ]
+    raw = bytearray(step * polyd_codec.STEP_COUNT) + bytes([ 0x00, 0x00, 0x1F, 0x00, 0x00, 0x05 ])
+    raw[0] = note
+    return bytes(PolyD_Cmd.pattern2Seq(polyd_codec.encode_pattern(bytes(raw))))
+
+def write_zip(path, seqs):
+    """ Writes a compressed zip file with the seqs in a dict mapping names to data. """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip:
+        for name, seq in seqs.items():
+            zip.writestr(name, seq)
+
+def damage_zip_member(path, name):
+    """ Breaks the compressed data of a zip member, reading it raises zlib.error. """
+    with zipfile.ZipFile(path) as zip:
+        offset = zip.getinfo(name).header_offset + 30 + len(name)
+    with open(path, "r+b") as fp:
+        fp.seek(offset)
+        data = fp.read(3)
+        fp.seek(offset)
+        fp.write(bytes(b ^ 0xFF for b in data))
+
+class FakeClock:
+    """ Stands in for kivy's Clock. The callbacks run on the calling thread
+        when advance() reaches their time. """
+
+    class Event:
+        def __init__(self, callback, time):
+            self.callback = callback
+            self.time = time
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self):
+        self.time = 0.0
+        self.__events = []
+        self.__lock = threading.Lock()
+
+    def get_time(self):
+        return self.time
+
+    def schedule_once(self, callback, timeout=0):
+        event = FakeClock.Event(callback, self.time + timeout)
+        with self.__lock:
+            self.__events.append(event)
+        return event
+
+    def advance(self, seconds=0):
+        self.time += seconds
+        while True:
+            with self.__lock:
+                due = [ event for event in self.__events if event.time <= self.time and not event.cancelled ]
+                self.__events = [ event for event in self.__events if event.time > self.time and not event.cancelled ]
+            if not due:
+                return
+            for event in sorted(due, key=lambda event: event.time):
+                event.callback(0)
+
+@pytest.fixture
+def simulator():
+    return PolyD_Simulator(seed=1)
+
+@pytest.fixture
+def midi(simulator):
+    midi = MidiConnection(simulator)
+    midi.connect(PolyD_Simulator.PORT_NAME, PolyD_Simulator.PORT_NAME)
+    yield midi
+    midi.disconnect()
+
+@pytest.fixture
+def polyd(midi):
+    return PolyD(midi, PolyD_Pacer())
@@ -0,0 +1,48 @@
+import asyncio
+
+from asyncmidiconnection import AsyncMidiConnection
+from asyncpolyd import AsyncPolyD
+from polyd_cmd import PolyD_Cmd
+from polyd_config import PolyD_Config
+from polyd_pacing import PolyD_Pacer
+
+from conftest import make_seq
+
+def test_concurrent_transactions_are_separate(midi, simulator):
+    polyd = AsyncPolyD(AsyncMidiConnection(midi), PolyD_Pacer())
+    written = asyncio.Event()
+
+    async def change():
+        async with polyd.transaction():
+            await polyd.set_velocity_on(100)
+            await written.wait()
+            # The setting of the other task was not collected by this one
+            assert simulator.settings[PolyD_Config.ACCENT_VELOCITY] == 90
+            assert simulator.settings[PolyD_Config.NOTE_ON_VELOCITY] != 100
+            await polyd.set_velocity_curve('hard')
+
+    async def set_accent():
+        await polyd.set_accent_velocity(90)
+        written.set()
+
+    async def main():
+        await polyd.get_config()
+        await asyncio.gather(change(), set_accent())
+        assert not polyd.polyd.in_transaction
+
+    asyncio.run(main())
+    assert simulator.settings[PolyD_Config.NOTE_ON_VELOCITY] == 100
+    assert simulator.settings[PolyD_Config.VELOCITY_CURVE] == PolyD_Config.CURVES.index('hard')
+    assert simulator.settings[PolyD_Config.ACCENT_VELOCITY] == 90
+
+def test_async_requests_match_the_sync_ones(midi, simulator):
+    polyd = AsyncPolyD(AsyncMidiConnection(midi), PolyD_Pacer())
+    seqs = { (1, 1): make_seq(50), (1, 2): make_seq(51) }
+    sysexes = [ PolyD_Cmd.seq2syx(0, bank, pattern, seq) for (bank, pattern), seq in seqs.items() ]
+
+    async def main():
+        assert await polyd.send_patterns(sysexes) == []
+        return await polyd.get_patterns(seqs, window=2, cached=False)
+
+    patterns = asyncio.run(main())
+    assert { slot: PolyD_Cmd.syx2seq(sysex) for slot, sysex in patterns.items() } == seqs
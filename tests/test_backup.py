@@ -0,0 +1,46 @@
+import os
+import zipfile
+
+from polyd_sim import PolyD_Simulator
+
+from conftest import load_script
+
+cli = load_script("polyd-cli.py")
+
+class Fleet:
+    """ Backend with one simulated Poly D per port name. Opening the ports
+        in 'broken' fails like it does for a port that vanished. """
+
+    def __init__(self, names, broken=()):
+        self.simulators = { name: PolyD_Simulator(seed=1) for name in names }
+        self.broken = broken
+
+    def get_input_names(self):
+        return list(self.simulators)
+
+    def get_output_names(self):
+        return list(self.simulators)
+
+    def open_input(self, name=None, callback=None):
+        if name in self.broken:
+            raise SystemError("MIDI port went away")
+        return self.simulators[name].open_input(name, callback)
+
+    def open_output(self, name=None):
+        if name in self.broken:
+            raise IOError("MIDI port went away")
+        return self.simulators[name].open_output(name)
+
+def test_one_failing_device_does_not_stop_the_others(tmp_path, capsys):
+    fleet = Fleet([ "POLY D 1", "POLY D 2", "POLY D 3" ], broken=[ "POLY D 2" ])
+    assert not cli.backup_all_devices("POLY D", str(tmp_path), 1, backend=fleet)
+    assert "Saved 2 of 3 devices, 1 failed." in capsys.readouterr().out
+    for name in ("POLY_D_1-id0.zip", "POLY_D_3-id0.zip"):
+        with zipfile.ZipFile(os.path.join(tmp_path, name)) as zip:
+            assert len(zip.namelist()) == 65
+    assert not os.path.exists(os.path.join(tmp_path, "POLY_D_2-id0.zip"))
+
+def test_all_devices_saved(tmp_path, capsys):
+    fleet = Fleet([ "POLY D 1", "POLY D 2" ])
+    assert cli.backup_all_devices("POLY D", str(tmp_path), 4, backend=fleet)
+    assert "Saved 2 of 2 devices, 0 failed." in capsys.readouterr().out
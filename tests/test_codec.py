@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+import polyd_codec
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_InvalidArgumentException
+
+# Byte by byte implementation of the 7 bit encoding as reference
+
+def reference_decode(data):
+    raw = bytearray()
+    for start in range(0, len(data), 8):
+        high = data[start]
+        for n, byte in enumerate(data[start + 1:start + 8]):
+            raw.append(byte | (((high >> n) & 1) << 7))
+    return bytes(raw)
+
+def reference_encode(raw):
+    data = bytearray()
+    for start in range(0, len(raw), 7):
+        group = raw[start:start + 7]
+        data.append(sum(((byte >> 7) & 1) << n for n, byte in enumerate(group)))
+        data.extend(byte & 0x7F for byte in group)
+    return bytes(data)
+
+def reference_checksum(pattern_data):
+    total = 0
+    for i in range(len(pattern_data)):
+        total += pattern_data[i]
+    return (total & 0x7f, (total & 0x80) >> 7)
+
+def random_raws(count, seed=1):
+    generator = random.Random(seed)
+    return [ bytes(generator.randrange(256) for _ in range(polyd_codec.RAW_SIZE)) for _ in range(count) ]
+
+def test_sizes_end_with_a_partial_group():
+    assert PolyD_Cmd.PATTERN_SIZE == 373 and polyd_codec.RAW_SIZE == 326
+    assert PolyD_Cmd.PATTERN_SIZE % 8 == 5 and polyd_codec.RAW_SIZE % 7 == 4
+
+@pytest.mark.parametrize("raw", random_raws(20) + [ bytes(326), bytes([ 0xFF ]) * 326 ])
+def test_single_pattern_matches_the_reference(raw):
+    data = reference_encode(raw)
+    assert len(data) == PolyD_Cmd.PATTERN_SIZE
+    assert bytes(polyd_codec.encode_pattern(raw)) == data
+    assert bytes(polyd_codec.decode_pattern(data)) == raw
+
+def test_last_partial_group():
+    # Only the last four raw bytes have their high bit set
+    raw = bytes(322) + bytes([ 0x80, 0x81, 0xFF, 0x7F ])
+    data = bytes(polyd_codec.encode_pattern(raw))
+    assert data[-5:] == bytes([ 0b0111, 0x00, 0x01, 0x7F, 0x7F ])
+    assert bytes(polyd_codec.decode_pattern(data)) == raw
+
+def test_checksum_matches_the_reference():
+    for raw in random_raws(10):
+        data = bytes(polyd_codec.encode_pattern(raw))
+        assert PolyD_Cmd.calc_pattern_checksum(data) == reference_checksum(data)
+        sysex = PolyD_Cmd.pattern2syx(0, 1, 1, data)
+        assert tuple(sysex[13:15]) == reference_checksum(data)
+
+def test_stacked_patterns_match_the_reference():
+    raws = random_raws(300, seed=2)
+    datas = [ reference_encode(raw) for raw in raws ]
+    stacked = b''.join(datas)
+    assert bytes(polyd_codec.decode_patterns(stacked)) == b''.join(raws)
+    assert bytes(polyd_codec.decode_patterns(datas)) == b''.join(raws)
+    assert bytes(polyd_codec.encode_patterns(b''.join(raws))) == stacked
+    decoded = polyd_codec.decode_patterns(stacked)
+    assert polyd_codec.pattern_count(decoded) == 300
+    assert bytes(polyd_codec.pattern_view(decoded, 299)) == raws[299]
+    assert bytes(polyd_codec.config_view(decoded, 7)) == raws[7][320:]
+
+def test_wrong_sizes_are_rejected():
+    with pytest.raises(PolyD_InvalidArgumentException):
+        polyd_codec.decode_pattern(bytes(372))
+    with pytest.raises(PolyD_InvalidArgumentException):
+        polyd_codec.encode_pattern(bytes(327))
+    with pytest.raises(PolyD_InvalidArgumentException):
+        polyd_codec.decode_patterns(bytes(373 * 2 + 1))
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+import polyd_convert
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_Exception
+
+from conftest import damage_zip_member, make_seq, write_zip
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        fp.write(data)
+
+def run(jobs):
+    return [ job.run() for job in jobs ]
+
+def test_same_names_in_different_directories(tmp_path):
+    write(str(tmp_path / "in" / "live" / "b1p1.seq"), make_seq(40))
+    write(str(tmp_path / "in" / "studio" / "b1p1.seq"), make_seq(41))
+    inputs = polyd_convert.find_inputs([ str(tmp_path / "in") ])
+    out = str(tmp_path / "out")
+    jobs = polyd_convert.make_jobs(inputs, out, 'syx')
+    assert run(jobs) == [ (1, []), (1, []) ]
+    with open(os.path.join(out, "live", "b1p1.syx"), "rb") as fp:
+        assert PolyD_Cmd.syx2seq(fp.read()) == make_seq(40)
+    with open(os.path.join(out, "studio", "b1p1.syx"), "rb") as fp:
+        assert PolyD_Cmd.syx2seq(fp.read()) == make_seq(41)
+
+def test_bundles_of_directories_with_the_same_name(tmp_path):
+    write(str(tmp_path / "a" / "live" / "b1p1.seq"), make_seq(40))
+    write(str(tmp_path / "b" / "live" / "b1p1.seq"), make_seq(41))
+    inputs = polyd_convert.find_inputs([ str(tmp_path) ])
+    jobs = polyd_convert.make_jobs(inputs, str(tmp_path / "out"), 'zip')
+    assert len({ job.output for job in jobs }) == 2
+
+def test_collision_is_rejected(tmp_path):
+    write(str(tmp_path / "b1p1.seq"), make_seq(40))
+    write(str(tmp_path / "b1p1.syx"), PolyD_Cmd.seq2syx(0, 1, 1, make_seq(41)))
+    inputs = polyd_convert.find_inputs([ str(tmp_path) ])
+    with pytest.raises(PolyD_Exception):
+        polyd_convert.make_jobs(inputs, str(tmp_path / "out"), 'seq')
+
+def test_bank_and_pattern_need_a_single_pattern(tmp_path):
+    write(str(tmp_path / "b1p1.seq"), make_seq(40))
+    write(str(tmp_path / "b1p2.seq"), make_seq(41))
+    inputs = polyd_convert.find_inputs([ str(tmp_path) ])
+    jobs = polyd_convert.make_jobs(inputs, str(tmp_path / "out"), 'zip', 3, 4)
+    count, errors = jobs[0].run()
+    assert count == 0 and len(errors) == 1
+    assert not os.path.exists(jobs[0].output)
+
+def test_slot_names():
+    assert PolyD_Cmd.parse_slot("b1p2") == (1, 2)
+    assert PolyD_Cmd.parse_slot("b9p2") == (None, None)
+    assert PolyD_Cmd.parse_slot("live/B3 p4.seq", ".seq") == (3, 4)
+    assert PolyD_Cmd.parse_slot("b3p4.syx", ".seq") == (None, None)
+
+def test_damaged_zip_fails_alone(tmp_path):
+    write_zip(str(tmp_path / "damaged.zip"), { "b1p1.seq": make_seq(40), "b1p2.seq": make_seq(41) })
+    damage_zip_member(str(tmp_path / "damaged.zip"), "b1p2.seq")
+    write_zip(str(tmp_path / "good.zip"), { "b1p1.seq": make_seq(42) })
+    inputs = polyd_convert.find_inputs([ str(tmp_path) ])
+    jobs = polyd_convert.make_jobs(inputs, str(tmp_path / "out"), 'seq')
+    results = { os.path.basename(job.inputs[0]): (count, errors) for job, count, errors in polyd_convert.convert(jobs, 1) }
+    assert results["good.zip"] == (1, [])
+    count, errors = results["damaged.zip"]
+    assert count == 0 and len(errors) == 1
@@ -0,0 +1,67 @@
+import json
+import threading
+
+import pytest
+
+from polyd_cmd import PolyD_Cmd
+from polyd_config import PolyD_Config
+from polyd_daemon import PolyD_Daemon, PolyD_DaemonClient, is_running
+from polyd_sim import PolyD_Simulator
+
+from conftest import make_seq
+
+@pytest.fixture
+def daemon(simulator, tmp_path):
+    daemon = PolyD_Daemon(str(tmp_path / "daemon.sock"), simulator)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    while not is_running(daemon.path):
+        pass
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+
+def client(daemon):
+    return PolyD_DaemonClient("POLY D", daemon.path)
+
+def test_settings_changed_on_the_instrument_are_read(daemon, simulator):
+    with client(daemon) as polyd:
+        assert polyd.get_config().accent_velocity == simulator.settings[PolyD_Config.ACCENT_VELOCITY]
+    simulator.settings[PolyD_Config.ACCENT_VELOCITY] = 77
+    with client(daemon) as polyd:
+        assert polyd.get_config().accent_velocity == 77
+
+def test_patterns_are_kept_while_the_settings_are_unchanged(daemon, simulator):
+    with client(daemon) as polyd:
+        mirrored = polyd.get_patterns([ (1, 1) ])[(1, 1)]
+    data = PolyD_Cmd.extract_pattern_from_seq(make_seq(60))
+    simulator.patterns[(0, 0)] = data
+    with client(daemon) as polyd:
+        assert polyd.get_patterns([ (1, 1) ])[(1, 1)] == mirrored
+        assert PolyD_Cmd.extract_pattern_from_syx(polyd.get_patterns([ (1, 1) ], cached=False)[(1, 1)]) == data
+
+def test_patterns_are_read_again_when_the_settings_changed(daemon, simulator):
+    with client(daemon) as polyd:
+        polyd.get_patterns([ (1, 1) ])
+    data = PolyD_Cmd.extract_pattern_from_seq(make_seq(60))
+    simulator.patterns[(0, 0)] = data
+    simulator.settings[PolyD_Config.ACCENT_VELOCITY] ^= 1
+    with client(daemon) as polyd:
+        assert PolyD_Cmd.extract_pattern_from_syx(polyd.get_patterns([ (1, 1) ])[(1, 1)]) == data
+
+def test_backend_failures_are_answered(tmp_path):
+    class BrokenSimulator(PolyD_Simulator):
+        def open_input(self, name=None, callback=None):
+            raise SystemError("MIDI port went away")
+
+    daemon = PolyD_Daemon(str(tmp_path / "daemon.sock"), BrokenSimulator())
+    answer = daemon.handle_request(json.dumps({ 'port': "POLY D", 'method': 'get_config' }))
+    assert answer == { 'error': "MIDI port went away", 'type': 'PolyD_MidiException' }
+
+def test_settings_are_written_in_one_transaction(daemon, simulator):
+    with client(daemon) as polyd:
+        with polyd.transaction():
+            polyd.set_accent_velocity(90)
+            polyd.set_velocity_on(100)
+        assert polyd.get_config().accent_velocity == 90
+    assert simulator.settings[PolyD_Config.NOTE_ON_VELOCITY] == 100
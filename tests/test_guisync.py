@@ -0,0 +1,141 @@
+import threading
+
+from delegate import Delegate
+from polyd_config import PolyD_Config
+from polyd_exc import PolyD_MidiException
+from polydguisync import LiveSync, PolyDWorker, WriteScheduler, changed_settings
+
+from conftest import FakeClock
+
+class ImmediateWorker:
+    """ Runs the commands right away instead of on a thread. """
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, func, on_done=None, on_error=None):
+        self.submitted += 1
+        try:
+            result = func()
+        except Exception as exc:
+            if on_error is not None:
+                on_error(exc)
+            return
+        if on_done is not None:
+            on_done(result)
+
+class IdleWriter:
+    def __init__(self):
+        self.written = Delegate()
+        self.pending = False
+
+def test_only_changed_settings_are_listed(polyd):
+    config = polyd.get_config()
+    assert changed_settings(None, config) == list(range(PolyD_Config.SIZE))
+    assert changed_settings(bytes(config.values), config) == []
+    changed = config.with_values({ PolyD_Config.DEVICE_ID: 5, PolyD_Config.ARPEGGIATOR_OUTPUT: 2 })
+    assert changed.values[PolyD_Config.DEVICE_ID] != config.values[PolyD_Config.DEVICE_ID]
+    assert changed_settings(bytes(config.values), changed) == [ PolyD_Config.DEVICE_ID, PolyD_Config.ARPEGGIATOR_OUTPUT ]
+
+def test_changes_on_the_instrument_are_reported(polyd, simulator):
+    clock = FakeClock()
+    sync = LiveSync(polyd, ImmediateWorker(), IdleWriter(), clock)
+    changes = []
+    sync.changed += lambda config, indices: changes.append(indices)
+    sync.start(polyd.get_config())
+
+    clock.advance(LiveSync.MIN_INTERVAL)
+    assert changes == []
+    assert sync.interval == 2 * LiveSync.MIN_INTERVAL
+
+    simulator.settings[PolyD_Config.ACCENT_VELOCITY] ^= 1
+    clock.advance(sync.interval)
+    assert changes == [ [ PolyD_Config.ACCENT_VELOCITY ] ]
+    assert sync.interval == LiveSync.MIN_INTERVAL
+
+def test_own_writes_are_not_reported(polyd):
+    clock = FakeClock()
+    writer = IdleWriter()
+    sync = LiveSync(polyd, ImmediateWorker(), writer, clock)
+    changes = []
+    sync.changed += lambda config, indices: changes.append(indices)
+    config = polyd.get_config()
+    sync.start(config)
+
+    velocity = 1 if config.note_on_velocity != 1 else 2
+    polyd.set_velocity_on(velocity)
+    writer.written([ 'velocity_on' ])
+    clock.advance(LiveSync.MIN_INTERVAL)
+    assert polyd.state.config.note_on_velocity == velocity
+    assert changes == []
+
+def test_rapid_edits_are_written_once(polyd, simulator):
+    clock = FakeClock()
+    worker = ImmediateWorker()
+    writer = WriteScheduler(polyd, worker, clock)
+    written = []
+    writer.written += written.append
+    polyd.get_config()
+    sent = []
+    receive = simulator.receive
+    simulator.receive = lambda data: (sent.append(bytes(data)), receive(data))
+
+    for velocity in (1, 12, 127):
+        writer.schedule('velocity_on', polyd.set_velocity_on, velocity, 0.6)
+        clock.advance(0.2)
+    writer.schedule('curve', polyd.set_velocity_curve, 'hard', 0.15)
+    clock.advance(0.3)
+    assert writer.pending and worker.submitted == 0
+
+    # Written together once the typed field has been quiet for its delay
+    clock.advance(0.1)
+    assert not writer.pending
+    assert worker.submitted == 1
+    assert len(sent) == 1
+    assert written == [ [ 'velocity_on', 'curve' ] ]
+    assert simulator.settings[PolyD_Config.NOTE_ON_VELOCITY] == 127
+    assert simulator.settings[PolyD_Config.VELOCITY_CURVE] == PolyD_Config.CURVES.index('hard')
+
+def test_cancelled_edits_are_not_written(polyd):
+    clock = FakeClock()
+    worker = ImmediateWorker()
+    writer = WriteScheduler(polyd, worker, clock)
+    writer.schedule('velocity_on', polyd.set_velocity_on, 1, 0.15)
+    writer.cancel()
+    clock.advance(1)
+    assert worker.submitted == 0
+
+def test_failing_requests_do_not_stop_the_worker(polyd, capsys):
+    clock = FakeClock()
+    worker = PolyDWorker(clock)
+    results = []
+    errors = []
+
+    def fail():
+        raise SystemError("backend failed")
+
+    worker.submit(fail, results.append, errors.append)
+    worker.submit(fail)
+    worker.submit(polyd.get_config, results.append, errors.append)
+    assert worker.stop()
+    # The callbacks run on the thread of the clock
+    assert results == [] and errors == []
+    clock.advance()
+    assert [ str(exc) for exc in errors ] == [ "backend failed" ]
+    assert results == [ polyd.state.config ]
+    assert "Error: backend failed" in capsys.readouterr().out
+
+def test_dropped_requests_are_reported(polyd):
+    clock = FakeClock()
+    worker = PolyDWorker(clock)
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+    worker.submit(lambda: (started.set(), release.wait()))
+    started.wait()
+    worker.submit(polyd.get_config, None, errors.append)
+    worker.drop(PolyD_MidiException("The Poly D was disconnected."))
+    release.set()
+    assert worker.stop()
+    clock.advance()
+    assert [ exc.message for exc in errors ] == [ "The Poly D was disconnected." ]
+    assert polyd.state.config is None
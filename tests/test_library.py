@@ -0,0 +1,31 @@
+import os
+
+from polyd_cmd import PolyD_Cmd
+from polyd_library import PolyD_Library
+
+from conftest import damage_zip_member, make_seq, write_zip
+
+def test_damaged_files_are_indexed_without_patterns(tmp_path):
+    patterns = tmp_path / "patterns"
+    patterns.mkdir()
+    (patterns / "b1p1.seq").write_bytes(make_seq(50))
+    write_zip(patterns / "damaged.zip", { "b1p1.seq": make_seq(51), "b1p2.seq": make_seq(52) })
+    damage_zip_member(str(patterns / "damaged.zip"), "b1p2.seq")
+    (patterns / "truncated.zip").write_bytes((patterns / "damaged.zip").read_bytes()[:40])
+
+    with PolyD_Library(str(tmp_path / "library.db")) as library:
+        assert library.index(str(patterns)) == (3, 0, 0)
+        assert [ entry.location for entry in library.query() ] == [ str(patterns / "b1p1.seq") ]
+        assert library.index(str(patterns)) == (0, 3, 0)
+
+def test_changed_files_are_replaced(tmp_path):
+    path = tmp_path / "b2p3.seq"
+    path.write_bytes(make_seq(50))
+    with PolyD_Library(str(tmp_path / "library.db")) as library:
+        library.index(str(tmp_path))
+        path.write_bytes(make_seq(60))
+        os.utime(path, (1, 1))
+        assert library.index(str(tmp_path)) == (1, 0, 0)
+        entries = library.query()
+        assert [ (entry.bank, entry.pattern) for entry in entries ] == [ (2, 3) ]
+        assert entries[0].hash == PolyD_Cmd.calc_pattern_hash(PolyD_Cmd.extract_pattern_from_seq(make_seq(60)))
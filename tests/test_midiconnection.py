@@ -0,0 +1,37 @@
+import pytest
+
+from midiconnection import MidiException
+from polyd_cmd import PolyD_Cmd
+from polyd_stats import PolyD_Stats
+
+def test_cancelled_request_does_not_break_the_input(midi):
+    request = PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.GET_FW_VERSION, 0 ])
+    match = PolyD_Cmd.make_reply_matcher(PolyD_Cmd.FW_VERSION_RESULT)
+    future = midi.expect(match, request)
+    future.cancel()
+    answer = midi.sysex_communicate(request, match, 1.0)
+    assert answer[8] == PolyD_Cmd.FW_VERSION_RESULT
+
+def test_result_is_matched_to_the_addressed_device():
+    request = PolyD_Cmd.make_sysex(5, [ PolyD_Cmd.SET_ACCENT_VELOCITY, 100 ])
+    match = PolyD_Cmd.make_result_matcher(request)
+    assert match(PolyD_Cmd.make_sysex(5, [ PolyD_Cmd.RESULT, 0x00, 0x00 ]))
+    assert not match(PolyD_Cmd.make_sysex(6, [ PolyD_Cmd.RESULT, 0x00, 0x00 ]))
+    assert not match(PolyD_Cmd.make_sysex(5, [ PolyD_Cmd.FW_VERSION_RESULT, 0x00, 1, 1, 3 ]))
+    broadcast = PolyD_Cmd.make_result_matcher(PolyD_Cmd.make_sysex(0, [ PolyD_Cmd.SET_ACCENT_VELOCITY, 100 ]))
+    assert broadcast(PolyD_Cmd.make_sysex(6, [ PolyD_Cmd.RESULT, 0x00, 0x00 ]))
+
+def test_answers_are_counted_for_their_request(polyd, midi, simulator):
+    midi.stats = PolyD_Stats()
+    polyd.get_pattern(1, 1)
+    polyd.set_accent_velocity(90)
+    simulator.error_rate = 1.0
+    with pytest.raises(MidiException):
+        polyd.set_velocity_on(100)
+    commands = midi.stats.commands
+    assert commands[PolyD_Cmd.GET_SEQ_PATTERN].bytes_received == PolyD_Cmd.PATTERN_SYX_SIZE
+    assert PolyD_Cmd.SEQ_PATTERN not in commands
+    assert commands[PolyD_Cmd.SET_ACCENT_VELOCITY].bytes_received > 0
+    assert commands[PolyD_Cmd.SET_ACCENT_VELOCITY].errors == 0
+    assert commands[PolyD_Cmd.SET_VELOCITY_INFO].errors == commands[PolyD_Cmd.SET_VELOCITY_INFO].requests
+    assert PolyD_Cmd.RESULT not in commands
@@ -0,0 +1,66 @@
+import queue
+
+from midiports import MidiPortRegistry
+
+class FakePorts:
+    """ Backend that only lists port names. 'failing' makes the next
+        enumeration fail like it can while a device is plugged in. """
+
+    def __init__(self, inputs, outputs):
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.enumerations = 0
+        self.failing = False
+
+    def get_input_names(self):
+        self.enumerations += 1
+        if self.failing:
+            self.failing = False
+            raise SystemError("Enumeration failed")
+        return list(self.inputs)
+
+    def get_output_names(self):
+        return list(self.outputs)
+
+def test_ports_are_paired_by_name():
+    backend = FakePorts([ "POLY D 2", "Keystep", "POLY D", "poly d In" ],
+                        [ "POLY D", "Keystep", "POLY D 2", "poly d Out" ])
+    registry = MidiPortRegistry(backend)
+    assert registry.pairs("POLY D") == [ ("POLY D", "POLY D"), ("POLY D 2", "POLY D 2") ]
+    assert registry.pairs("poly d") == [ ("poly d In", "poly d Out") ]
+    assert registry.first_pair("Keystep") == ("Keystep", "Keystep")
+    assert registry.first_pair("Minilogue") == (None, None)
+    assert registry.ids == [ "Keystep", "POLY D", "POLY D 2", "poly d In", "poly d Out" ]
+
+def test_ports_are_enumerated_until_refresh():
+    backend = FakePorts([ "POLY D" ], [ "POLY D" ])
+    registry = MidiPortRegistry(backend)
+    assert registry.inputs == [ "POLY D" ]
+    backend.inputs.append("POLY D 2")
+    backend.outputs.append("POLY D 2")
+    assert registry.pairs("POLY D") == [ ("POLY D", "POLY D") ]
+    assert backend.enumerations == 1
+    registry.refresh()
+    assert registry.pairs("POLY D") == [ ("POLY D", "POLY D"), ("POLY D 2", "POLY D 2") ]
+    assert backend.enumerations == 2
+
+def test_watcher_reports_plugged_and_unplugged_instruments():
+    backend = FakePorts([ "POLY D", "Keystep" ], [ "POLY D", "Keystep" ])
+    registry = MidiPortRegistry(backend)
+    events = queue.Queue()
+    registry.added += lambda in_id, out_id: events.put(("added", in_id, out_id))
+    registry.removed += lambda in_id, out_id: events.put(("removed", in_id, out_id))
+    registry.watch("POLY D", interval=0.01)
+    try:
+        backend.failing = True
+        backend.inputs.append("POLY D 2")
+        backend.outputs.append("POLY D 2")
+        assert events.get(timeout=2) == ("added", "POLY D 2", "POLY D 2")
+        backend.inputs.remove("POLY D")
+        backend.outputs.remove("POLY D")
+        backend.inputs.remove("Keystep")
+        backend.outputs.remove("Keystep")
+        assert events.get(timeout=2) == ("removed", "POLY D", "POLY D")
+    finally:
+        registry.stop_watching()
+    assert events.empty()
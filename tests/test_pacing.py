@@ -0,0 +1,44 @@
+from polyd_cmd import PolyD_Cmd
+from polyd_pacing import PolyD_Pacer
+
+from conftest import load_script, make_seq
+
+cli = load_script("polyd-cli.py")
+
+def make_seqs():
+    return { slot: make_seq(20 + i) for i, slot in enumerate(cli.all_slots()) }
+
+def written(simulator, seqs):
+    """ Returns the slots whose pattern on the simulator equals the seq. """
+    return { (bank, pattern) for (bank, pattern), seq in seqs.items()
+             if simulator.patterns[(bank - 1, pattern - 1)] == PolyD_Cmd.extract_pattern_from_seq(seq) }
+
+def test_window_is_not_shorter_than_the_latency():
+    pacer = PolyD_Pacer()
+    pacer.gap = PolyD_Pacer.MIN_GAP
+    pacer.observe(0.03)
+    assert pacer.window >= 0.03
+
+def test_restore_reports_every_pattern_that_was_not_written(polyd, simulator):
+    simulator.latency = 0.01
+    polyd.get_version()
+    simulator.error_rate = 0.2
+    seqs = dict(list(make_seqs().items())[:24])
+    failed = cli.restore_patterns(polyd, seqs)
+    assert written(simulator, seqs) == set(seqs) - set(failed)
+
+def test_restore_with_errors_after_the_gap(polyd, simulator):
+    # The pacer learns from the replies that errors take longer than its gap
+    simulator.latency = 0.03
+    polyd.get_version()
+    polyd.pacer.gap = PolyD_Pacer.MIN_GAP
+    simulator.error_rate = 0.2
+    seqs = dict(list(make_seqs().items())[:16])
+    failed = cli.restore_patterns(polyd, seqs)
+    assert written(simulator, seqs) == set(seqs) - set(failed)
+
+def test_only_accepted_patterns_are_mirrored(polyd, simulator):
+    simulator.error_rate = 1.0
+    seqs = { (1, 1): make_seq(40) }
+    assert cli.restore_patterns(polyd, seqs) == [ (1, 1) ]
+    assert polyd.state.get_pattern(1, 1) is None
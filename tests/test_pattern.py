@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_InvalidArgumentException
+from polyd_pattern import PolyD_Pattern
+
+from conftest import make_seq
+
+def random_syx(seed):
+    # 7 bit data with every bit set at random, including the unused ones
+    generator = random.Random(seed)
+    data = bytes(generator.randrange(128) for _ in range(PolyD_Cmd.PATTERN_SIZE))
+    return bytes(PolyD_Cmd.pattern2syx(0, 3, 5, data))
+
+@pytest.mark.parametrize("seed", range(10))
+def test_sysex_round_trip_is_byte_identical(seed):
+    sysex = random_syx(seed)
+    assert bytes(PolyD_Pattern.from_syx(sysex).to_syx(0, 3, 5)) == sysex
+
+def test_modifying_keeps_unused_bits():
+    sysex = random_syx(1)
+    data = bytearray(PolyD_Cmd.extract_pattern_from_syx(sysex))
+    data[-5] |= 0x70
+    pattern = PolyD_Pattern.from_pattern_data(data)
+    flags = list(pattern.flags)
+    configs = list(pattern.step_configs)
+    pattern.set_note(3, 2, 60)
+    pattern.set_accent(3, not pattern.accent(3))
+    pattern.set_gate(4, 7 - pattern.gate(4))
+    encoded = pattern.to_pattern_data()
+    assert encoded[-5] & 0x70 == 0x70
+    decoded = PolyD_Pattern.from_pattern_data(encoded)
+    assert decoded.note(3, 2) == 60
+    # Only the changed bits differ
+    assert decoded.flags[3] ^ flags[3] == 0x04
+    assert decoded.step_configs[4] & ~0x07 == configs[4] & ~0x07
+    assert [ b for i, b in enumerate(decoded.flags) if i != 3 ] == [ b for i, b in enumerate(flags) if i != 3 ]
+
+def test_step_fields():
+    pattern = PolyD_Pattern.from_seq(make_seq(50))
+    assert pattern.note(0, 0) == 50
+    pattern.set_voice_count(1, 3)
+    pattern.set_ratchet(1, 2)
+    pattern.set_gate(1, 5)
+    assert (pattern.voice_count(1), pattern.ratchet(1), pattern.gate(1)) == (3, 2, 5)
+    pattern.set_gate(1, 0)
+    assert (pattern.voice_count(1), pattern.ratchet(1), pattern.gate(1)) == (3, 2, 0)
+    pattern.set_voice_used(1, 3, True)
+    pattern.set_rest(1, True)
+    assert pattern.voice_used(1, 3) and pattern.rest(1) and not pattern.glide(1)
+    for setter, value in ((pattern.set_gate, 8), (pattern.set_ratchet, 4), (pattern.set_voice_count, 0)):
+        with pytest.raises(PolyD_InvalidArgumentException):
+            setter(1, value)
+    with pytest.raises(PolyD_InvalidArgumentException):
+        pattern.voice_used(1, 4)
+
+def test_pattern_fields():
+    pattern = PolyD_Pattern.from_seq(make_seq(50))
+    pattern.step_count = 16
+    pattern.swing = 66
+    pattern.transpose = -12
+    pattern.division_value = PolyD_Pattern.DIVISIONS.index('1/8T')
+    copy = PolyD_Pattern.from_seq(pattern.to_seq())
+    assert (copy.step_count, copy.swing, copy.transpose, copy.division) == (16, 66, -12, '1/8T')
+    assert copy == pattern
+    with pytest.raises(PolyD_InvalidArgumentException):
+        pattern.division_value = len(PolyD_Pattern.DIVISIONS)
+
+def test_views_write_through():
+    pattern = PolyD_Pattern.from_seq(make_seq(50))
+    pattern.notes(1)[:] = bytes(range(40, 72))
+    assert [ pattern.note(step, 1) for step in range(32) ] == list(range(40, 72))
+    assert PolyD_Pattern.from_pattern_data(pattern.to_pattern_data()).note(31, 1) == 71
@@ -0,0 +1,32 @@
+import pytest
+
+from midiconnection import MidiException
+
+from polyd import PolyD
+from polyd_exc import PolyD_MidiException
+from polyd_pacing import PolyD_Pacer
+from polyd_policy import PolyD_Policies, PolyD_Policy
+
+def test_rejected_settings_are_not_retried(midi, simulator):
+    policies = PolyD_Policies(settings=PolyD_Policy(timeout=0.5, retries=2))
+    polyd = PolyD(midi, PolyD_Pacer(), policies)
+    polyd.get_config()
+    simulator.error_rate = 1.0
+    sent = []
+    write = midi.write
+    midi.write = lambda data: (sent.append(bytes(data)), write(data))
+    with pytest.raises(PolyD_MidiException):
+        polyd.set_accent_velocity(100)
+    assert len(sent) == 1
+
+def test_lost_answers_are_retried(midi, simulator):
+    policies = PolyD_Policies(settings=PolyD_Policy(timeout=0.05, retries=2, backoff=1.0))
+    polyd = PolyD(midi, PolyD_Pacer(), policies)
+    polyd.get_config()
+    simulator.drop_rate = 1.0
+    sent = []
+    write = midi.write
+    midi.write = lambda data: (sent.append(bytes(data)), write(data))
+    with pytest.raises(MidiException):
+        polyd.set_accent_velocity(100)
+    assert len(sent) == policies[PolyD_Policies.SETTINGS].attempts == 3
@@ -0,0 +1,75 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from polyd_exc import PolyD_InvalidArgumentException
+
+from conftest import load_script, make_seq
+
+cli = load_script("polyd-cli.py")
+
+def script(tmp_path, steps):
+    filename = str(tmp_path / "script.json")
+    with open(filename, "w") as fp:
+        json.dump(steps, fp)
+    return cli.load_script(filename)
+
+def run(polyd, steps):
+    out = io.StringIO()
+    ok = cli.run_script(polyd, polyd.get_version(), steps, 1, out)
+    return ok, [ json.loads(line) for line in out.getvalue().splitlines() ]
+
+def test_numbers_given_as_text_are_converted(tmp_path):
+    steps = script(tmp_path, [ { "op": "set", "vel_on": "100" } ])
+    assert steps[0]["vel_on"] == 100
+
+@pytest.mark.parametrize("step", [
+    { "op": "set", "vel_on": "loud" },
+    { "op": "set", "vel_on": True },
+    { "op": "set", "mod_range": "1000%" },
+    { "op": "set", "volume": 3 },
+    { "op": "restore", "file": "a.zip", "remap": { "b9p1": "b1p1" } },
+    { "op": "restore", "file": "a.zip", "bank": "1" },
+    { "op": "verify", "settings": { "seq_out": [ "USB" ] } },
+])
+def test_invalid_values_are_rejected(tmp_path, step):
+    with pytest.raises(PolyD_InvalidArgumentException):
+        script(tmp_path, [ step ])
+
+def test_verify_compares_the_values_the_setters_accept(polyd, tmp_path):
+    steps = script(tmp_path, [
+        { "op": "set", "mod_range": "100%", "vel_curve": "med", "local": "off", "rx": "all", "vel_on": "90" },
+        { "op": "verify", "settings": { "mod_range": "100%", "vel_curve": "medium", "local": "no", "rx": "All", "vel_on": 90 } },
+        { "op": "verify", "settings": { "mod_range": 2, "vel_curve": 1 } },
+        { "op": "verify", "settings": { "mod_range": "200%" } },
+    ])
+    ok, lines = run(polyd, steps)
+    assert not ok
+    assert [ line["ok"] for line in lines ] == [ True, True, True, False ]
+    assert lines[3]["differences"] == [ "mod_range" ]
+
+def test_every_failure_is_reported(polyd, tmp_path):
+    # A zip file whose pattern does not match its CRC
+    filename = str(tmp_path / "broken.zip")
+    with zipfile.ZipFile(filename, "w") as zip:
+        zip.writestr(cli.pattern_name(1, 1), make_seq(40))
+    with open(filename, "rb") as fp:
+        data = fp.read().replace(make_seq(40), make_seq(41))
+    with open(filename, "wb") as fp:
+        fp.write(data)
+    ok, lines = run(polyd, script(tmp_path, [ { "op": "restore", "file": filename } ]))
+    assert not ok
+    assert lines == [ { "step": 1, "op": "restore", "ok": False, "error": lines[0]["error"], "time": lines[0]["time"] } ]
+
+def test_settings_are_merged_across_pattern_steps(tmp_path):
+    steps = script(tmp_path, [
+        { "op": "set", "seq_out": "USB" },
+        { "op": "restore", "file": "a.zip", "patterns_only": True },
+        { "op": "set", "arp_out": "USB" },
+        { "op": "restore", "file": "a.zip" },
+        { "op": "set", "vel_on": 100 },
+        { "op": "dump" },
+    ])
+    assert cli.schedule_script(steps) == [ [ 1 ], [ 0, 2 ], [ 3 ], [ 4 ], [ 5 ] ]
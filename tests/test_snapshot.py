@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+from polyd_cmd import PolyD_Cmd
+from polyd_exc import PolyD_Exception
+from polyd_snapshot import PolyD_SnapshotStore
+
+from conftest import load_script, make_seq
+
+cli = load_script("polyd-cli.py")
+
+def take(store, polyd, name=None):
+    config = polyd.refresh()
+    patterns = polyd.get_patterns(cli.all_slots(), cached=False)
+    seqs = { slot: PolyD_Cmd.syx2seq(sysex) for slot, sysex in patterns.items() }
+    return store.create(config.sysex, seqs, name)
+
+def test_unchanged_data_is_stored_once(polyd, simulator, tmp_path):
+    store = PolyD_SnapshotStore(str(tmp_path))
+    # The factory patterns are all the same
+    assert take(store, polyd, "first") == ("first", 2)
+    simulator.patterns[(2, 3)] = PolyD_Cmd.extract_pattern_from_seq(make_seq(50))
+    assert take(store, polyd, "second") == ("second", 1)
+    assert store.diff("first", "second") == [ ("b3p4", store.load("first")["items"]["b3p4"],
+                                               PolyD_Cmd.calc_hash(make_seq(50))) ]
+    with pytest.raises(PolyD_Exception):
+        take(store, polyd, "second")
+
+def test_snapshots_of_the_same_second_are_kept(polyd, tmp_path):
+    store = PolyD_SnapshotStore(str(tmp_path))
+    names = [ take(store, polyd)[0] for _ in range(3) ]
+    assert len(set(names)) == 3
+    assert [ manifest["name"] for manifest in store.list() ] == sorted(names)
+
+def test_restore(polyd, simulator, tmp_path):
+    store = PolyD_SnapshotStore(str(tmp_path))
+    simulator.patterns[(0, 0)] = PolyD_Cmd.extract_pattern_from_seq(make_seq(50))
+    name, _ = take(store, polyd)
+    original = dict(simulator.patterns)
+    simulator.factory_restore()
+    assert cli.restore_patterns(polyd, store.get_patterns(name)) == []
+    assert simulator.patterns == original
+
+def test_unknown_items_are_rejected(tmp_path):
+    store = PolyD_SnapshotStore(str(tmp_path))
+    store.create(None, { (1, 1): make_seq(50) }, "broken")
+    path = os.path.join(str(tmp_path), "snapshots", "broken.json")
+    with open(path) as fp:
+        manifest = json.load(fp)
+    manifest["items"]["b9"] = manifest["items"].pop("b1p1")
+    with open(path, "w") as fp:
+        json.dump(manifest, fp)
+    with pytest.raises(PolyD_Exception):
+        store.get_patterns("broken")
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, load_script
+
+cli = load_script("polyd-cli.py")
+
+# Loaded when a port is opened, the window is created or a subcommand runs
+LAZY_MODULES = ("rtmidi", "mido", "kivy", "sqlite3", "zipfile", "concurrent.futures", "asyncio")
+
+@pytest.mark.parametrize("program", [ "polyd-cli.py", "polyd-gui.py" ])
+def test_version_does_not_load_lazy_modules(program):
+    result = subprocess.run([ sys.executable, "-X", "importtime", os.path.join(ROOT, program), "--version" ],
+                            capture_output=True, text=True, check=True)
+    imported = { line.split("|")[-1].strip() for line in result.stderr.splitlines() if "|" in line }
+    assert not [ module for module in imported if module.split(".")[0] in LAZY_MODULES or module in LAZY_MODULES ]
+
+def test_startup_is_within_budget(capsys):
+    # The budget is generous, machines running the tests may be slow
+    assert cli.startup_benchmark(3, 500), capsys.readouterr().out
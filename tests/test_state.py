@@ -0,0 +1,72 @@
+import pytest
+
+from polyd import PolyD
+from polyd_cmd import PolyD_Cmd
+from polyd_config import PolyD_Config
+from polyd_exc import PolyD_MidiException
+from polyd_pacing import PolyD_Pacer
+from polyd_policy import PolyD_Policies, PolyD_Policy
+
+from conftest import load_script, make_seq
+
+cli = load_script("polyd-cli.py")
+
+def test_accepted_patterns_are_mirrored(polyd, midi):
+    seqs = { (2, 3): make_seq(50) }
+    assert cli.restore_patterns(polyd, seqs) == []
+    sent = []
+    write = midi.write
+    midi.write = lambda data: (sent.append(bytes(data)), write(data))
+    assert PolyD_Cmd.syx2seq(polyd.get_pattern(2, 3)) == seqs[(2, 3)]
+    assert sent == []
+
+def test_unconfirmed_patterns_are_not_mirrored(polyd):
+    sysex = PolyD_Cmd.seq2syx(0, 1, 1, make_seq(50))
+    polyd.state.set_pattern(1, 1, sysex)
+    polyd.set_pattern(sysex, 1, 1)
+    assert polyd.state.get_pattern(1, 1) is None
+
+def test_diff_reads_patterns_changed_on_the_instrument(polyd, simulator):
+    seqs = { (1, 1): make_seq(50), (1, 2): make_seq(51) }
+    assert cli.restore_patterns(polyd, seqs) == []
+    # Edited on the front panel
+    simulator.patterns[(0, 1)] = PolyD_Cmd.extract_pattern_from_seq(make_seq(60))
+    assert cli.changed_slots(polyd, seqs) == [ (1, 2) ]
+    assert cli.restore_patterns(polyd, seqs, diff=True) == []
+    assert simulator.patterns[(0, 1)] == PolyD_Cmd.extract_pattern_from_seq(seqs[(1, 2)])
+
+def test_verify_compares_with_the_instrument(polyd, simulator, tmp_path):
+    filename = str(tmp_path / "backup.zip")
+    cli.save_all(polyd, filename)
+    simulator.patterns[(7, 7)] = PolyD_Cmd.extract_pattern_from_seq(make_seq(60))
+    step = { "op": "verify", "file": filename }
+    assert cli.verify(polyd, step, 1) == [ "b8p8" ]
+
+def test_reading_the_settings_keeps_the_patterns(polyd, simulator):
+    polyd.get_patterns([ (1, 1) ])
+    simulator.settings[PolyD_Config.ACCENT_VELOCITY] = 77
+    assert polyd.read_settings().accent_velocity == 77
+    assert polyd.state.get_pattern(1, 1) is not None
+    polyd.refresh()
+    assert polyd.state.get_pattern(1, 1) is None
+
+def test_dropped_replies_are_fetched_again(midi, simulator):
+    policies = PolyD_Policies(pattern_fetch=PolyD_Policy(timeout=0.05, retries=20, backoff=1.0))
+    polyd = PolyD(midi, PolyD_Pacer(), policies)
+    for bank in range(8):
+        simulator.patterns[(bank, 2)] = PolyD_Cmd.extract_pattern_from_seq(make_seq(40 + bank))
+    simulator.drop_rate = 0.3
+    slots = [ (bank, 3) for bank in range(1, 9) ]
+    patterns = polyd.get_patterns(slots, window=4)
+    assert { slot: PolyD_Cmd.syx2seq(sysex) for slot, sysex in patterns.items() } == \
+           { (bank, 3): make_seq(39 + bank) for bank in range(1, 9) }
+
+def test_failed_pipeline_leaves_no_request_behind(polyd, midi, simulator):
+    # The later replies are still on their way when the first one fails
+    simulator.jitter = 0.2
+    def set_pattern(bank, pattern, sysex):
+        raise PolyD_MidiException("Invalid pattern")
+    polyd.state.set_pattern = set_pattern
+    with pytest.raises(PolyD_MidiException):
+        polyd.get_patterns([ (1, pattern) for pattern in range(1, 9) ], window=4)
+    assert midi._MidiConnection__pending == []